@@ -68,9 +68,14 @@ setup(name='pypolibox',
     package_data = {'pypolibox': package_data_list},
     zip_safe=False,
     install_requires=install_requires,
+    extras_require={'numpy': ['numpy']},
     entry_points={
         'console_scripts':
             ['pypolibox=pypolibox.pypolibox:main',
-             'hlds-converter=pypolibox.hlds:main']
+             'hlds-converter=pypolibox.hlds:main',
+             'pypolibox-tccg-server=pypolibox.realization:main',
+             'pypolibox-build-catalog=pypolibox.catalog:main',
+             'pypolibox-build-term-index=pypolibox.database:main',
+             'pypolibox-compile-plans=pypolibox.plantable:main']
     }
 )
@@ -0,0 +1,628 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Arne Neumann <arne-neumann@web.de>
+
+"""
+The ``benchmark`` module contains functions that measure how fast the
+different stages of the pypolibox pipeline are. They use the predefined
+test queries from the ``debug`` module, so the results of different versions
+of pypolibox can be compared with each other. Run it from the command line
+to see the results::
+
+    python benchmark.py
+
+Besides the rule options, this measures the cost of building the sets of
+constituents in each step of the planner (cf. ``benchmark_planner_steps``)
+and how long it takes to plan a book with the search or with a compiled plan
+table (cf. ``benchmark_plan_table``).
+
+The scaling benchmark generates synthetic catalogs of different sizes and
+measures how long each stage of the pipeline takes for them::
+
+    python benchmark.py --scaling 1000 10000 100000 --max-results 10
+"""
+
+import argparse
+import bisect
+import itertools
+import math
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+from collections import Counter
+from time import time
+
+from nltk.featstruct import Feature, FeatStruct
+
+import database
+import rules as rules_module
+from database import Query, Results, Books, DB_FILE, BOOK_TABLE_NAME
+from facts import AllFacts
+from propositions import AllPropositions
+from messages import AllMessages
+from textplan import (TextPlans, TextPlanCache, generate_textplan,
+                      textplan_skeleton)
+from planrecords import PlanMessage, PlanConstituent
+from plantable import compile_plan_table
+from rules import Rules, ConstituentSet
+from util import freeze_all_messages, sql_array_to_list
+from debug import genallmessages, testqueries
+
+SCALING_SIZES = (1000, 10000) # default catalog sizes of ``benchmark_scaling``
+PIPELINE_STAGES = ('results', 'books', 'facts', 'propositions', 'messages',
+                   'textplans')
+
+
+def gen_message_sets(queries=testqueries):
+    """
+    generates the (frozen) messages of all books that are returned by the
+    given queries.
+
+    :type queries: ``list`` of ``list``s of ``str``
+    :rtype: ``list`` of ``list``s of ``Message``s
+    """
+    message_sets = []
+    for query in queries:
+        allmessages = genallmessages(query)
+        for book in allmessages.books:
+            message_sets.append(freeze_all_messages(book.messages.values()))
+    return message_sets
+
+
+def legacy_get_options(rule, messages):
+    """
+    re-implements ``Rule.get_options`` the way it worked before rule
+    conditions were compiled, i.e. all condition strings are parsed and
+    evaluated for each (nucleus, satellite) combination in a namespace that
+    is rebuilt from ``messages`` every time. Only used as a baseline for
+    ``benchmark_rule_options``.
+
+    :type rule: ``Rule``
+    :type messages: ``list`` of ``Message``s
+    :rtype: ``list`` of (``int``, ``ConstituentSet``, ``list``) tuples
+    """
+    nucleus_candidates = []
+    for message_prototype in rule.nucleus:
+        nucleus_candidates.extend(rule.find_message_candidates(messages,
+                                                        message_prototype))
+    satellite_candidates = []
+    for message_prototype in rule.satellite:
+        satellite_candidates.extend(rule.find_message_candidates(messages,
+                                                        message_prototype))
+
+    options = []
+    for combination in itertools.product(nucleus_candidates,
+                                         satellite_candidates):
+        namespace = {}
+        for message in messages:
+            if Feature("msgType") in message:
+                namespace[message[Feature("msgType")]] = message
+
+        results = []
+        for condition in rule.conditions:
+            try:
+                results.append(eval(condition, vars(rules_module), namespace))
+            except (NameError, AttributeError):
+                results.append(False)
+
+        if all(results):
+            (nucleus_name, nucleus), (sat_name, satellite) = combination
+            constituent_set = ConstituentSet(relType=rule.ruleType,
+                                             nucleus=nucleus,
+                                             satellite=satellite)
+            options.append( (rule.heuristic, constituent_set,
+                             [nucleus, satellite]) )
+    return options
+
+
+class SubsumptionCounter(object):
+    """
+    counts how often ``FeatStruct.subsumes`` is called (e.g. by
+    ``Rule.find_message_candidates``) while it is active::
+
+        with SubsumptionCounter() as counter:
+            rule.get_options(messages)
+        print counter.calls
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def __enter__(self):
+        self._subsumes = FeatStruct.subsumes
+        counter = self
+        def counting_subsumes(featstruct, other):
+            counter.calls += 1
+            return counter._subsumes(featstruct, other)
+        FeatStruct.subsumes = counting_subsumes
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        FeatStruct.subsumes = self._subsumes
+
+
+def benchmark_rule_options(queries=testqueries, repeat=3):
+    """
+    measures how many rule applications (options) per second can be found
+    for the messages of all books returned by the test queries, both with
+    the old condition handling (``legacy_get_options``) and with
+    ``Rule.get_options``. Each measurement is repeated and the fastest run
+    is reported, together with the number of subsumption checks needed to
+    find the candidate messages.
+
+    :type queries: ``list`` of ``list``s of ``str``
+    :type repeat: ``int``
+    :rtype: ``dict`` of (``str``, ``float``)
+    :return: maps 'before' and 'after' to the number of options per second
+    """
+    message_sets = gen_message_sets(queries)
+    rules = Rules().rules
+    implementations = [('before', legacy_get_options),
+                       ('after', lambda rule, messages: \
+                                    rule.get_options(messages))]
+
+    options_per_second = {}
+    for name, get_options in implementations:
+        fastest_run = None
+        for run in range(repeat):
+            num_of_options = 0
+            before = time()
+            for messages in message_sets:
+                for rule in rules:
+                    num_of_options += len(get_options(rule, messages))
+            time_diff = time() - before
+            if fastest_run is None or time_diff < fastest_run:
+                fastest_run = time_diff
+        options_per_second[name] = num_of_options / fastest_run
+
+        with SubsumptionCounter() as counter:
+            for messages in message_sets:
+                for rule in rules:
+                    get_options(rule, messages)
+
+        print "{0}: {1} options for {2} message sets in {3:.3f} seconds " \
+              "({4:.1f} options/sec, {5} subsumption checks)".format(name,
+                num_of_options, len(message_sets), fastest_run,
+                options_per_second[name], counter.calls)
+    return options_per_second
+
+
+def gen_plan_skeletons(queries=testqueries):
+    """
+    plans the books returned by the given queries and returns the skeleton
+    of each plan (cf. ``textplan.textplan_skeleton``), together with the
+    messages it was planned for.
+
+    :type queries: ``list`` of ``list``s of ``str``
+    :rtype: ``list`` of (``tuple``, ``list`` of ``Message``s) tuples
+    """
+    rules = Rules().rules
+    skeletons = []
+    for messages in gen_message_sets(queries):
+        plan = generate_textplan(messages, rules)
+        if plan is not None:
+            skeletons.append( (textplan_skeleton(plan["children"]),
+                               messages) )
+    return skeletons
+
+
+def replay_planner_steps(skeleton, leaves, combine):
+    """
+    rebuilds a plan bottom-up, step by step, with the same set operations
+    that the planner uses to get from one search state to the next (cf.
+    ``textplan.Agenda.apply``), including the frozen copy of each state
+    that is looked up in the search state memo.
+
+    :param skeleton: the skeleton of the plan
+    :type skeleton: ``tuple``
+    :param leaves: maps the message types of the plan to the messages (in
+    the representation used by the planner)
+    :type leaves: ``dict``
+    :param combine: combines a relation type, a nucleus and a satellite
+    into the representation of a constituent set
+    :type combine: ``function``
+    :rtype: ``int``
+    :return: the number of planner steps
+    """
+    state = set(leaves.values())
+    frozenset(state)
+    steps = 0
+    pending = [skeleton]
+    built = []
+    while pending: # post-order traversal of the skeleton
+        node = pending.pop()
+        if isinstance(node, tuple):
+            pending.extend( ([node], node[2], node[1]) )
+        elif isinstance(node, list): # all constituents of node[0] exist
+            satellite, nucleus = built.pop(), built.pop()
+            constituent_set = combine(node[0][0], nucleus, satellite)
+            state = state - set([nucleus, satellite])
+            state = state.union(set([constituent_set]))
+            frozenset(state)
+            built.append(constituent_set)
+            steps += 1
+        else:
+            built.append(leaves[node])
+    return steps
+
+
+def freeze_message(message):
+    """freezes a ``Message`` (and calculates its hash value)"""
+    message.freeze()
+    hash(message)
+    return message
+
+
+def combine_featstructs(rel_type, nucleus, satellite):
+    """
+    combines two constituents into a frozen ``ConstituentSet``, as the
+    planner did before it used planner records
+    """
+    constituent_set = ConstituentSet(relType=rel_type, nucleus=nucleus,
+                                     satellite=satellite)
+    constituent_set.freeze()
+    return constituent_set
+
+
+def benchmark_planner_steps(queries=testqueries, repeat=3):
+    """
+    measures how long it takes to build the sets of constituents (and their
+    frozen copies) of each planner step, i.e. to add a new constituent set
+    to a search state and remove its constituents. This is done for the
+    plans of all books returned by the test queries, both with
+    ``Message``s and ``ConstituentSet``s (which are rehashed whenever a
+    new ``ConstituentSet`` is added to a set) and with the (hash-consed)
+    planner records (cf. ``planrecords``).
+
+    :type queries: ``list`` of ``list``s of ``str``
+    :type repeat: ``int``
+    :rtype: ``dict`` of (``str``, ``float``)
+    :return: maps 'featstructs' and 'records' to the number of
+    microseconds per planner step
+    """
+    skeletons = gen_plan_skeletons(queries)
+    implementations = [('featstructs', freeze_message, combine_featstructs),
+                       ('records', PlanMessage, PlanConstituent)]
+
+    microseconds_per_step = {}
+    for name, to_leaf, combine in implementations:
+        fastest_run = None
+        for run in range(repeat):
+            # plans must be rebuilt from fresh copies of the messages,
+            # since frozen ``FeatStruct``s remember their hash value.
+            # the messages themselves are converted before measuring.
+            leaf_sets = [dict((message[Feature("msgType")],
+                               to_leaf(message.copy()))
+                              for message in messages)
+                         for (skeleton, messages) in skeletons]
+            before = time()
+            num_of_steps = 0
+            for (skeleton, messages), leaves in zip(skeletons, leaf_sets):
+                num_of_steps += replay_planner_steps(skeleton, leaves,
+                                                     combine)
+            time_diff = time() - before
+            if fastest_run is None or time_diff < fastest_run:
+                fastest_run = time_diff
+        microseconds_per_step[name] = fastest_run / num_of_steps * 1e6
+        print "{0}: {1} planner steps for {2} plans in {3:.3f} seconds " \
+              "({4:.1f} microseconds/step)".format(name, num_of_steps,
+                len(skeletons), fastest_run, microseconds_per_step[name])
+    return microseconds_per_step
+
+
+def benchmark_plan_table(queries=testqueries, repeat=3):
+    """
+    measures how long it takes to generate the text plans of all books
+    returned by the test queries, with a best-first search (and a new
+    search state memo for each book) and with a plan table (cf.
+    ``plantable``).
+
+    :type queries: ``list`` of ``list``s of ``str``
+    :type repeat: ``int``
+    :rtype: ``dict`` of (``str``, ``float``)
+    :return: maps 'search' and 'table' to the number of milliseconds per
+    book
+    """
+    message_sets = [list(set(messages))
+                    for messages in gen_message_sets(queries)]
+    rules = Rules().rules
+    before = time()
+    table = compile_plan_table(rules)
+    print "compiled {0} signatures in {1:.3f} seconds".format(len(table),
+                                                            time() - before)
+    implementations = [('search', None), ('table', table)]
+
+    milliseconds_per_book = {}
+    for name, plan_table in implementations:
+        fastest_run = None
+        for run in range(repeat):
+            before = time()
+            for messages in message_sets:
+                generate_textplan(messages, rules, plan_table=plan_table)
+            time_diff = time() - before
+            if fastest_run is None or time_diff < fastest_run:
+                fastest_run = time_diff
+        milliseconds_per_book[name] = fastest_run / len(message_sets) * 1e3
+        print "{0}: {1} books in {2:.3f} seconds ({3:.3f} ms/book)".format(
+            name, len(message_sets), fastest_run,
+            milliseconds_per_book[name])
+    return milliseconds_per_book
+
+
+class CatalogDistributions(object):
+    """
+    the distributions of the values of each column of a book database (e.g.
+    how often each keyword occurs and how many keywords a book has), which
+    ``generate_catalog`` samples from.
+    """
+    def __init__(self, db_file=DB_FILE):
+        """
+        :param db_file: the database whose distributions are used
+        :type db_file: ``str``
+        """
+        conn = sqlite3.connect(db_file)
+        self.create_table = conn.execute("SELECT sql FROM sqlite_master "
+            "WHERE type = 'table' AND name = ?", (BOOK_TABLE_NAME,)
+            ).fetchone()[0]
+        rows = conn.execute("SELECT authors, keywords, plang, year, pages, "
+            "lang, target, exercises, examples FROM {0} ORDER BY "
+            "rowid".format(BOOK_TABLE_NAME)).fetchall()
+        conn.close()
+
+        self.counts = {} # how many values a book has in an 'array' column
+        self.values = {} # how often each value occurs in a column
+        self.choices = {} # the same, prepared for ``weighted_choice``
+        for index, column in enumerate(('authors', 'keywords', 'plang')):
+            arrays = [sql_array_to_list(row[index]) for row in rows]
+            self.counts[column] = [len(array) for array in arrays]
+            self.values[column] = Counter(value for array in arrays
+                                          for value in array)
+        for index, column in enumerate(('lang', 'target', 'exercises',
+                                        'examples'), 5):
+            self.values[column] = Counter(row[index] for row in rows)
+        for column, counter in self.values.iteritems():
+            self.choices[column] = cumulative_weights(counter)
+        self.years = [row[3] for row in rows]
+        log_pages = [math.log(row[4]) for row in rows]
+        self.log_pages_mean = sum(log_pages) / len(log_pages)
+        self.log_pages_sd = math.sqrt(sum((log_page - self.log_pages_mean)**2
+            for log_page in log_pages) / len(log_pages))
+
+        names = [author.split() for author in self.values['authors']]
+        self.first_names = sorted(set(name[0] for name in names if name))
+        self.last_names = sorted(set(name[-1] for name in names if name))
+
+
+def cumulative_weights(counter):
+    """
+    returns the (sorted) values of a ``Counter`` and their cumulated counts,
+    which ``weighted_choice`` samples from.
+
+    :type counter: ``collections.Counter``
+    :rtype: ``tuple`` of (``list``, ``list`` of ``float``)
+    """
+    values = sorted(counter)
+    cumulated = []
+    total = 0
+    for value in values:
+        total += counter[value]
+        cumulated.append(total)
+    return values, cumulated
+
+
+def weighted_choice(rng, choices):
+    """
+    chooses a value of a ``Counter`` (proportionally to its count).
+
+    :type rng: ``random.Random``
+    :param choices: the values of the ``Counter`` and their cumulated
+    counts (cf. ``cumulative_weights``)
+    :type choices: ``tuple`` of (``list``, ``list`` of ``float``)
+    """
+    values, cumulated = choices
+    index = bisect.bisect(cumulated, rng.random() * cumulated[-1])
+    return values[min(index, len(values) - 1)]
+
+
+def generate_catalog(db_file, size, seed=0, distributions=None):
+    """
+    generates a database with ``size`` synthetic books, which has the same
+    schema as the pypolibox database (incl. the term index, cf.
+    ``database.build_term_index``). The same size and seed always result
+    in the same catalog.
+
+    Keywords, programming languages, languages, target groups, exercises
+    and code examples are sampled from their distribution in the pypolibox
+    database, as is the number of keywords/programming languages/authors of
+    each book. Authors are combinations of the first and last names found
+    in the database (some authors write many books, most only a few, i.e.
+    their popularity follows Zipf's law). Publication years are jittered
+    by up to 5 years, page counts follow the log-normal distribution of the
+    original page counts.
+
+    :param db_file: path of the database to create (will be overwritten)
+    :type db_file: ``str``
+    :type size: ``int``
+    :type seed: ``int``
+    :param distributions: the distributions to sample from (default: those
+    of the pypolibox database)
+    :type distributions: ``CatalogDistributions`` or ``NoneType``
+    """
+    if distributions is None:
+        distributions = CatalogDistributions()
+    rng = random.Random(seed)
+    authors = [u"{0} {1}".format(first_name, last_name)
+               for first_name in distributions.first_names
+               for last_name in distributions.last_names]
+    rng.shuffle(authors)
+    zipf_weights = cumulative_weights(Counter(dict((author, 1.0 / rank)
+        for rank, author in enumerate(authors, 1))))
+
+    def sample_array(column):
+        count = rng.choice(distributions.counts[column])
+        values = set()
+        if column == 'authors':
+            while len(values) < min(count, len(authors)):
+                values.add(weighted_choice(rng, zipf_weights))
+        else:
+            candidates = distributions.choices[column]
+            while len(values) < min(count, len(candidates[0])):
+                values.add(weighted_choice(rng, candidates))
+        return u"".join(u"[{0}]".format(value) for value in sorted(values))
+
+    books = []
+    for book_id in xrange(size):
+        keywords = sample_array('keywords')
+        title = u"{0} {1}".format(
+            rng.choice([u"Introduction to", u"Foundations of", u"Advances in",
+                        u"Handbook of", u"Topics in"]),
+            u", ".join(sql_array_to_list(keywords)[:2]) or u"Linguistics")
+        books.append( (title,
+            rng.choice(distributions.years) + rng.randint(-5, 5),
+            sample_array('authors'), keywords,
+            weighted_choice(rng, distributions.choices['lang']),
+            sample_array('plang'),
+            int(round(rng.lognormvariate(distributions.log_pages_mean,
+                                         distributions.log_pages_sd))),
+            weighted_choice(rng, distributions.choices['target']),
+            weighted_choice(rng, distributions.choices['exercises']),
+            weighted_choice(rng, distributions.choices['examples'])) )
+
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    conn = sqlite3.connect(db_file)
+    conn.execute(distributions.create_table)
+    conn.executemany("INSERT INTO {0} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                     "?)".format(BOOK_TABLE_NAME), books)
+    conn.commit()
+    conn.close()
+    database.build_term_index(db_file)
+
+
+def peak_rss():
+    """
+    :rtype: ``float``
+    :return: the max. amount of memory (resident set size) this process has
+    used so far (in MiB)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def benchmark_pipeline(queries=testqueries, max_results=None):
+    """
+    runs all stages of the pypolibox pipeline (except for the realization)
+    for each query on the current database and measures how long each
+    stage takes.
+
+    :type queries: ``list`` of ``list``s of ``str``
+    :param max_results: if given, only the best ``max_results`` books of
+    each query are processed (cf. ``--max-results``)
+    :type max_results: ``int`` or ``NoneType``
+    :rtype: (``dict``, ``int``)
+    :return: the number of seconds spent in each stage (cf.
+    ``PIPELINE_STAGES``) and the number of books processed
+    """
+    stage_times = dict((stage, 0.0) for stage in PIPELINE_STAGES)
+    num_of_books = 0
+    plan_cache = TextPlanCache()
+    for query in queries:
+        if max_results is not None:
+            query = query + ["--max-results", str(max_results)]
+        query = Query(query)
+        stages = [('results', Results),
+                  ('books', Books),
+                  ('facts', AllFacts),
+                  ('propositions', AllPropositions),
+                  ('messages', AllMessages),
+                  ('textplans', lambda allmessages: \
+                        TextPlans(allmessages, plan_cache=plan_cache))]
+        output = query
+        for stage, process in stages:
+            before = time()
+            output = process(output)
+            stage_times[stage] += time() - before
+            if stage == 'books':
+                num_of_books += len(output.books)
+    return stage_times, num_of_books
+
+
+def benchmark_scaling(sizes=SCALING_SIZES, queries=testqueries,
+                      max_results=None, seed=0):
+    """
+    generates synthetic catalogs of different sizes (cf.
+    ``generate_catalog``), replays the queries against each of them and
+    reports the latency of each pipeline stage (per query) and the peak
+    memory usage (which can only grow, so the sizes should be ascending).
+
+    :type sizes: ``list`` of ``int``s
+    :type queries: ``list`` of ``list``s of ``str``
+    :param max_results: if given, only the best ``max_results`` books of
+    each query are processed
+    :type max_results: ``int`` or ``NoneType``
+    :type seed: ``int``
+    :rtype: ``list`` of ``dict``s
+    :return: the measurements for each catalog size
+    """
+    distributions = CatalogDistributions()
+    directory = tempfile.mkdtemp(prefix='pypolibox-benchmark-')
+    measurements = []
+    print "{0:>8} {1:>8} {2}   {3:>9} {4:>9}".format("catalog", "books",
+        " ".join("{0:>12}".format(stage) for stage in PIPELINE_STAGES),
+        "total", "peak RSS")
+    try:
+        for size in sizes:
+            db_file = os.path.join(directory, "books-{0}.sqlite".format(size))
+            generate_catalog(db_file, size, seed, distributions)
+            database.CONNECTIONS.reset(db_file)
+            stage_times, num_of_books = benchmark_pipeline(queries,
+                                                           max_results)
+            measurement = {'size': size, 'books': num_of_books,
+                           'peak_rss': peak_rss()}
+            for stage in PIPELINE_STAGES:
+                measurement[stage] = stage_times[stage] / len(queries)
+            measurements.append(measurement)
+            print "{0:>8} {1:>8} {2}   {3:>8.3f}s {4:>6.0f}MiB".format(size,
+                num_of_books, " ".join("{0:>11.4f}s".format(measurement[stage])
+                                       for stage in PIPELINE_STAGES),
+                sum(measurement[stage] for stage in PIPELINE_STAGES),
+                measurement['peak_rss'])
+    finally:
+        database.CONNECTIONS.reset(DB_FILE)
+        shutil.rmtree(directory)
+    return measurements
+
+
+def main():
+    """run the benchmarks selected on the command line"""
+    parser = argparse.ArgumentParser(description='benchmark pypolibox')
+    parser.add_argument("-n", "--repeat", type=int, default=3,
+        help="repeat each measurement N times and report the fastest run")
+    parser.add_argument("--scaling", type=int, nargs='*', metavar="SIZE",
+        help=("measure the latency of each pipeline stage on synthetic "
+              "catalogs of the given sizes. default sizes: {0}".format(
+                " ".join(str(size) for size in SCALING_SIZES))))
+    parser.add_argument("--max-results", type=int,
+        help="only process the best MAX_RESULTS books of each query")
+    parser.add_argument("--seed", type=int, default=0,
+        help="seed of the synthetic catalogs. default: 0")
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.scaling is None:
+        print "### Rule options (over debug.testqueries) ###\n"
+        benchmark_rule_options(repeat=args.repeat)
+        print "\n### Set building per planner step " \
+              "(over debug.testqueries) ###\n"
+        benchmark_planner_steps(repeat=args.repeat)
+        print "\n### Plan table vs. search (over debug.testqueries) ###\n"
+        benchmark_plan_table(repeat=args.repeat)
+    else:
+        print "### Pipeline latency per query (over debug.testqueries) ###\n"
+        benchmark_scaling(args.scaling or SCALING_SIZES,
+                          max_results=args.max_results, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
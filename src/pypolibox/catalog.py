@@ -0,0 +1,667 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Arne Neumann <arne-neumann@web.de>
+
+"""
+The ``catalog`` module contains an alternative to querying the sqlite
+database for each ``Query``: the books table is loaded into memory once
+(as NumPy arrays) and all the criteria a ``Query`` supports are evaluated
+for all books at once. ``CatalogResults`` can be used instead of
+``database.Results`` and returns exactly the same results::
+
+    catalog = load_catalog()
+    books = Books(CatalogResults(Query(["-k", "semantics"]), catalog))
+
+The catalog can also be compiled into a binary file (cf.
+``write_catalog_file`` or the ``pypolibox-build-catalog`` command), which
+is memory-mapped by ``MappedCatalog``. Opening such a file only reads its
+header, regardless of the size of the catalog, and all processes that
+use the same file share its pages::
+
+    catalog = load_catalog_file("books.catalog")
+
+This module requires NumPy, which is an optional dependency of pypolibox.
+"""
+
+import re
+import sys
+import json
+import mmap
+import struct
+import argparse
+import sqlite3
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import util
+from database import (Results, DB_FILE, BOOK_TABLE_NAME, TERM_COLUMNS,
+                      CONNECTIONS, has_term_index, file_version)
+
+
+class Catalog(object):
+    """
+    a ``Catalog`` stores the books table of the database in columns:
+    numerical columns (pages, target etc.) as NumPy arrays, the languages as
+    an array of integer codes and the 'array' columns (keywords, plang,
+    authors) as an inverted index, which maps each term to the (sorted)
+    positions of the books that contain it.
+    """
+    def __init__(self, db_file=DB_FILE):
+        """
+        loads the books table from an sqlite database.
+
+        :param db_file: path to the sqlite database
+        :type db_file: ``str``
+        """
+        if numpy is None:
+            raise ImportError("the catalog backend requires NumPy")
+        self.db_file = db_file
+        if db_file == CONNECTIONS.db_file:
+            conn = CONNECTIONS.connection()
+            self.db_columns = CONNECTIONS.get_table_header(BOOK_TABLE_NAME)
+        else:
+            conn = sqlite3.connect(db_file)
+            self.db_columns = {}
+            for column in conn.execute("PRAGMA table_info({0})".format(
+                                                        BOOK_TABLE_NAME)):
+                self.db_columns[column[1].encode('UTF8')] = column[0]
+
+        # the original rows (in the order of the database), which are
+        # returned as query results
+        self.rows = conn.execute("SELECT * FROM {0} ORDER BY rowid".format(
+                                                BOOK_TABLE_NAME)).fetchall()
+        self.size = len(self.rows)
+        self.use_term_index = has_term_index(db_file)
+
+        # NULL values are stored as NaN, so that they never match
+        for column in ('year', 'pages', 'target', 'exercises', 'examples'):
+            setattr(self, column, self.__numeric_column(column))
+
+        self.languages = {}
+        lang_codes = []
+        for row in self.rows:
+            lang = row[self.db_columns['lang']]
+            lang_codes.append(self.languages.setdefault(lang,
+                                                        len(self.languages)))
+        self.lang = numpy.array(lang_codes, dtype=numpy.int32)
+
+        self.arrays = {} # the original 'array' strings of each column
+        # maps the distinct terms of each column to the (sorted) positions
+        # of the books that contain them
+        self.terms = {}
+        for column in TERM_COLUMNS:
+            self.arrays[column] = [row[self.db_columns[column]]
+                                   for row in self.rows]
+            term_positions = {}
+            for position, sql_array in enumerate(self.arrays[column]):
+                for term in util.sql_array_to_set(sql_array or u''):
+                    term_positions.setdefault(term, []).append(position)
+            self.terms[column] = dict(
+                (term, numpy.array(positions, dtype=numpy.int32))
+                for term, positions in term_positions.iteritems())
+
+    def __numeric_column(self, column):
+        index = self.db_columns[column]
+        return numpy.array([numpy.nan if row[index] is None else row[index]
+                            for row in self.rows], dtype=numpy.float64)
+
+    def term_mask(self, column, terms):
+        """
+        :param column: an 'array' column, e.g. 'keywords'
+        :type column: ``str``
+        :param terms: terms of that column
+        :type terms: iterable of ``unicode``
+        :rtype: ``numpy.ndarray`` of ``bool``
+        :return: marks all books that contain at least one of the terms
+        """
+        mask = numpy.zeros(self.size, dtype=bool)
+        for term in terms:
+            if term in self.terms[column]:
+                mask[self.terms[column][term]] = True
+        return mask
+
+    def substring_mask(self, column, substring):
+        """
+        finds the books that an SQL ``LIKE '%substring%'`` query would return
+        (cf. ``Query.__substring_query``).
+
+        :type column: ``str``
+        :type substring: ``str`` or ``unicode``
+        :rtype: ``numpy.ndarray`` of ``bool``
+        """
+        pattern = like_regex(u"%{0}%".format(util.ensure_unicode(substring)))
+        if column in TERM_COLUMNS and self.use_term_index and substring \
+           and '[' not in substring and ']' not in substring:
+            return self.term_mask(column, [term for term in self.terms[column]
+                                           if pattern.match(ascii_lower(term))])
+        return numpy.array([value is not None and
+                            pattern.match(ascii_lower(value)) is not None
+                            for value in self.arrays[column]], dtype=bool)
+
+    def pages_mask(self, length_category):
+        """
+        :param length_category: 0 (short), 1 (medium length) or 2 (long)
+        :type length_category: ``int``
+        :rtype: ``numpy.ndarray`` of ``bool``
+        """
+        if length_category == 0:
+            return self.pages < 300
+        if length_category == 1:
+            return (self.pages >= 300) & (self.pages < 600)
+        if length_category == 2:
+            return self.pages >= 600
+
+    def lang_mask(self, language):
+        """
+        :type language: ``str`` or ``unicode``
+        :rtype: ``numpy.ndarray`` of ``bool``
+        """
+        code = self.languages.get(util.ensure_unicode(language), -1)
+        return self.lang == code
+
+    def query_masks(self, query_args):
+        """
+        evaluates all criteria of a query for all books.
+
+        :type query_args: ``argparse.Namespace``
+        :rtype: ``list`` of (``numpy.ndarray``, ``numpy.ndarray``) tuples
+        :return: for each criterion, a mask of the books it selects (cf.
+        ``Query.queries``) and a mask of the books that match it exactly
+        (cf. ``Query.match_queries``)
+        """
+        masks = []
+        for column, values in (("keywords", query_args.keywords),
+                               ("plang", query_args.proglang)):
+            for value in values or []:
+                masks.append( (self.substring_mask(column, value),
+                    self.term_mask(column, [util.ensure_unicode(value)])) )
+        if query_args.language is not None:
+            lang_mask = self.lang_mask(query_args.language)
+            masks.append( (lang_mask, lang_mask) )
+        if query_args.pagerange is not None:
+            pages_mask = self.pages_mask(query_args.pagerange)
+            masks.append( (pages_mask, pages_mask) )
+        for column, value in (("target", query_args.target),
+                              ("exercises", query_args.exercises),
+                              ("examples", query_args.codeexamples)):
+            if value is not None:
+                equals_mask = getattr(self, column) == value
+                masks.append( (equals_mask, equals_mask) )
+        return masks
+
+    def score(self, query_args):
+        """
+        counts for each book how many criteria of a query select it and
+        how many it matches exactly.
+
+        :type query_args: ``argparse.Namespace``
+        :rtype: (``int``, ``numpy.ndarray``, ``numpy.ndarray``)
+        :return: the number of criteria, the number of criteria that select
+        each book ('matched_queries') and the number of criteria each book
+        matches exactly ('book_matches')
+        """
+        matched_queries = numpy.zeros(self.size, dtype=numpy.int32)
+        book_matches = numpy.zeros(self.size, dtype=numpy.int32)
+        masks = self.query_masks(query_args)
+        for selects, matches in masks:
+            matched_queries += selects
+            book_matches += matches
+        return len(masks), matched_queries, book_matches
+
+
+class CatalogResults(Results):
+    """
+    a drop-in replacement for ``database.Results``, which evaluates a
+    ``Query`` on a ``Catalog`` instead of sending it to the database.
+    """
+    def __init__(self, query, catalog=None):
+        """
+        :type query: instance of class ``Query``
+        :param catalog: the catalog to search (default: the catalog of the
+        database, cf. ``load_catalog``)
+        :type catalog: ``Catalog`` or ``NoneType``
+        """
+        if catalog is None:
+            catalog = load_catalog()
+        self.and_query_results = []
+        self.or_query_results = []
+        self.query_results = []
+        self.query_args = query.query_args
+        self.and_query = query.and_query
+        self.or_query = query.or_query
+        self.minresults = query.minresults
+        self.possible_matches = 0
+
+        self.db_columns = dict(catalog.db_columns)
+        self.db_columns['matched_queries'] = len(self.db_columns)
+        self.db_columns['book_matches'] = len(self.db_columns)
+
+        num_of_queries, matched_queries, book_matches = \
+            catalog.score(self.query_args)
+        max_results = self.query_args.max_results
+
+        and_positions = numpy.flatnonzero(matched_queries == num_of_queries)
+        if len(and_positions) >= self.minresults:
+            self.and_query_results = self.__rows(catalog, and_positions[
+                :max_results], matched_queries, book_matches)
+            self.possible_matches = self.get_number_of_possible_matches()
+            self.query_results = self.and_query_results
+            self.query_type = 'and'
+        else:
+            self.and_query_results = self.__rows(catalog, and_positions,
+                                                 matched_queries, book_matches)
+            if num_of_queries > 0:
+                or_positions = numpy.flatnonzero(matched_queries > 0)
+            else:
+                or_positions = numpy.arange(catalog.size)
+            if max_results is not None:
+                # the books with the most matches (and among those, the
+                # last ones) are the best, cf. ``Books.get_book_ranks``
+                best = numpy.lexsort( (-or_positions,
+                                       -book_matches[or_positions]) )
+                or_positions = numpy.sort(or_positions[best[:max_results]])
+            self.or_query_results = self.__rows(catalog, or_positions,
+                                                matched_queries, book_matches)
+            self.possible_matches = self.get_number_of_possible_matches()
+            self.query_results = self.or_query_results
+            self.query_type = 'or'
+
+    def __rows(self, catalog, positions, matched_queries, book_matches):
+        """
+        returns the given books in the same format as the database query
+        (cf. ``Query.scoring_query``).
+        """
+        return [catalog.rows[position] + (int(matched_queries[position]),
+                                          int(book_matches[position]))
+                for position in positions]
+
+
+CATALOG_FILE_MAGIC = 'PYPOLCAT' # the first bytes of a catalog file
+CATALOG_FILE_VERSION = 1 # incremented whenever the file format changes
+# magic, format version and length of the (JSON) header
+CATALOG_FILE_PREAMBLE = struct.Struct('<8sII')
+
+
+class StringTable(object):
+    """
+    a read-only sequence of (unicode) strings, which are stored as one
+    UTF-8 encoded buffer and the offsets of the strings in it.
+    """
+    def __init__(self, offsets, data, nulls=None):
+        """
+        :param offsets: the start offset of each string (and the end offset
+        of the last one)
+        :type offsets: ``numpy.ndarray`` of ``int64``
+        :param data: the UTF-8 encoded strings
+        :type data: ``buffer`` or ``mmap.mmap``
+        :param nulls: marks the strings that are NULL (i.e. None)
+        :type nulls: ``numpy.ndarray`` of ``bool`` or ``NoneType``
+        """
+        self.offsets = offsets
+        self.data = data
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if self.nulls is not None and self.nulls[index]:
+            return None
+        start, end = self.offsets[index], self.offsets[index+1]
+        return self.data[start:end].decode('UTF8')
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+
+class TermIndex(object):
+    """
+    the inverted index of one 'array' column of a ``MappedCatalog``. It
+    behaves like the ``dict`` used by ``Catalog.terms``, but the vocabulary
+    is only decoded when it is first needed and the positions of the books
+    are views of the memory-mapped postings.
+    """
+    def __init__(self, terms, postings_offsets, postings):
+        """
+        :type terms: ``StringTable``
+        :type postings_offsets: ``numpy.ndarray`` of ``int64``
+        :type postings: ``numpy.ndarray`` of ``int32``
+        """
+        self._terms = terms
+        self._postings_offsets = postings_offsets
+        self._postings = postings
+        self._term_ids = None
+
+    def __term_ids(self):
+        if self._term_ids is None:
+            self._term_ids = dict((term, term_id)
+                                  for term_id, term in enumerate(self._terms))
+        return self._term_ids
+
+    def __contains__(self, term):
+        return term in self.__term_ids()
+
+    def __getitem__(self, term):
+        term_id = self.__term_ids()[term]
+        return self._postings[self._postings_offsets[term_id]:
+                              self._postings_offsets[term_id+1]]
+
+    def __iter__(self):
+        return iter(self.__term_ids())
+
+    def __len__(self):
+        return len(self._terms)
+
+
+class RowTable(object):
+    """
+    a read-only sequence of the rows of a ``MappedCatalog``, which returns
+    them in the same format as the sqlite database (i.e. as tuples).
+    """
+    def __init__(self, columns):
+        """
+        :param columns: the values of each column (in database order)
+        :type columns: ``list`` of ``StringTable``s or ``IntegerColumn``s
+        """
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, position):
+        return tuple(column[position] for column in self.columns)
+
+
+class IntegerColumn(object):
+    """
+    a read-only sequence of integers (or None), stored as ``float64`` so
+    that NULL values can be represented as NaN.
+    """
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        value = self.values[index]
+        return None if numpy.isnan(value) else int(value)
+
+
+class MappedCatalog(Catalog):
+    """
+    a ``Catalog`` that is stored in a memory-mapped file (cf.
+    ``write_catalog_file``). All columns are (zero-copy) views of the file,
+    so creating a ``MappedCatalog`` doesn't depend on the number of books.
+    """
+    def __init__(self, catalog_file):
+        """
+        :param catalog_file: path to a file written by ``write_catalog_file``
+        :type catalog_file: ``str``
+        """
+        if numpy is None:
+            raise ImportError("the catalog backend requires NumPy")
+        self.catalog_file = catalog_file
+        with open(catalog_file, 'rb') as catalog:
+            self._mmap = mmap.mmap(catalog.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+
+        magic, version, header_length = CATALOG_FILE_PREAMBLE.unpack_from(
+                                                                self._mmap)
+        if magic != CATALOG_FILE_MAGIC:
+            raise ValueError("{0} is not a pypolibox catalog file".format(
+                catalog_file))
+        if version != CATALOG_FILE_VERSION:
+            raise ValueError("{0} has version {1} of the catalog file "
+                "format, but version {2} is needed. Please rebuild it with "
+                "pypolibox-build-catalog.".format(catalog_file, version,
+                                                  CATALOG_FILE_VERSION))
+        header = json.loads(self._mmap[CATALOG_FILE_PREAMBLE.size:
+                                       CATALOG_FILE_PREAMBLE.size +
+                                       header_length])
+        # the sections start right after the (padded) header
+        self._data_start = CATALOG_FILE_PREAMBLE.size + header_length
+        self._sections = header['sections']
+        self.db_file = header['db_file']
+        self.size = header['size']
+        self.use_term_index = header['use_term_index']
+        self.db_columns = dict((name.encode('UTF8'), index) for index, name
+                               in enumerate(header['columns']))
+
+        row_columns = []
+        for name, kind in zip(header['columns'], header['kinds']):
+            if kind == 'integer':
+                column = IntegerColumn(self.__array('values:' + name))
+                if name in ('year', 'pages', 'target', 'exercises',
+                            'examples'):
+                    setattr(self, name, column.values)
+            else:
+                column = self.__string_table(name)
+            row_columns.append(column)
+        self.rows = RowTable(row_columns)
+
+        self.lang = self.__array('lang_codes')
+        self.languages = dict((language, code) for code, language
+                              in enumerate(self.__string_table('languages')))
+        self.arrays = {}
+        self.terms = {}
+        for column in TERM_COLUMNS:
+            self.arrays[column] = row_columns[self.db_columns[column]]
+            self.terms[column] = TermIndex(
+                self.__string_table('terms:' + column),
+                self.__array('postings_offsets:' + column),
+                self.__array('postings:' + column))
+
+    def __array(self, section):
+        """returns a section of the file as a (read-only) NumPy array"""
+        offset, dtype, count = self._sections[section]
+        return numpy.frombuffer(self._mmap, dtype=numpy.dtype(str(dtype)),
+                                count=count, offset=self._data_start + offset)
+
+    def __string_table(self, name):
+        """returns the strings stored in the sections of the given name"""
+        offset, dtype, length = self._sections['data:' + name]
+        nulls = None
+        if 'nulls:' + name in self._sections:
+            nulls = self.__array('nulls:' + name)
+        return StringTable(self.__array('offsets:' + name),
+                           buffer(self._mmap, self._data_start + offset,
+                                  length), nulls)
+
+
+def write_catalog_file(catalog_file, db_file=DB_FILE):
+    """
+    compiles the books table of an sqlite database into a binary catalog
+    file, which can be memory-mapped by ``MappedCatalog``.
+
+    The file starts with a magic string, the version of the file format and
+    a JSON header, which lists the offset, data type and length of each
+    section of the file. Sections are aligned to 8 bytes and contain
+    little-endian arrays: integer columns (as ``float64``, NULL = NaN),
+    string columns (UTF-8 data and ``int64`` offsets), the language code of
+    each book and, for each 'array' column, its vocabulary and the sorted
+    positions of the books that contain each term (posting lists).
+
+    :param catalog_file: path of the catalog file to write
+    :type catalog_file: ``str``
+    :param db_file: path to the sqlite database
+    :type db_file: ``str``
+    """
+    catalog = Catalog(db_file)
+    columns = sorted(catalog.db_columns, key=catalog.db_columns.get)
+    sections = [] # (name, dtype, count, bytes)
+
+    def add_array(name, array):
+        sections.append( (name, array.dtype.str, len(array),
+                          array.tostring()) )
+
+    def add_strings(name, strings):
+        encoded = [None if string is None else string.encode('UTF8')
+                   for string in strings]
+        lengths = [0 if string is None else len(string) for string in encoded]
+        offsets = numpy.zeros(len(encoded) + 1, dtype='<i8')
+        offsets[1:] = numpy.cumsum(lengths)
+        data = ''.join(string for string in encoded if string is not None)
+        sections.append( ('data:' + name, '|u1', len(data), data) )
+        add_array('offsets:' + name, offsets)
+        if None in encoded:
+            add_array('nulls:' + name, numpy.array([string is None
+                                                    for string in encoded]))
+
+    kinds = []
+    for index, name in enumerate(columns):
+        values = [row[index] for row in catalog.rows]
+        non_null = [value for value in values if value is not None]
+        if all(isinstance(value, (int, long)) for value in non_null):
+            kinds.append('integer')
+            add_array('values:' + name, numpy.array(
+                [numpy.nan if value is None else value for value in values],
+                dtype='<f8'))
+        elif all(isinstance(value, unicode) for value in non_null):
+            kinds.append('text')
+            add_strings(name, values)
+        else:
+            raise ValueError("column {0} contains values of different "
+                             "types, which the catalog file can't "
+                             "store".format(name))
+
+    add_array('lang_codes', catalog.lang.astype('<i4'))
+    add_strings('languages', sorted(catalog.languages,
+                                    key=catalog.languages.get))
+    for column in TERM_COLUMNS:
+        terms = sorted(catalog.terms[column])
+        postings = [catalog.terms[column][term] for term in terms]
+        postings_offsets = numpy.zeros(len(terms) + 1, dtype='<i8')
+        postings_offsets[1:] = numpy.cumsum([len(positions)
+                                             for positions in postings])
+        add_strings('terms:' + column, terms)
+        add_array('postings_offsets:' + column, postings_offsets)
+        add_array('postings:' + column, numpy.concatenate(
+            postings + [numpy.zeros(0, dtype=numpy.int32)]).astype('<i4'))
+
+    header = {'db_file': db_file, 'size': catalog.size, 'columns': columns,
+              'kinds': kinds, 'use_term_index': catalog.use_term_index,
+              'sections': {}}
+    # section offsets are relative to the end of the header
+    offset = 0
+    for name, dtype, count, data in sections:
+        header['sections'][name] = [offset, dtype, count]
+        offset = __align(offset + len(data))
+    header_json = json.dumps(header, sort_keys=True)
+    # the header is padded, so that the first section is aligned, too
+    header_json += ' ' * (__align(CATALOG_FILE_PREAMBLE.size +
+                                  len(header_json)) -
+                          CATALOG_FILE_PREAMBLE.size - len(header_json))
+
+    with open(catalog_file, 'wb') as output:
+        output.write(CATALOG_FILE_PREAMBLE.pack(CATALOG_FILE_MAGIC,
+                     CATALOG_FILE_VERSION, len(header_json)))
+        output.write(header_json)
+        data_start = output.tell()
+        for name, dtype, count, data in sections:
+            section_offset = data_start + header['sections'][name][0]
+            output.write('\0' * (section_offset - output.tell()))
+            output.write(data)
+
+
+def __align(offset, alignment=8):
+    """rounds an offset up to the next multiple of ``alignment``"""
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def ascii_lower(string):
+    """
+    converts only the ASCII characters of a string to lower case (that's
+    how sqlite compares strings in ``LIKE`` queries).
+
+    :type string: ``unicode``
+    :rtype: ``unicode``
+    """
+    return string.translate(ASCII_LOWER)
+
+ASCII_LOWER = dict((ord(char), ord(char.lower()))
+                   for char in u"ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+
+def like_regex(pattern):
+    """
+    converts the pattern of an SQL ``LIKE`` query into a regular expression
+    (which must be matched against ``ascii_lower``ed strings).
+
+    :type pattern: ``unicode``
+    :rtype: compiled regular expression
+    """
+    regex = []
+    for char in ascii_lower(pattern):
+        if char == u'%':
+            regex.append(u'.*')
+        elif char == u'_':
+            regex.append(u'.')
+        else:
+            regex.append(re.escape(char))
+    return re.compile(u''.join(regex) + u'\\Z', re.DOTALL | re.UNICODE)
+
+
+__catalogs = {} # caches the catalogs loaded by ``load_catalog``
+
+def load_catalog(db_file=None):
+    """
+    loads the books table of a database into a ``Catalog`` (only once per
+    process, unless the database file is modified).
+
+    :param db_file: path to the database (default: the database that is
+    currently queried, cf. ``database.CONNECTIONS``)
+    :type db_file: ``str`` or ``NoneType``
+    :rtype: ``Catalog``
+    """
+    if db_file is None:
+        db_file = CONNECTIONS.db_file
+    version = file_version(db_file)
+    if __catalogs.get(db_file, (None, None))[0] != version:
+        __catalogs[db_file] = (version, Catalog(db_file))
+    return __catalogs[db_file][1]
+
+
+__catalog_files = {} # caches the catalogs loaded by ``load_catalog_file``
+
+def load_catalog_file(catalog_file):
+    """
+    memory-maps a catalog file (only once per process, unless the file is
+    modified).
+
+    :type catalog_file: ``str``
+    :rtype: ``MappedCatalog``
+    """
+    version = file_version(catalog_file)
+    if __catalog_files.get(catalog_file, (None, None))[0] != version:
+        __catalog_files[catalog_file] = (version,
+                                         MappedCatalog(catalog_file))
+    return __catalog_files[catalog_file][1]
+
+
+def main():
+    """
+    compiles the book database into a catalog file (cf.
+    ``write_catalog_file``), e.g.::
+
+        pypolibox-build-catalog books.catalog
+    """
+    parser = argparse.ArgumentParser(
+        description='compile the book database into a pypolibox catalog file')
+    parser.add_argument("catalog_file", help="path of the catalog file")
+    parser.add_argument("--db", default=DB_FILE,
+        help="path to the sqlite database. default: {0}".format(DB_FILE))
+    args = parser.parse_args(sys.argv[1:])
+    write_catalog_file(args.catalog_file, args.db)
+    catalog = MappedCatalog(args.catalog_file)
+    print "wrote {0} books to {1}".format(catalog.size, args.catalog_file)
+
+
+if __name__ == "__main__":
+    main()
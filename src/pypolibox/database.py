@@ -10,8 +10,14 @@ sqlite database and returning the results.
 """
 
 import os
+import sys
+import copy
+import heapq
 import argparse
 import sqlite3
+import threading
+import urllib
+from collections import OrderedDict
 import util
 
 if __name__ == '__main__':
@@ -23,6 +29,154 @@ BOOK_TABLE_NAME = 'books' # name of the table in the database file that
                           # contains info about books
 DEFAULT_ENCODING = 'UTF8'
 
+# columns of the books table that contain 'arrays' of several values, e.g.
+# '[semantics][parsing]', cf. ``build_term_index``
+TERM_COLUMNS = ('authors', 'keywords', 'plang')
+TERMS_TABLE_NAME = 'terms' # the distinct values of all TERM_COLUMNS
+POSTINGS_TABLE_NAME = 'postings' # which book (rowid) contains which term
+
+# settings of all connections to the database (cf. ``ConnectionManager``):
+# page cache size (negative: in KiB) and size of the memory-mapped part of
+# the database file (in bytes)
+SQLITE_PRAGMAS = {'cache_size': -16384, 'mmap_size': 268435456}
+
+SQLITE_STATEMENT_CACHE_SIZE = 256 # compiled statements kept per connection
+QUERY_SHAPE_CACHE_SIZE = 1000 # number of SQL query templates kept in memory
+
+# bounds of the cache of query results (and their serialized text plans),
+# cf. ``ResultCache``
+RESULT_CACHE_SIZE = 1000 # max. number of entries
+RESULT_CACHE_BYTES = 64 * 1024 * 1024 # max. (estimated) size of all entries
+
+# query arguments that don't describe the books the user is looking for,
+# i.e. that can't be matched by a book
+NON_MATCHING_ARGS = ('minresults', 'workers', 'plan_timeout', 'plan_cache',
+                     'tccg_server', 'realization_cache', 'max_results',
+                     'backend', 'catalog_file', 'batch', 'cache_output',
+                     'strategy', 'beam_width', 'node_budget', 'time_budget',
+                     'plan_table')
+
+# query arguments that choose the search strategy of the text planner and its
+# settings, i.e. keyword arguments of ``textplan.generate_textplan``
+SEARCH_ARGS = ('strategy', 'beam_width', 'node_budget', 'time_budget')
+
+class QueryArgumentError(ValueError):
+    """raised by a ``BatchArgumentParser`` if query arguments are invalid"""
+
+
+class BatchArgumentParser(argparse.ArgumentParser):
+    """
+    an ``argparse.ArgumentParser`` that raises a ``QueryArgumentError``
+    instead of printing its usage to stderr and exiting, so that an invalid
+    query in a batch (cf. ``--batch``) can be reported without affecting 
+    the other queries.
+    """
+    def error(self, message):
+        raise QueryArgumentError(message)
+
+
+__query_parsers = {} # built once, cf. ``query_parser``
+
+def query_parser(batch=False):
+    """
+    returns the ``argparse`` parser of all query arguments (cf. ``Query``).
+    The parser is only built once per process.
+
+    :param batch: if True, return a ``BatchArgumentParser`` (without a
+    ``--help`` argument)
+    :type batch: ``bool``
+    :rtype: ``argparse.ArgumentParser``
+    """
+    if batch in __query_parsers:
+        return __query_parsers[batch]
+
+    if batch:
+        parser = BatchArgumentParser(add_help=False)
+    else:
+        parser = argparse.ArgumentParser()
+
+    parser.add_argument("-k", "--keywords", nargs='+',
+        help="Which topic(s) should the book cover?")
+        #nargs='+' handles 1 or more args
+    parser.add_argument("-l", "--language",
+        help="Which language should the book have?")
+    parser.add_argument("-p", "--proglang", nargs='+',
+        help="Which programming language(s) should the book use?")
+    parser.add_argument("-s", "--pagerange", type=int,
+        help="book length ranges. 0 = less than 300 pages, " \
+            "1 = between 300 and 600 pages. 2 = more than 600 pages.")
+    parser.add_argument("-t", "--target", type=int,
+        help="target audience. 0 = beginner, 1 = intermediate" \
+             "2 = advanced, 3 = professional")
+    parser.add_argument("-e", "--exercises", type=int,
+        help="Should the book contain exercises? 0 = no, 1 = yes")
+    parser.add_argument("-c", "--codeexamples", type=int,
+        help="Should the book contain code examples? 0 = no, 1 = yes")
+    parser.add_argument("-r", "--minresults", type=int,
+        help="show no less than MINRESULTS books")
+    parser.add_argument("--max-results", type=int,
+        help="show no more than MAX_RESULTS books (the best matches)")
+    parser.add_argument("--backend", choices=('sqlite', 'numpy'),
+        help=("search the database with sqlite queries (default) or "
+            "load it into memory once and search it with NumPy"))
+    parser.add_argument("--catalog-file",
+        help=("search the (memory-mapped) catalog file CATALOG_FILE "
+            "(cf. pypolibox-build-catalog) with NumPy"))
+    parser.add_argument("-o", "--output-format",
+        default='openccg',
+        help=("output format: openccg, hlds, textplan-xml, textplan-featstruct. "
+            "default: openccg"))
+    parser.add_argument("-d", "--output-language",
+        default='de',
+        help=("output natural language: currently only 'de' for German is supported. "
+            "default: de"))
+    parser.add_argument("-w", "--workers", type=int,
+        help="plan the text of WORKERS books concurrently")
+    parser.add_argument("--plan-timeout", type=float,
+        help=("stop planning a book after PLAN_TIMEOUT seconds "
+            "(only used with --workers)"))
+    parser.add_argument("--plan-cache",
+        help=("store text plan skeletons in the file PLAN_CACHE, so "
+            "that they can be reused by later queries"))
+    parser.add_argument("--tccg-server", type=int, metavar="PORT",
+        help=("realize sentences with the tccg processes of an already "
+            "running pypolibox-tccg-server on localhost:PORT"))
+    parser.add_argument("--realization-cache",
+        help=("store the sentences realized by OpenCCG in the SQLite "
+            "database REALIZATION_CACHE, so that they can be reused by "
+            "later queries"))
+    parser.add_argument("--batch", metavar="FILE",
+        help=("answer all queries in FILE (one query per line, either as "
+            "a JSON list of arguments or as plain command line arguments; "
+            "'-' reads them from stdin) and print one JSON object per "
+            "query. requires an output format of textplan-xml or "
+            "textplan-featstruct"))
+    parser.add_argument("--cache-output", action='store_const', const=True,
+        help=("also cache the serialized text plans of each query, so "
+            "that repeated queries (e.g. in a --batch file) are answered "
+            "without planning them again"))
+    parser.add_argument("--strategy", choices=('best-first', 'beam', 'dp'),
+        help=("search for text plans with a best-first search (default), "
+            "with a beam search, which keeps only the BEAM_WIDTH best "
+            "partial plans in each step, or with a dynamic program, which "
+            "finds the plan with the highest sum of rule heuristics"))
+    parser.add_argument("--beam-width", type=int,
+        help="number of partial plans kept by the beam search. default: 8")
+    parser.add_argument("--node-budget", type=int,
+        help=("stop the beam search after NODE_BUDGET search states and "
+            "complete its best partial plan"))
+    parser.add_argument("--time-budget", type=float,
+        help=("stop the beam search after TIME_BUDGET seconds and "
+            "complete its best partial plan"))
+    parser.add_argument("--plan-table",
+        help=("look up the text plans of books in the plan table "
+            "PLAN_TABLE (cf. pypolibox-compile-plans) instead of searching "
+            "for them"))
+
+    __query_parsers[batch] = parser
+    return parser
+
+
 class Query:
     """
     a ``Query`` instance represents one user query to the database
@@ -44,75 +198,68 @@ class Query:
     If you print the ``Query`` instance (by using the ``print`` command), it
     will return the SQL query that was constructed from the user input::
 
-        SELECT * FROM books WHERE keywords like '%semantics%' AND keywords
-        like '%parsing%' AND examples = 1
+        SELECT * FROM books WHERE keywords like ? AND keywords like ? AND
+        examples = ? ORDER BY rowid
+        parameters: (u'%semantics%', u'%parsing%', 1)
+
+    If the database contains a term index (cf. ``build_term_index``),
+    keywords and programming languages are looked up in this index instead
+    of scanning the whole books table, e.g.::
+
+        SELECT * FROM books WHERE rowid IN (SELECT book_id FROM postings
+        JOIN terms ON postings.term_id = terms.term_id WHERE
+        terms.column_name = 'keywords' AND terms.term like ?) ...
 
     TODO: This module talks directly to the database. To make it easier to
     adapt pypolibox to a different domain, an SQL abstraction layer (e.g.
     SQL Alchemy) should be used.
     """
-    def __init__ (self, argv):
+    def __init__ (self, argv, parser=None):
         """
         given a list of query arguments, this constructor parses commandline
         options with argparse, constructs a valid sql query and stores the
         resulting query strings in self.and_query (using boolean AND to
         combine the query arguments) and self.or_query (boolean OR).
 
-        TODO: add max_textplans paramter --> generate only the X highest
-              ranking books
+        If ``--max-results K`` is given, only the K highest ranking books
+        are retrieved (and turned into facts, messages and text plans).
 
         :param argv: a list of strings (either parsed from the command line
         or set programmatically)
         :type argv: ``list`` of ``str``
+        :param parser: the parser of the arguments (default:
+        ``query_parser()``)
+        :type parser: ``argparse.ArgumentParser`` or ``NoneType``
         """
         self.queries = []
+        # for each query, an SQL condition that holds iff the book matches
+        # the query parameter in the sense of ``Book.get_number_of_book_matches``
+        self.match_queries = []
         self.minresults = 3
         query_and = " AND "
         query_or = " OR "
 
-        parser = argparse.ArgumentParser()
-
-        parser.add_argument("-k", "--keywords", nargs='+',
-            help="Which topic(s) should the book cover?")
-            #nargs='+' handles 1 or more args
-        parser.add_argument("-l", "--language",
-            help="Which language should the book have?")
-        parser.add_argument("-p", "--proglang", nargs='+',
-            help="Which programming language(s) should the book use?")
-        parser.add_argument("-s", "--pagerange", type=int,
-            help="book length ranges. 0 = less than 300 pages, " \
-                "1 = between 300 and 600 pages. 2 = more than 600 pages.")
-        parser.add_argument("-t", "--target", type=int,
-            help="target audience. 0 = beginner, 1 = intermediate" \
-                 "2 = advanced, 3 = professional")
-        parser.add_argument("-e", "--exercises", type=int,
-            help="Should the book contain exercises? 0 = no, 1 = yes")
-        parser.add_argument("-c", "--codeexamples", type=int,
-            help="Should the book contain code examples? 0 = no, 1 = yes")
-        parser.add_argument("-r", "--minresults", type=int,
-            help="show no less than MINRESULTS books")
-        parser.add_argument("-o", "--output-format",
-            default='openccg',
-            help=("output format: openccg, hlds, textplan-xml, textplan-featstruct. "
-                "default: openccg"))
-        parser.add_argument("-d", "--output-language",
-            default='de',
-            help=("output natural language: currently only 'de' for German is supported. "
-                "default: de"))
-
+        if parser is None:
+            parser = query_parser()
         args = parser.parse_args(argv)
 
         if args.keywords is not None:
             for keyword in args.keywords:
                 self.queries.append(self.__substring_query("keywords",
                                                            keyword))
+                self.match_queries.append(self.__term_query("keywords",
+                                                            keyword))
         if args.language is not None:
             self.queries.append(self.__string_query("lang", args.language))
+            self.match_queries.append(self.queries[-1])
         if args.proglang is not None:
             for proglang in args.proglang:
                 self.queries.append(self.__substring_query("plang", proglang))
+                self.match_queries.append(self.__term_query("plang",
+                                                            proglang))
         if args.pagerange is not None:
             self.queries.append(self.__pages_query(args.pagerange))
+            self.match_queries.append(self.queries[-1])
         if args.target is not None:
             # confusion: in the db, advanced is encoded as "3"
             # --> blame JPolibox ;)
@@ -120,12 +267,14 @@ class Query:
             (intermediate), 2 (advanced) or 3 (professional)"""
             assert args.target in (0, 1, 2, 3), target_error
             self.queries.append(self.__equals_query("target", args.target))
+            self.match_queries.append(self.queries[-1])
         if args.exercises is not None:
             exercises_error = """exercises value should be either 0 (books
             should have no exercises) or 1 (book should have exercises)"""
             assert args.exercises in (0, 1), exercises_error
             self.queries.append(self.__equals_query("exercises",
                                                     args.exercises))
+            self.match_queries.append(self.queries[-1])
         if args.codeexamples is not None:
             codeexamples_error = """codeexamples value should be either 0
             (books should have no code examples) or 1 (book should have code
@@ -133,14 +282,93 @@ class Query:
             assert args.codeexamples in (0, 1), codeexamples_error
             self.queries.append(self.__equals_query("examples",
                                                     args.codeexamples))
+            self.match_queries.append(self.queries[-1])
         if args.minresults is not None:
             assert args.minresults > 0, """the minimal number of results must
             be 1"""
             self.minresults = args.minresults
+        if args.max_results is not None:
+            assert args.max_results > 0, """the maximal number of results
+            must be at least 1"""
+        if args.workers is not None:
+            assert args.workers > 0, """the number of workers must be at
+            least 1"""
 
         self.query_args = args # we still need them in pypolibox.main()
-        self.and_query = self.__construct_query(self.queries, query_and)
-        self.or_query = self.__construct_query(self.queries, query_or)
+
+        # all queries with the same 'shape' (i.e. the same SQL templates,
+        # but different values) are constructed only once. since the
+        # values are passed as parameters, sqlite can also reuse the
+        # statements it has already compiled.
+        limit = None
+        if not self.queries and args.max_results is not None:
+            # all books match an empty query, so we only need the first ones
+            limit = max(args.max_results, self.minresults)
+        shape = (tuple(sql for (sql, params) in self.queries),
+                 tuple(sql for (sql, params) in self.match_queries),
+                 limit is not None)
+        templates = QUERY_SHAPES.get(shape)
+        if templates is None:
+            templates = (self.__construct_query(self.queries, query_and),
+                         self.__construct_query(self.queries, query_or),
+                         self.__construct_scoring_query(self.queries,
+                                                        self.match_queries,
+                                                        limit is not None))
+            QUERY_SHAPES.put(shape, templates)
+        self.and_query, self.or_query, self.scoring_query = templates
+
+        query_params = tuple(param for (sql, params) in self.queries
+                             for param in params)
+        match_params = tuple(param for (sql, params) in self.match_queries
+                             for param in params)
+        self.and_params = self.or_params = query_params
+        self.scoring_params = query_params + match_params + query_params
+        if limit is not None:
+            self.scoring_params += (limit,)
+
+    def __construct_scoring_query(self, queries, match_queries, limit=False):
+        """
+        helper function for __init__: constructs one SQL query that returns
+        the results of both the AND and the OR query. Each result row is
+        extended by two columns: 'matched_queries' (the number of
+        ``queries`` the book matches, i.e. it is an AND query result iff all
+        queries match) and 'book_matches' (the number of ``match_queries``
+        it matches, i.e. its score).
+
+        The query expects the parameters of ``queries``, of
+        ``match_queries``, again of ``queries`` and (if ``limit`` is True)
+        the max. number of results.
+
+        :param queries: a list of queries in SQL notation (and their
+        parameters)
+        :type queries: ``list`` of (``str``, ``tuple``) tuples
+
+        :param match_queries: a list of SQL conditions that check if a book
+        matches a query parameter (cf. ``Book.get_number_of_book_matches``)
+        :type match_queries: ``list`` of (``str``, ``tuple``) tuples
+
+        :param limit: if True, the number of results will be limited
+        :type limit: ``bool``
+
+        :rtype: ``str``
+        """
+        def count_matches(conditions):
+            if not conditions:
+                return "0"
+            return " + ".join("(CASE WHEN {0} THEN 1 ELSE 0 END)".format(
+                condition) for (condition, params) in conditions)
+
+        scoring_query = "SELECT *, {0} AS matched_queries, {1} AS " \
+                        "book_matches FROM books ".format(
+                            count_matches(queries),
+                            count_matches(match_queries))
+        if queries:
+            scoring_query += "WHERE " + " OR ".join(
+                query for (query, params) in queries) + " "
+        scoring_query += "ORDER BY rowid"
+        if limit:
+            scoring_query += " LIMIT ?"
+        return scoring_query
 
     def __construct_query(self, queries, query_combinator):
         """
@@ -148,31 +376,29 @@ class Query:
         combines them into one complex SQL query (using either boolean AND or
         boolean OR).
 
-        :param queries: a list of queries in SQL notation
-        :type queries: ``list`` of ``str``
+        :param queries: a list of queries in SQL notation (and their
+        parameters)
+        :type queries: ``list`` of (``str``, ``tuple``) tuples
 
         :param query_combinator: a string that can be used to combine SQL
         queries, e.g. " AND " or " OR "
         :type query_combinator: ``str``
 
-        :return: a complex SQL query
+        :return: a complex SQL query (with placeholders for the parameters
+        of the queries)
         :rtype: ``str``
         """
         query_template = "SELECT * FROM books "
         where = "WHERE "
-        combined_queries = ""
-        if len(queries) > 1:
-            for query in queries[:-1]:
-            #combine queries with " AND ", but don't append
-            #after the last query
-                combined_queries += query + query_combinator
-            combined_queries += queries[-1]
-            return query_template + where + combined_queries
-        elif len(queries) == 1: # simple query, no combination needed
-            query = queries[0] # list with one string element --> string
-            return query_template + where + query
+        # books are always returned in the order they're stored in, even if
+        # sqlite finds them via an index (cf. ``build_term_index``)
+        order = "ORDER BY rowid"
+        if queries:
+            combined_queries = query_combinator.join(
+                query for (query, params) in queries)
+            return query_template + where + combined_queries + " " + order
         else: #empty query
-            return query_template # query will show all books in the db
+            return query_template + order # query will show all books in the db
 
     def __pages_query(self, length_category):
         """
@@ -184,18 +410,19 @@ class Query:
         book (0: short, 1: medium length, 2: long)
         :type length_category: ``int``
 
-        :return: a part of a simple SQL query, e.g. 'pages < 300'
-        :rtype: ``str``
+        :return: a part of a simple SQL query and its parameters, e.g. 
+        ('pages < ?', (300,))
+        :rtype: (``str``, ``tuple``)
         """
         length_error = """length value should be either 0: short, 1: medium
             length or 2: long"""
         assert length_category in (0, 1, 2), length_error
         if length_category == 0:
-            return "pages < 300"
+            return ("pages < ?", (300,))
         if length_category == 1:
-            return "pages >= 300 AND pages < 600"
+            return ("pages >= ? AND pages < ?", (300, 600))
         if length_category == 2:
-            return "pages >= 600"
+            return ("pages >= ?", (600,))
 
     def __substring_query(self, sql_column, substring):
         """
@@ -212,13 +439,49 @@ class Query:
         :param substring: a string we're looking for, e.g. 'semantics'
         :type substring: ``str``
 
-        :return: a part of a simple SQL query, e.g. 'keyword like %semantics%'
-        :rtype: ``str``
+        :return: a part of a simple SQL query and its parameters, e.g.
+        ('keywords like ?', (u'%semantics%',))
+        :rtype: (``str``, ``tuple``)
         """
         # keyword --> '%keyword%' for SQL LIKE queries
-        sql_substring = "'%{0}%'".format(substring)
-        substring_query = "{0} like {1}".format(sql_column, sql_substring)
-        return substring_query
+        sql_substring = u"%{0}%".format(util.ensure_unicode(substring))
+        if sql_column in TERM_COLUMNS and has_term_index() \
+           and substring and '[' not in substring and ']' not in substring:
+            # only the (few) distinct terms have to be compared with the
+            # substring; the matching books are then found via the index.
+            # (an empty substring also matches books without any terms and
+            # brackets can only be matched in the original 'array' string)
+            return ("rowid IN (SELECT book_id FROM {0} JOIN {1} ON "
+                    "{0}.term_id = {1}.term_id WHERE {1}.column_name = '{2}' "
+                    "AND {1}.term like ?)".format(POSTINGS_TABLE_NAME,
+                        TERMS_TABLE_NAME, sql_column), (sql_substring,))
+        substring_query = "{0} like ?".format(sql_column)
+        return (substring_query, (sql_substring,))
+
+    def __term_query(self, sql_column, term):
+        """
+        helper function for __init__: unlike ``__substring_query``, this
+        checks if one of the values of an 'array' column is exactly the
+        given term, e.g. if 'semantics' is one of the keywords of a book.
+
+        :param sql_column: the name of the column in the database we're
+        querying, e.g. 'keywords'
+        :type sql_column: ``str``
+
+        :param term: a string we're looking for, e.g. 'semantics'
+        :type term: ``str``
+
+        :return: a part of a simple SQL query and its parameters, e.g.
+        ("instr(keywords, ?) > 0", (u'[semantics]',))
+        :rtype: (``str``, ``tuple``)
+        """
+        term = util.ensure_unicode(term)
+        if has_term_index():
+            return ("rowid IN (SELECT book_id FROM {0} JOIN {1} ON "
+                    "{0}.term_id = {1}.term_id WHERE {1}.column_name = '{2}' "
+                    "AND {1}.term = ?)".format(POSTINGS_TABLE_NAME,
+                        TERMS_TABLE_NAME, sql_column), (term,))
+        return ("instr({0}, ?) > 0".format(sql_column), (u"[{0}]".format(term),))
 
     def __string_query(self, sql_column, string):
         """
@@ -232,31 +495,35 @@ class Query:
         :param string: a string we're looking for, e.g. 'German'
         :type string: ``str``
 
-        :return: a part of a simple SQL query, e.g. 'keyword like %semantics%'
-        :rtype: ``str``
+        :return: a part of a simple SQL query and its parameters, e.g. 
+        ('lang = ?', (u'German',))
+        :rtype: (``str``, ``tuple``)
         """
-        return "{0} = '{1}'".format(sql_column, string)
+        return ("{0} = ?".format(sql_column), (util.ensure_unicode(string),))
 
     def __equals_query(self, sql_column, integer):
         """
         helper function for __init__: find all database items that completely
         match an integer value in a given column, e.g. WHERE exercises = 1
 
-        :return: a part of a simple SQL query, e.g. 'exercises = 1'
-        :rtype: ``str``
+        :return: a part of a simple SQL query and its parameters, e.g. 
+        ('exercises = ?', (1,))
+        :rtype: (``str``, ``tuple``)
         """
-        return "{0} = {1}".format(sql_column, integer)
+        return ("{0} = ?".format(sql_column), (integer,))
 
     def __str__(self):
         """
         If you print a ``Query`` instance, it will return the query strings
-        that will be send to the database.
+        that will be send to the database (and their parameters).
         """
         ret_str = "The arguments (parsed from the command line): " + \
             "{0}\nhave resulted in the following SQL query:".format(self.query_args) + \
-            "\n{0}\n\nIf the query should return less than ".format(self.and_query) + \
+            "\n{0}\nparameters: {1}\n\n".format(self.and_query, self.and_params) + \
+            "If the query should return less than " + \
             "{0} book(s), this query will be used and ranked ".format(self.minresults) + \
-            "according to the number of query parameter matches:\n{0}".format(self.or_query)
+            "according to the number of query parameter matches:\n{0}".format(self.or_query) + \
+            "\nparameters: {0}".format(self.or_params)
         return ret_str
 
 class Results:
@@ -271,11 +538,16 @@ class Results:
         in self.query_results
 
         If the query (combining query parameters with boolean AND) returns
-        less than query.minresults books, a different query will be sent
-        (combining query parameters with boolean OR). In the latter case, a
-        maximum score (possible_matches) will be calculated (how many query
-        parameters does a result match). possible_matches will be used by
-        a ``Books`` instance to find the n-best matching books.
+        less than query.minresults books, the results of a different query
+        will be used (combining query parameters with boolean OR). In the
+        latter case, a maximum score (possible_matches) will be calculated
+        (how many query parameters does a result match). possible_matches
+        will be used by a ``Books`` instance to find the n-best matching
+        books.
+
+        Both result sets are retrieved with one query (``scoring_query``),
+        which also counts how many query parameters each book matches
+        ('book_matches' column).
 
         :type query: instance of class ``Query``
         :param query: an instance of the class Query()
@@ -289,33 +561,61 @@ class Results:
         self.minresults = query.minresults
         self.possible_matches = 0
 
-        conn = sqlite3.connect(DB_FILE)
-        self.curs = conn.cursor()
-
-        # NOTE: this has to be done BEFORE the actual query,
-        # otherwise we'll overwrite the cursor!
+        self.curs = CONNECTIONS.connection().cursor()
         self.db_columns = self.get_table_header(BOOK_TABLE_NAME)
 
-        and_sql_cursor = self.curs.execute(self.and_query)
-        for result in and_sql_cursor:
-            self.and_query_results.append(result)
+        # the scoring query appends two columns to the books table columns
+        self.db_columns['matched_queries'] = len(self.db_columns)
+        self.db_columns['book_matches'] = len(self.db_columns)
+
+        max_results = self.query_args.max_results
+        scored_results = []
+        for result in self.curs.execute(query.scoring_query,
+                                        query.scoring_params):
+            scored_results.append(result)
+            if result[self.db_columns['matched_queries']] == len(query.queries):
+                self.and_query_results.append(result)
+                # enough 'AND query' results: the remaining books can't
+                # be among the best ones
+                if max_results is not None and \
+                   len(self.and_query_results) >= max(max_results,
+                                                      self.minresults):
+                    break
         if len(self.and_query_results) >= self.minresults:
             self.possible_matches = self.get_number_of_possible_matches()
+            self.and_query_results = self.and_query_results[:max_results]
             self.query_results = self.and_query_results
             self.query_type = 'and'
 
-        # if 'AND query' doesn't return enough results ...
-        # TODO: this 'else block' only needs to be executed if the and_query
-        # has too few results AND that query consists of more than one
-        # parameter -- otherwise, it won't improve results.
+        # if 'AND query' doesn't return enough results, use the results of
+        # the 'OR query' (which were retrieved by the same scoring query)
         else:
-            or_sql_cursor = self.curs.execute(query.or_query)
-            for result in or_sql_cursor:
-                self.or_query_results.append(result)
+            if max_results is not None:
+                scored_results = self.get_best_results(scored_results,
+                                                       max_results)
+            self.or_query_results = scored_results
             self.possible_matches = self.get_number_of_possible_matches()
             self.query_results = self.or_query_results
             self.query_type = 'or'
-        conn.close() # close connection to sqlite db
+        self.curs.close() # the connection is reused by later queries
+
+    def get_best_results(self, results, max_results):
+        """
+        finds the 'OR query' results that match the most query parameters,
+        i.e. the books that ``Books.get_book_ranks()`` would rank highest.
+
+        :type results: ``list`` of ``tuple``s
+        :param results: rows returned by the scoring query
+        :type max_results: ``int``
+        :rtype: ``list`` of ``tuple``s
+        :return: the best ``max_results`` results (in their original order)
+        """
+        book_matches = self.db_columns['book_matches']
+        best = heapq.nlargest(max_results,
+                              ((result[book_matches], index)
+                               for index, result in enumerate(results)))
+        return [results[index] for (matches, index) in sorted(best,
+                                                key=lambda best: best[1])]
 
     def get_number_of_possible_matches(self):
         """
@@ -335,7 +635,7 @@ class Results:
         """
         possible_matches = 0
         self.params = [param for param in self.query_args.__dict__
-                          if param is not 'minresults'
+                          if param not in NON_MATCHING_ARGS
                           if self.query_args.__getattribute__(param) is not None]
         self.values = map(self.query_args.__getattribute__, self.params)
 
@@ -358,11 +658,7 @@ class Results:
         as keys and their index as values
         :rtype: ``dict``, with ``str`` keys and ``int`` values
         """
-        table_info = self.curs.execute('PRAGMA table_info({0})'.format(table_name))
-        db_columns = {}
-        for index, name, data_type, notnull, dflt_value, pk in table_info:
-            db_columns[name.encode(DEFAULT_ENCODING)] = index
-        return db_columns
+        return CONNECTIONS.get_table_header(table_name)
 
     def __str__(self):
         """
@@ -415,7 +711,8 @@ class Books:
             #their score will always be 1.0
             self.scores = [1.0 for book in range(len(self.books))]
         elif self.query_type == 'or':
-            book_ranks = self.get_book_ranks(results.possible_matches)
+            book_ranks = self.get_book_ranks(results.possible_matches,
+                                             self.query_args.max_results)
             for (score, index) in book_ranks:
                 sorted_books.append( (self.books[index], score) )
             #magic unzip / reverse zip function
@@ -425,7 +722,7 @@ class Books:
             else:
                 self.books, self.scores = zip(*sorted_books)
 
-    def get_book_ranks(self, possible_matches):
+    def get_book_ranks(self, possible_matches, max_results=None):
         """
         ranks 'OR query' results according to the number of query parameters
         they match.
@@ -434,6 +731,8 @@ class Books:
         ----------
         possible_matches : int
             the number of (meaningful) parameters of the query.
+        max_results : int or None
+            if given, only the ``max_results`` best books are ranked
 
         Returns
         -------
@@ -445,6 +744,8 @@ class Books:
         for index, book in enumerate(self.books):
             score = float(book.book_matches) / float(possible_matches)
             scores.append( (score, index) )
+        if max_results is not None:
+            return heapq.nlargest(max_results, scores)
         return sorted(scores, reverse=True) #best (highest) scores first
 
     def __str__(self):
@@ -537,7 +838,10 @@ class Book:
         self.target = db_item[db_columns["target"]]
         self.exercises = db_item[db_columns["exercises"]]
         self.codeexamples = db_item[db_columns["examples"]]
-        self.book_matches = self.get_number_of_book_matches()
+        if "book_matches" in db_columns: # already counted by the db query
+            self.book_matches = db_item[db_columns["book_matches"]]
+        else:
+            self.book_matches = self.get_number_of_book_matches()
 
     def get_number_of_book_matches(self):
         """
@@ -572,6 +876,383 @@ class Book:
             return_string += "{0}:\t\t{1}\n".format(key, value)
         return return_string
 
+class ConnectionManager(object):
+    """
+    manages read-only connections to the database, which are opened once 
+    per thread (sqlite connections can't be shared between threads) and 
+    reused for all later queries of that thread. It also caches the column 
+    names of the database tables.
+    """
+    def __init__(self, db_file=DB_FILE, immutable=True, pragmas=None):
+        """
+        :param db_file: path to the sqlite database
+        :type db_file: ``str``
+        :param immutable: if True, sqlite assumes that the database file 
+        isn't changed while it is opened (i.e. it doesn't need to lock it).
+        Call ``reset()`` after changing the database.
+        :type immutable: ``bool``
+        :param pragmas: the settings of each connection (default:
+        ``SQLITE_PRAGMAS``)
+        :type pragmas: ``dict`` or ``NoneType``
+        """
+        self.db_file = db_file
+        self.immutable = immutable
+        self.pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+        self.generation = 0 # incremented by reset()
+        self._local = threading.local()
+        self._table_headers = {}
+
+    def connection(self):
+        """
+        :rtype: ``sqlite3.Connection``
+        :return: the read-only connection of the current thread
+        """
+        conn = getattr(self._local, 'connection', None)
+        if conn is None or self._local.generation != self.generation:
+            if conn is not None:
+                conn.close()
+            conn = self.__connect()
+            self._local.connection = conn
+            self._local.generation = self.generation
+        return conn
+
+    def __connect(self):
+        """opens a new read-only connection to the database"""
+        if uri_filenames_supported():
+            uri = "file:{0}?mode=ro".format(
+                urllib.quote(os.path.abspath(self.db_file)))
+            if self.immutable:
+                uri += "&immutable=1"
+            conn = sqlite3.connect(uri,
+                cached_statements=SQLITE_STATEMENT_CACHE_SIZE)
+        else: # the file name would be taken literally
+            conn = sqlite3.connect(self.db_file,
+                cached_statements=SQLITE_STATEMENT_CACHE_SIZE)
+            conn.execute("PRAGMA query_only = 1")
+        for pragma, value in self.pragmas.iteritems():
+            conn.execute("PRAGMA {0} = {1}".format(pragma, value))
+        return conn
+
+    def get_table_header(self, table_name):
+        """
+        get the column names (e.g. title, year, authors) and their index from
+        a table of the db and return them as a dictionary.
+
+        :param table_name: name of a database table, e.g. 'books'
+        :type table_name: ``str``
+
+        :return: a (new) dictionary, which contains the names of the table
+        columns as keys and their index as values
+        :rtype: ``dict``, with ``str`` keys and ``int`` values
+        """
+        if table_name not in self._table_headers:
+            table_info = self.connection().execute(
+                'PRAGMA table_info({0})'.format(table_name))
+            db_columns = {}
+            for index, name, data_type, notnull, dflt_value, pk in table_info:
+                db_columns[name.encode(DEFAULT_ENCODING)] = index
+            self._table_headers[table_name] = db_columns
+        return dict(self._table_headers[table_name])
+
+    def reset(self, db_file=None):
+        """
+        makes all threads reopen their connections (and forgets the cached 
+        column names), e.g. after the database was changed.
+
+        :param db_file: if given, all later connections are opened to this 
+        database instead
+        :type db_file: ``str`` or ``NoneType``
+        """
+        if db_file is not None:
+            self.db_file = db_file
+        self._table_headers = {}
+        self.generation += 1
+
+
+CONNECTIONS = ConnectionManager() # used by all queries of this process
+
+# SQL query templates of all ``Query``s, keyed by the query 'shape'
+QUERY_SHAPES = util.LRUCache(maxsize=QUERY_SHAPE_CACHE_SIZE)
+
+
+class ResultCache(object):
+    """
+    caches the results of queries (``Results`` or ``CatalogResults``), so
+    that repeated queries don't have to search the database again. Queries
+    are identified by their normalized arguments, i.e. the order of their
+    keywords and programming languages doesn't matter, e.g.
+    ``-k parsing semantics`` and ``-k semantics parsing`` share an entry.
+
+    The cache is bounded by the number of entries (``maxsize``) and by their
+    estimated size in bytes (``maxbytes``), evicting the least recently
+    used entries first. All entries of a database or catalog file are
+    dropped as soon as the file is modified (i.e. its mtime or size
+    changes).
+
+    Optionally (``cache_output``), the cache also stores the serialized text
+    plans of a query (cf. ``get_output``). Since the text plans mention the
+    query arguments in their original order, these are keyed by the exact
+    query arguments (and the search options of the text planner, cf.
+    ``search_options``).
+    """
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, maxbytes=RESULT_CACHE_BYTES,
+                 cache_output=False):
+        """
+        :type maxsize: ``int``
+        :type maxbytes: ``int``
+        :param cache_output: if False, ``get_output`` and ``put_output``
+        don't cache anything
+        :type cache_output: ``bool``
+        """
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.cache_output = cache_output
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict() # key -> (value, nbytes)
+        self._versions = {} # source file -> version of its cached entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, query):
+        """
+        returns the cached results of a query (adapted to its arguments,
+        cf. ``Results.get_number_of_possible_matches``) or None.
+
+        :type query: ``Query``
+        :rtype: ``Results`` or ``NoneType``
+        """
+        cached = self.__lookup(query, ('results', query_key(query)))
+        if cached is None:
+            return None
+        results = copy.copy(cached)
+        results.query_args = query.query_args
+        results.and_query = query.and_query
+        results.or_query = query.or_query
+        results.possible_matches = results.get_number_of_possible_matches()
+        return results
+
+    def put(self, query, results):
+        """
+        :type query: ``Query``
+        :type results: ``Results``
+        """
+        nbytes = estimate_size(results.query_results)
+        if results.and_query_results is not results.query_results:
+            nbytes += estimate_size(results.and_query_results)
+        self.__store(query, ('results', query_key(query)), results, nbytes)
+
+    def get_output(self, query, output_format):
+        """
+        returns the cached text plans of a query (in the given output
+        format) or None.
+
+        :type query: ``Query``
+        :type output_format: ``str``
+        :rtype: ``str`` or ``NoneType``
+        """
+        if not self.cache_output:
+            return None
+        return self.__lookup(query, ('output', output_format,
+                                     query_key(query, normalize=False),
+                                     search_key(query)))
+
+    def put_output(self, query, output_format, output):
+        """
+        :type query: ``Query``
+        :type output_format: ``str``
+        :param output: the serialized text plans of the query
+        :type output: ``str``
+        """
+        if self.cache_output:
+            self.__store(query, ('output', output_format,
+                                 query_key(query, normalize=False),
+                                 search_key(query)),
+                         output, sys.getsizeof(output))
+
+    def clear(self):
+        """removes all entries"""
+        self._entries.clear()
+        self._versions.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """
+        :rtype: ``dict``
+        :return: the number of cache hits, misses, invalidations (of all
+        entries of a modified file), stored entries and their size
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'invalidations': self.invalidations,
+                'size': len(self._entries), 'maxsize': self.maxsize,
+                'bytes': self.nbytes, 'maxbytes': self.maxbytes}
+
+    def __str__(self):
+        return "{hits} hits, {misses} misses, {invalidations} " \
+               "invalidations, {size}/{maxsize} entries, " \
+               "{bytes}/{maxbytes} bytes".format(**self.stats())
+
+    def __lookup(self, query, key):
+        """returns the cached value of the query or None"""
+        source = query_source(query)
+        self.__check_version(source)
+        try:
+            value, nbytes = self._entries.pop( (source, key) )
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[(source, key)] = (value, nbytes)
+        self.hits += 1
+        return value
+
+    def __store(self, query, key, value, nbytes):
+        """caches the value and evicts the least recently used entries"""
+        source = query_source(query)
+        self.__check_version(source)
+        old_value, old_nbytes = self._entries.pop( (source, key),
+                                                   (None, 0) )
+        self.nbytes -= old_nbytes
+        if nbytes > self.maxbytes:
+            return
+        self._entries[(source, key)] = (value, nbytes)
+        self.nbytes += nbytes
+        while len(self._entries) > self.maxsize or \
+              self.nbytes > self.maxbytes:
+            (evicted_value, evicted_nbytes) = \
+                self._entries.popitem(last=False)[1]
+            self.nbytes -= evicted_nbytes
+
+    def __check_version(self, source):
+        """
+        drops all entries of a database or catalog file if it was modified
+        since they were cached.
+        """
+        version = file_version(source)
+        if self._versions.get(source, version) != version:
+            for key in [key for key in self._entries if key[0] == source]:
+                self.nbytes -= self._entries.pop(key)[1]
+            self.invalidations += 1
+            if source == CONNECTIONS.db_file:
+                # the connections assume that the database never changes
+                CONNECTIONS.reset()
+        self._versions[source] = version
+
+
+RESULT_CACHE = ResultCache() # shared by all queries of this process
+
+
+def query_key(query, normalize=True):
+    """
+    returns a hashable representation of the query arguments that determine
+    the results of a query (cf. ``ResultCache``).
+
+    :type query: ``Query``
+    :param normalize: if True, the order of keywords and programming
+    languages is ignored
+    :type normalize: ``bool``
+    :rtype: ``tuple``
+    """
+    args = query.query_args
+    keywords, proglang = args.keywords, args.proglang
+    if normalize:
+        keywords = None if keywords is None else sorted(keywords)
+        proglang = None if proglang is None else sorted(proglang)
+    return (None if keywords is None else tuple(keywords),
+            None if proglang is None else tuple(proglang),
+            args.language, args.pagerange, args.target, args.exercises,
+            args.codeexamples, query.minresults, args.max_results,
+            args.backend == 'numpy')
+
+
+def search_options(query):
+    """
+    returns the search strategy of the text planner and its settings, as 
+    given by the query arguments (cf. ``SEARCH_ARGS``). Arguments that 
+    weren't given are left out, i.e. the defaults of 
+    ``textplan.generate_textplan`` apply.
+
+    :type query: ``Query``
+    :rtype: ``dict`` of (``str``, ``str`` or ``int`` or ``float``)
+    """
+    options = {}
+    for param in SEARCH_ARGS:
+        value = getattr(query.query_args, param)
+        if value is not None:
+            options[param] = value
+    return options
+
+
+def search_key(query):
+    """
+    returns a hashable representation of the search options of a query 
+    (cf. ``search_options``), which determine the text plans of its results.
+
+    :type query: ``Query``
+    :rtype: ``tuple``
+    """
+    return tuple(sorted(search_options(query).items()))
+
+
+def query_source(query):
+    """
+    returns the path of the file that a query searches, i.e. its catalog
+    file or the database.
+
+    :type query: ``Query``
+    :rtype: ``str``
+    """
+    if query.query_args.catalog_file is not None:
+        return query.query_args.catalog_file
+    return CONNECTIONS.db_file
+
+
+def file_version(path):
+    """
+    returns the modification time and size of a file, which change whenever
+    the file is rewritten.
+
+    :type path: ``str``
+    :rtype: ``tuple`` of (``float``, ``int``)
+    """
+    stat = os.stat(path)
+    return (stat.st_mtime, stat.st_size)
+
+
+def estimate_size(rows):
+    """
+    estimates the memory used by the rows of a query result.
+
+    :type rows: ``list`` of ``tuple``s
+    :rtype: ``int``
+    """
+    return sys.getsizeof(rows) + sum(sys.getsizeof(row) +
+                                     sum(sys.getsizeof(value)
+                                         for value in row)
+                                     for row in rows)
+
+
+__uri_filenames = [] # caches the result of ``uri_filenames_supported``
+
+def uri_filenames_supported():
+    """
+    checks if the sqlite library interprets file names like 
+    'file:books.sqlite?mode=ro' as URIs (Python 2 can't ask for that).
+
+    :rtype: ``bool``
+    """
+    if not __uri_filenames:
+        conn = sqlite3.connect(":memory:")
+        options = [option for (option,)
+                   in conn.execute("PRAGMA compile_options")]
+        conn.close()
+        __uri_filenames.append("USE_URI" in options or
+                               "USE_URI=1" in options)
+    return __uri_filenames[0]
+
+
 def get_column(column_name):
     """
     debugging: primitive db query that returns all the values stored in a
@@ -581,13 +1262,121 @@ def get_column(column_name):
     :type column_name: ``str``
     :rtype: ``list`` of ``str``
     """
-    conn = sqlite3.connect(DB_FILE)
+    columns = CONNECTIONS.get_table_header(BOOK_TABLE_NAME)
+    #print "available table columns: {0}\n".format(columns)
+    results_cursor = CONNECTIONS.connection().execute(
+        "select {0} from books".format(column_name))
+    return [result[0] for result in results_cursor]
+
+
+# caches the results of ``has_term_index``, keyed by the database file.
+# values: (``file_version`` of the database, result)
+__term_index_available = {}
+
+def has_term_index(db_file=None):
+    """
+    checks if the database contains a term index (cf. ``build_term_index``).
+    The result is cached until the database file is modified.
+
+    :param db_file: path to the database (default: the database that is
+    currently queried, cf. ``CONNECTIONS``)
+    :type db_file: ``str`` or ``NoneType``
+    :rtype: ``bool``
+    """
+    if db_file is None:
+        db_file = CONNECTIONS.db_file
+    version = file_version(db_file) # fails if the database doesn't exist
+    cached_version, available = \
+        __term_index_available.get(db_file, (None, None))
+    if cached_version != version:
+        # a new (read-only) connection, which isn't fooled by an
+        # 'immutable' connection opened before the index was built
+        connections = ConnectionManager(db_file, immutable=False, pragmas={})
+        conn = connections.connection()
+        tables = [name for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")]
+        conn.close()
+        available = TERMS_TABLE_NAME in tables and \
+                    POSTINGS_TABLE_NAME in tables
+        __term_index_available[db_file] = (version, available)
+    return available
+
+def build_term_index(db_file=DB_FILE):
+    """
+    builds an inverted index of all the values stored in the 'array' columns
+    (``TERM_COLUMNS``) of the books table. Each distinct value (e.g. the
+    keyword 'semantics') is stored once in the terms table and the postings
+    table lists the books (rowids) that contain it. Both tables are indexed,
+    so that ``Query`` can find the books that match a keyword without
+    scanning (and pattern matching) the whole books table.
+
+    The index has to be rebuilt whenever the books table is changed.
+
+    :param db_file: path to an sqlite database containing a books table
+    :type db_file: ``str``
+    """
+    conn = sqlite3.connect(db_file)
     curs = conn.cursor()
+    curs.execute("DROP TABLE IF EXISTS {0}".format(POSTINGS_TABLE_NAME))
+    curs.execute("DROP TABLE IF EXISTS {0}".format(TERMS_TABLE_NAME))
+    curs.execute("CREATE TABLE {0} (term_id INTEGER PRIMARY KEY, "
+                 "column_name TEXT NOT NULL, term TEXT NOT NULL, "
+                 "UNIQUE (column_name, term))".format(TERMS_TABLE_NAME))
+    curs.execute("CREATE TABLE {0} (term_id INTEGER NOT NULL, "
+                 "book_id INTEGER NOT NULL)".format(POSTINGS_TABLE_NAME))
+
+    term_ids = {}
+    postings = []
+    books = curs.execute("SELECT rowid, {0} FROM {1}".format(
+        ", ".join(TERM_COLUMNS), BOOK_TABLE_NAME)).fetchall()
+    for book in books:
+        book_id, arrays = book[0], book[1:]
+        for column_name, sql_array in zip(TERM_COLUMNS, arrays):
+            for term in util.sql_array_to_set(sql_array or u''):
+                key = (column_name, term)
+                if key not in term_ids:
+                    term_ids[key] = len(term_ids) + 1
+                postings.append( (term_ids[key], book_id) )
+
+    curs.executemany("INSERT INTO {0} VALUES (?, ?, ?)".format(
+        TERMS_TABLE_NAME), [(term_id, column_name, term)
+                            for (column_name, term), term_id
+                            in term_ids.iteritems()])
+    curs.executemany("INSERT INTO {0} VALUES (?, ?)".format(
+        POSTINGS_TABLE_NAME), sorted(postings))
+    curs.execute("CREATE INDEX {0}_term_book ON {0} (term_id, book_id)".format(
+        POSTINGS_TABLE_NAME))
+    conn.commit()
+    conn.close()
+    __term_index_available[db_file] = (file_version(db_file), True)
+    if db_file == CONNECTIONS.db_file:
+        CONNECTIONS.reset()
+
+
+def main():
+    """
+    (re)builds the term index of the book database (cf.
+    ``build_term_index``), e.g. after the books table was changed::
 
-    col_curs = curs.execute("PRAGMA table_info({0})".format(BOOK_TABLE_NAME))
-    columns = [header[1] for header in col_curs]
-    #print "available table columns: {0}\n".format(columns)
-    results_cursor = curs.execute("select {0} from books".format(column_name))
-    results = [result[0] for result in results_cursor]
-    conn.close() # close connection to db
-    return results
+        pypolibox-build-term-index --db books.sqlite
+    """
+    parser = argparse.ArgumentParser(
+        description='build the term index of the pypolibox book database')
+    parser.add_argument("--db", default=DB_FILE,
+        help="path to the sqlite database. default: {0}".format(DB_FILE))
+    args = parser.parse_args(sys.argv[1:])
+    if not os.path.isfile(args.db):
+        parser.error("database {0} doesn't exist".format(args.db))
+    build_term_index(args.db)
+    conn = sqlite3.connect(args.db)
+    (num_terms,), = conn.execute(
+        "SELECT count(*) FROM {0}".format(TERMS_TABLE_NAME))
+    (num_postings,), = conn.execute(
+        "SELECT count(*) FROM {0}".format(POSTINGS_TABLE_NAME))
+    conn.close()
+    print "indexed {0} terms ({1} postings) in {2}".format(
+        num_terms, num_postings, args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Arne Neumann <arne-neumann@web.de>
+
+"""
+The ``planrecords`` module contains the compact representation of
+``Message``s and ``ConstituentSet``s that the text planner works on (cf.
+``textplan.generate_textplan``).
+
+``Message``s and ``ConstituentSet``s are ``nltk.featstruct.FeatDict``s, so
+creating, freezing, hashing and comparing them walks through the whole
+(nested) feature structure. During the search, the planner only needs to
+know the message type of a ``Message`` and the relation type and the
+constituents of a ``ConstituentSet``. ``PlanMessage`` and
+``PlanConstituent`` store just that (in ``__slots__``), never change after
+they were created and compute their hash value only once. Records are
+hash-consed, i.e. there is only one record for all equal messages (or
+constituent sets), so sets of records compare their elements by identity.
+The intern tables are shared by all books planned in a process, so that
+search states (sets of records) that recur in several books are found in
+the planner's memo. Since an equal ``Message`` of another book may be
+returned by ``to_featstruct``, the messages of a record are frozen and
+must not be told apart by their identity (only by their content).
+
+Records are converted into feature structures (``to_featstruct``) only
+once a plan was found, i.e. ``textplans2xml`` and the lexicalization still
+work on ``Message``s and ``ConstituentSet``s::
+
+    >>> record = to_record(constituent_set)
+    >>> record.to_featstruct() == constituent_set
+    True
+
+A record has the same hash value as the (frozen) feature structure it
+represents. Therefore, sets of records are iterated in the same order as
+sets of the corresponding feature structures, and the planner finds
+exactly the same plans as it would on the feature structures themselves.
+``PlanConstituent`` computes this hash value like
+``nltk.featstruct.FeatStruct._calculate_hashvalue`` (cf.
+``test_constituent_hash``).
+"""
+
+import weakref
+from nltk.featstruct import Feature
+
+from rules import ConstituentSet
+
+MSG_TYPE = Feature('msgType')
+REL_TYPE = Feature('relType', display='prefix')
+NUCLEUS = Feature('nucleus', display='prefix')
+SATELLITE = Feature('satellite', display='prefix')
+
+# a frozen ConstituentSet hashes its features in this order, cf.
+# ``FeatStruct._calculate_hashvalue``
+CONSTITUENT_FEATURES = tuple(sorted([REL_TYPE, NUCLEUS, SATELLITE]))
+CONSTITUENT_FEATURE_HASHES = tuple(hash(feature)
+                                   for feature in CONSTITUENT_FEATURES)
+
+
+class PlanMessage(object):
+    """
+    represents a (frozen) ``Message`` in the text planner. The ``Message``
+    itself is kept, since ``Rule`` conditions and the final text plan
+    need its content.
+
+    ``PlanMessage``s are hash-consed: all equal messages are represented by
+    the same ``PlanMessage`` (as long as it exists).
+    """
+    __slots__ = ('msg_type', 'message', 'keys', '_hash', '__weakref__')
+
+    def __new__(cls, message):
+        """
+        :param message: the message (will be frozen)
+        :type message: ``Message``
+        """
+        message.freeze() # the message may be shared with other books
+        record = PLAN_MESSAGES.get(message)
+        if record is not None:
+            return record
+
+        record = object.__new__(cls)
+        msg_type = intern(str(message[MSG_TYPE]))
+        set_attribute = object.__setattr__
+        set_attribute(record, 'msg_type', msg_type)
+        set_attribute(record, 'message', message)
+        # the index key of the message, cf. ``rules.constituent_keys``
+        set_attribute(record, 'keys', (("msgType", msg_type),))
+        set_attribute(record, '_hash', hash(message))
+        PLAN_MESSAGES[message] = record
+        return record
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PlanMessages can't be modified")
+
+    def __hash__(self):
+        return self._hash
+
+    # equal records are identical, i.e. they are compared by identity
+
+    def __reduce__(self):
+        return (PlanMessage, (self.message,))
+
+    def __repr__(self):
+        return "PlanMessage({0})".format(self.msg_type)
+
+    def to_featstruct(self):
+        """
+        :rtype: ``Message``
+        """
+        return self.message
+
+
+class PlanConstituent(object):
+    """
+    represents a (frozen) ``ConstituentSet`` in the text planner, i.e. the
+    combination of two records (``nucleus`` and ``satellite``) by a rule of
+    the given relation type.
+
+    ``PlanConstituent``s are hash-consed, just like ``PlanMessage``s. Since
+    their constituents are hash-consed as well, two ``PlanConstituent``s
+    are equal iff they are the same object.
+    """
+    __slots__ = ('rel_type', 'nucleus', 'satellite', 'keys', '_hash',
+                 '__weakref__')
+
+    def __new__(cls, rel_type, nucleus, satellite):
+        """
+        :type rel_type: ``str``
+        :type nucleus: ``PlanMessage`` or ``PlanConstituent``
+        :type satellite: ``PlanMessage`` or ``PlanConstituent``
+        """
+        # the constituents are kept alive by the record, so their ids
+        # can't be reused while the record is stored
+        key = (rel_type, id(nucleus), id(satellite))
+        record = PLAN_CONSTITUENTS.get(key)
+        if record is not None:
+            return record
+
+        record = object.__new__(cls)
+        rel_type = intern(str(rel_type))
+        set_attribute = object.__setattr__
+        set_attribute(record, 'rel_type', rel_type)
+        set_attribute(record, 'nucleus', nucleus)
+        set_attribute(record, 'satellite', satellite)
+
+        # the index keys of the constituent set, cf.
+        # ``rules.constituent_keys``
+        keys = [("relType", rel_type)]
+        for role, child in (("nucleus", nucleus), ("satellite", satellite)):
+            if isinstance(child, PlanMessage):
+                keys.append( (role, child.msg_type) )
+        set_attribute(record, 'keys', tuple(keys))
+
+        # the hash value of the equivalent frozen ``ConstituentSet``, cf.
+        # ``test_constituent_hash``
+        values = {REL_TYPE: hash(rel_type), NUCLEUS: nucleus._hash,
+                  SATELLITE: satellite._hash}
+        hashval = 5831
+        for feature, feature_hash in zip(CONSTITUENT_FEATURES,
+                                         CONSTITUENT_FEATURE_HASHES):
+            hashval = (hashval * 37 + feature_hash) * 37 + values[feature]
+            hashval = int(hashval & 0x7FFFFFFF)
+        set_attribute(record, '_hash', hashval)
+        PLAN_CONSTITUENTS[key] = record
+        return record
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PlanConstituents can't be modified")
+
+    def __hash__(self):
+        return self._hash
+
+    # equal records are identical, i.e. they are compared by identity
+
+    def __reduce__(self):
+        return (PlanConstituent, (self.rel_type, self.nucleus,
+                                  self.satellite))
+
+    def __repr__(self):
+        return "PlanConstituent({0}, {1!r}, {2!r})".format(self.rel_type,
+            self.nucleus, self.satellite)
+
+    def to_featstruct(self):
+        """
+        :rtype: ``ConstituentSet``
+        :return: a new, frozen ``ConstituentSet``
+        """
+        constituent_set = ConstituentSet(relType=self.rel_type,
+            nucleus=self.nucleus.to_featstruct(),
+            satellite=self.satellite.to_featstruct())
+        constituent_set.freeze()
+        return constituent_set
+
+
+# all records that currently exist, cf. ``PlanMessage.__new__`` and
+# ``PlanConstituent.__new__``
+PLAN_MESSAGES = weakref.WeakValueDictionary() # Message -> PlanMessage
+# (relation type, id of nucleus, id of satellite) -> PlanConstituent
+PLAN_CONSTITUENTS = weakref.WeakValueDictionary()
+
+
+def to_record(featstruct):
+    """
+    converts a ``Message`` or a ``ConstituentSet`` (with a relation type, a
+    nucleus and a satellite) into a planner record.
+
+    :type featstruct: ``Message`` or ``ConstituentSet``
+    :rtype: ``PlanMessage`` or ``PlanConstituent``
+    """
+    if MSG_TYPE in featstruct:
+        return PlanMessage(featstruct)
+    return PlanConstituent(featstruct[REL_TYPE],
+                           to_record(featstruct[NUCLEUS]),
+                           to_record(featstruct[SATELLITE]))
+
+
+def to_featstruct(record):
+    """
+    converts a planner record back into a (frozen) ``Message`` or
+    ``ConstituentSet``.
+
+    :type record: ``PlanMessage`` or ``PlanConstituent``
+    :rtype: ``Message`` or ``ConstituentSet``
+    """
+    return record.to_featstruct()
+
+
+def record_namespace(records):
+    """
+    does the same as ``rules.message_namespace`` for a search state made of
+    records, i.e. maps message types to the original ``Message``s (which
+    ``Rule`` conditions may inspect).
+
+    :type records: ``set`` of ``PlanMessage``s and/or ``PlanConstituent``s
+    :rtype: ``dict`` of (``str``, ``Message``)
+    """
+    namespace = {}
+    for record in records:
+        if isinstance(record, PlanMessage):
+            namespace[record.msg_type] = record.message
+    return namespace
+
+
+def index_records(records):
+    """
+    does the same as ``rules.index_constituents`` for records.
+
+    :type records: ``list`` or ``set`` of ``PlanMessage``s and/or
+    ``PlanConstituent``s
+    :rtype: ``dict`` of (``tuple``, ``list``)
+    """
+    index = {None: []}
+    for record in records:
+        index[None].append(record)
+        for key in record.keys:
+            index.setdefault(key, []).append(record)
+    return index
+
+
+def test_constituent_hash():
+    """
+    checks that records have the same hash value as the (frozen) feature
+    structures they represent, which the planner relies on (cf.
+    ``PlanConstituent.__new__``).
+    """
+    from messages import Message
+    messages = []
+    for msg_type, title in (('id', 'Grundlagen der Computerlinguistik'),
+                            ('extra', 'Grundlagen der Computerlinguistik'),
+                            ('usermodel_match', 'Natural Language '
+                                                'Understanding')):
+        message = Message(msg_type)
+        message['title'] = title
+        message['pages'] = 572
+        messages.append(message)
+
+    elaboration = ConstituentSet(relType='Elaboration',
+                                 nucleus=messages[0], satellite=messages[1])
+    sequence = ConstituentSet(relType='Sequence', nucleus=elaboration,
+                              satellite=messages[2])
+    sequence.freeze() # also freezes the nested feature structures
+    for featstruct in messages + [elaboration, sequence]:
+        record = to_record(featstruct)
+        assert hash(record) == hash(featstruct), featstruct
+        assert hash(record.to_featstruct()) == hash(featstruct)
+        assert record.to_featstruct() == featstruct
+
+
+def test_shared_records():
+    """
+    checks that equal messages (e.g. of different books) are represented by
+    the same record, which can't be modified (and neither can its message).
+    """
+    from messages import Message
+    message, other_message = Message('id'), Message('id')
+    for msg in (message, other_message):
+        msg['title'] = 'Grundlagen der Computerlinguistik'
+    record = PlanMessage(message)
+    assert PlanMessage(other_message) is record
+    assert record.to_featstruct() == other_message
+    for modify in (lambda: setattr(record, 'msg_type', 'extra'),
+                   lambda: record.message.__setitem__('title', 'Foo')):
+        try:
+            modify()
+        except (AttributeError, ValueError):
+            pass
+        else:
+            raise AssertionError("a shared record was modified")
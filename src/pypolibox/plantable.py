@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Arne Neumann <arne-neumann@web.de>
+
+"""
+The ``plantable`` module compiles the ``Rules`` of the text planner into a
+decision table of text plan skeletons (cf. ``textplan.textplan_skeleton``).
+
+Rules only 'see' the message types of a search state and the outcome of
+their conditions, which are evaluated on the messages that haven't been
+combined, yet. Each condition either checks if a message type exists or
+refers to the messages themselves (e.g. ``len(usermodel_match) >=
+len(usermodel_nomatch)``), so its outcome in any search state follows from
+the message types of the state and from its outcome on all messages of the
+book. The text plan of a book is therefore determined by its *signature*,
+i.e. its message types and the outcome of all rule conditions on its
+messages (cf. ``plan_signature``).
+
+``compile_plan_table`` enumerates the signatures offline: for each
+combination of message types that the rules know, it plans synthetic books
+whose messages differ in length (the only property of a message that the
+conditions look at, apart from its type). At runtime, ``PlanTable.get``
+only computes the signature of a book and looks up its skeleton, which is
+filled with the book's messages (cf. ``textplan.fill_skeleton``). Books
+whose signature isn't in the table are planned by the search::
+
+    table = compile_plan_table()
+    table.save("plans.table")
+    plan = generate_textplan(messages, plan_table=load_plan_table(
+        "plans.table"))
+
+``check_plan_table`` (or ``pypolibox-compile-plans --check``) verifies that
+the table returns the same plans as the search.
+
+The synthetic messages have no content (only 0 to ``MESSAGE_LENGTHS`` - 1
+numbered attributes), i.e. the table assumes that conditions only check if
+a message type exists (``exists("extra", locals())``) and compare the
+lengths of messages (``len(usermodel_match) >= len(usermodel_nomatch)``).
+A condition that looks at the content of a message (e.g.
+``usermodel_match['keywords']``) or compares a length to a number would
+have the same outcome for all synthetic books, but not for real ones.
+``compile_plan_table`` and ``load_plan_table`` reject rules with such
+conditions (cf. ``check_condition``).
+"""
+
+import sys
+import argparse
+import itertools
+import cPickle as pickle
+from nltk.featstruct import Feature
+
+from rules import (Rules, ConstituentSet, compile_condition,
+                   evaluate_condition, check_condition, rules_digest)
+from messages import Message
+from textplan import (DEFAULT_STRATEGY, STRATEGIES, _NOT_CACHED,
+                      generate_textplan, textplan_skeleton)
+from database import file_version
+from util import freeze_all_messages
+
+PLAN_TABLE_VERSION = 1 # incremented whenever the file format changes
+# the synthetic messages of a type (referred to by a condition) have 0, 1,
+# ..., MESSAGE_LENGTHS - 1 attributes, which covers all orderings of the
+# lengths of two messages
+MESSAGE_LENGTHS = 3
+
+
+class PlanTable(object):
+    """
+    maps the signatures of books (cf. ``plan_signature``) to the skeletons
+    of their text plans.
+    """
+    def __init__(self, conditions, rules_digest, strategy=DEFAULT_STRATEGY,
+                 skeletons=None):
+        """
+        :param conditions: the distinct conditions of the rules the table was
+        compiled for (cf. ``rule_conditions``)
+        :type conditions: ``list`` of ``str``
+        :param rules_digest: identifies these rules (cf. ``rules_digest``)
+        :type rules_digest: ``str``
+        :param strategy: the search strategy the skeletons were planned with
+        (cf. ``textplan.generate_textplan``)
+        :type strategy: ``str``
+        :param skeletons: maps signatures to skeletons (None, if books with
+        this signature can't be planned)
+        :type skeletons: ``dict`` or ``NoneType``
+        """
+        self.conditions = conditions
+        self.compiled_conditions = [compile_condition(condition)
+                                    for condition in conditions]
+        self.rules_digest = rules_digest
+        self.strategy = strategy
+        if skeletons is None:
+            skeletons = {}
+        self.skeletons = skeletons
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.skeletons)
+
+    def signature(self, messages):
+        """
+        :type messages: ``list`` or ``set`` of ``Message``s
+        :rtype: ``tuple`` or ``NoneType``
+        """
+        return plan_signature(messages, self.compiled_conditions)
+
+    def get(self, messages):
+        """
+        returns the skeleton of the text plan of a book.
+
+        :param messages: the (frozen) messages of a book
+        :type messages: ``list`` or ``set`` of ``Message``s
+        :rtype: ``tuple`` or ``str`` or ``NoneType``
+        :return: the skeleton (None, if the messages can't be planned) or
+        ``textplan._NOT_CACHED``, if the table doesn't cover their signature
+        """
+        skeleton = self.skeletons.get(self.signature(messages), _NOT_CACHED)
+        if skeleton is _NOT_CACHED:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return skeleton
+
+    def save(self, path):
+        """
+        writes the table to a file (cf. ``load_plan_table``).
+
+        :type path: ``str``
+        """
+        with open(path, 'wb') as table_file:
+            pickle.dump({'version': PLAN_TABLE_VERSION,
+                         'conditions': self.conditions,
+                         'rules_digest': self.rules_digest,
+                         'strategy': self.strategy,
+                         'skeletons': self.skeletons},
+                        table_file, pickle.HIGHEST_PROTOCOL)
+
+    def stats(self):
+        """
+        :rtype: ``dict``
+        :return: the number of signatures in the table and the number of
+        lookups that were answered (hits) or not (misses)
+        """
+        return {'signatures': len(self), 'hits': self.hits,
+                'misses': self.misses}
+
+    def __str__(self):
+        return "{signatures} signatures, {hits} hits, " \
+               "{misses} misses".format(**self.stats())
+
+
+def plan_signature(messages, conditions):
+    """
+    returns the signature of a book, i.e. its message types and the outcome
+    of all rule conditions on its messages.
+
+    :type messages: ``list`` or ``set`` of ``Message``s
+    :param conditions: compiled rule conditions (cf. ``rule_conditions``)
+    :type conditions: ``list`` of ``code``
+    :rtype: ``tuple`` or ``NoneType``
+    :return: a (message types, condition outcomes) tuple or None, if the
+    messages don't have distinct message types
+    """
+    namespace = {}
+    for message in messages:
+        if not isinstance(message, Message):
+            return None
+        msg_type = message[Feature("msgType")]
+        if msg_type in namespace:
+            return None
+        namespace[msg_type] = message
+    return (tuple(sorted(namespace)),
+            tuple(bool(evaluate_condition(condition, namespace))
+                  for condition in conditions))
+
+
+def rule_conditions(rules):
+    """
+    returns the distinct conditions of the rules (in the order of the
+    rules).
+
+    :type rules: ``list`` of ``Rule``s
+    :rtype: ``list`` of ``str``
+    """
+    conditions = []
+    for rule in rules:
+        for condition in rule.conditions:
+            if condition not in conditions:
+                conditions.append(condition)
+    return conditions
+
+
+def rule_message_types(rules):
+    """
+    returns all message types that the nucleus and satellite prototypes of
+    the rules refer to. Messages of other types can't be combined by any
+    rule.
+
+    :type rules: ``list`` of ``Rule``s
+    :rtype: ``list`` of ``str``
+    """
+    msg_types = set()
+    def collect(prototype):
+        if isinstance(prototype, Message):
+            if Feature("msgType") in prototype:
+                msg_types.add(prototype[Feature("msgType")])
+        elif isinstance(prototype, ConstituentSet):
+            for role in ("nucleus", "satellite"):
+                if Feature(role) in prototype:
+                    collect(prototype[Feature(role)])
+
+    for rule in rules:
+        for name, prototype in rule.nucleus + rule.satellite:
+            collect(prototype)
+    return sorted(msg_types)
+
+
+def synthetic_messages(msg_types, lengths):
+    """
+    creates the messages of a synthetic book.
+
+    :param msg_types: the message types of the book
+    :type msg_types: ``list`` of ``str``
+    :param lengths: maps message types to the number of attributes their
+    message should have (default: 0)
+    :type lengths: ``dict`` of (``str``, ``int``)
+    :rtype: ``list`` of ``Message``s
+    """
+    messages = []
+    for msg_type in msg_types:
+        message = Message(msg_type)
+        for attribute in range(lengths.get(msg_type, 0)):
+            message['attribute{0}'.format(attribute)] = attribute
+        messages.append(message)
+    return freeze_all_messages(messages)
+
+
+def compile_plan_table(rules=None, strategy=DEFAULT_STRATEGY,
+                       lengths=MESSAGE_LENGTHS):
+    """
+    compiles the rules into a ``PlanTable``, by planning a synthetic book
+    for each signature. The messages of these books have all combinations
+    of the message types the rules know (cf. ``rule_message_types``).
+    Messages that are referred to by a condition are created with each
+    length in ``range(lengths)``.
+
+    :type rules: ``list`` of ``Rule``s or ``NoneType``
+    :param strategy: the search strategy used to plan the books
+    :type strategy: ``str``
+    :param lengths: the number of different lengths of messages that
+    conditions refer to
+    :type lengths: ``int``
+    :rtype: ``PlanTable``
+    :raises ValueError: if a condition can't be compiled (cf.
+    ``check_condition``)
+    """
+    if rules is None:
+        rules = Rules().rules
+    conditions = rule_conditions(rules)
+    for condition in conditions:
+        check_condition(condition)
+    table = PlanTable(conditions, rules_digest(rules), strategy)
+
+    referred_names = set()
+    for condition in table.compiled_conditions:
+        referred_names.update(condition.co_names)
+    msg_types = rule_message_types(rules)
+
+    for size in range(1, len(msg_types) + 1):
+        for present in itertools.combinations(msg_types, size):
+            varied = [msg_type for msg_type in present
+                      if msg_type in referred_names]
+            for message_lengths in itertools.product(range(lengths),
+                                                     repeat=len(varied)):
+                messages = synthetic_messages(present,
+                    dict(zip(varied, message_lengths)))
+                signature = table.signature(messages)
+                if signature in table.skeletons:
+                    continue
+                plan = generate_textplan(messages, rules, strategy=strategy)
+                if plan is None:
+                    table.skeletons[signature] = None
+                else:
+                    table.skeletons[signature] = \
+                        textplan_skeleton(plan["children"])
+    return table
+
+
+__plan_tables = {} # caches the tables loaded by ``load_plan_table``
+
+def load_plan_table(path, rules=None):
+    """
+    loads a table written by ``PlanTable.save`` (only once per process,
+    unless the file is modified).
+
+    :type path: ``str``
+    :param rules: the rules the table will be used with (default:
+    ``Rules().rules``)
+    :type rules: ``list`` of ``Rule``s or ``NoneType``
+    :rtype: ``PlanTable``
+    :raises ValueError: if the file isn't a plan table of these rules or if
+    the rules have conditions that a table can't represent (cf.
+    ``check_condition``)
+    """
+    version = file_version(path)
+    if __plan_tables.get(path, (None, None))[0] != version:
+        with open(path, 'rb') as table_file:
+            data = pickle.load(table_file)
+        if data.get('version') != PLAN_TABLE_VERSION:
+            raise ValueError("{0} isn't a plan table of version {1}".format(
+                path, PLAN_TABLE_VERSION))
+        __plan_tables[path] = (version, PlanTable(data['conditions'],
+            data['rules_digest'], data['strategy'], data['skeletons']))
+
+    table = __plan_tables[path][1]
+    if rules is None:
+        rules = Rules().rules
+    if table.rules_digest != rules_digest(rules):
+        raise ValueError("{0} was compiled for different rules. Please "
+                         "recompile it with pypolibox-compile-plans.".format(
+                         path))
+    for condition in table.conditions:
+        check_condition(condition)
+    return table
+
+
+def check_plan_table(table, books, rules=None):
+    """
+    checks if the table returns the same text plans as the search.
+
+    :type table: ``PlanTable``
+    :param books: the messages of each book
+    :type books: iterable of ``list``s of ``Message``s
+    :type rules: ``list`` of ``Rule``s or ``NoneType``
+    :rtype: ``tuple`` of (``int``, ``int``, ``list``)
+    :return: the number of books, the number of books covered by the table
+    and the messages of all books whose plans differ
+    """
+    if rules is None:
+        rules = Rules().rules
+    checked = covered = 0
+    mismatches = []
+    for messages in books:
+        messages = list(set(freeze_all_messages(messages)))
+        checked += 1
+        skeleton = table.get(messages)
+        if skeleton is _NOT_CACHED:
+            continue
+        covered += 1
+        plan = generate_textplan(messages, rules, strategy=table.strategy)
+        if plan is None:
+            searched = None
+        else:
+            searched = textplan_skeleton(plan["children"])
+        if searched != skeleton:
+            mismatches.append(messages)
+    return checked, covered, mismatches
+
+
+def test_check_condition():
+    """
+    checks that conditions on the types and lengths of messages can be
+    compiled into a plan table, while conditions on their content can't.
+    """
+    for condition in Rules().rules[0].conditions + [
+            'exists("extra", locals())',
+            'exists("lastbook_match", locals()) is False',
+            'len(usermodel_match) >= len(usermodel_nomatch)']:
+        check_condition(condition)
+    for condition in ('len(usermodel_match) > 3', 'extra',
+                      "usermodel_match['keywords'] == 2",
+                      'exists("extra", locals()) and extra.get("year")',
+                      'len(usermodel_match["keywords"]) > 0'):
+        try:
+            check_condition(condition)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("{0} wasn't rejected".format(condition))
+
+
+def main():
+    """
+    compiles the rules into a plan table (cf. ``compile_plan_table``), e.g.::
+
+        pypolibox-compile-plans plans.table --check
+        pypolibox -k semantics --plan-table plans.table
+    """
+    parser = argparse.ArgumentParser(
+        description='compile the text planning rules into a plan table')
+    parser.add_argument("table_file", help="path of the plan table")
+    parser.add_argument("--strategy", choices=STRATEGIES,
+        default=DEFAULT_STRATEGY,
+        help="search strategy used to plan the table. default: {0}".format(
+            DEFAULT_STRATEGY))
+    parser.add_argument("--check", action='store_true',
+        help=("check that the table returns the same plans as the search "
+            "for the books of all test queries (cf. debug.testqueries)"))
+    args = parser.parse_args(sys.argv[1:])
+
+    table = compile_plan_table(strategy=args.strategy)
+    table.save(args.table_file)
+    print "wrote {0} signatures to {1}".format(len(table), args.table_file)
+
+    if args.check:
+        from debug import genallmessages, testqueries
+        books = (book.messages.values()
+                 for query in testqueries
+                 for book in genallmessages(query).books)
+        checked, covered, mismatches = check_plan_table(table, books)
+        print "{0} books checked, {1} covered by the table, {2} " \
+              "mismatches".format(checked, covered, len(mismatches))
+        if mismatches:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,17 +10,29 @@ code in case it is run from the command line without any arguments.
 """
 
 import sys
+import json
+import shlex
+import itertools
 from nltk.featstruct import Feature
 
-from database import Query, Results, Book, Books
+from database import (Query, Results, Book, Books, RESULT_CACHE,
+                      QueryArgumentError, query_parser, search_options)
 from facts import Facts, AllFacts
 from propositions import Propositions, AllPropositions
-from textplan import (TextPlan, TextPlans, generate_textplan,
-                      linearize_textplan, textplans2xml)
+from textplan import (TextPlan, TextPlans, TextPlanCache, PLAN_CACHE,
+                      MEMO_SIZE, generate_textplan, linearize_textplan,
+                      textplans2xml, planning_pool, submit_books,
+                      collect_plans)
+from plantable import load_plan_table
 from hlds import etreeprint
+from util import LRUCache, ensure_utf8
 from messages import Message, Messages, AllMessages
 from rules import ConstituentSet, Rule, Rules
 
+# number of queries whose books are sent to the planning processes at once
+# (per process) when answering a batch of queries
+BATCH_QUERIES_PER_WORKER = 4
+
 
 def test():
     """test and realize all text plans for all test queries"""
@@ -31,18 +43,311 @@ def test():
             check_and_realize_textplan(textplan)
 
 
+def get_books(query, result_cache=RESULT_CACHE):
+    """
+    retrieves the books matching a database query (using the backend
+    selected by the query arguments).
+
+    :type query: ``Query``
+    :param result_cache: reuses the results of earlier queries with the
+    same arguments. if None, the database is always searched.
+    :type result_cache: ``ResultCache`` or ``NoneType``
+    :rtype: ``Books``
+    """
+    if result_cache is not None:
+        results = result_cache.get(query)
+        if results is not None:
+            return Books(results)
+
+    if query.query_args.catalog_file is not None:
+        from catalog import CatalogResults, load_catalog_file
+        results = CatalogResults(query,
+            load_catalog_file(query.query_args.catalog_file))
+    elif query.query_args.backend == 'numpy':
+        from catalog import CatalogResults
+        results = CatalogResults(query)
+    else:
+        results = Results(query)
+
+    if result_cache is not None:
+        result_cache.put(query, results)
+    return Books(results)
+
+
 def generate_textplans(query):
     """generates all text plans for a database query"""
-    books = Books(Results(query))
-    return TextPlans(AllMessages(AllPropositions(AllFacts(books))))
+    books = get_books(query)
+    if query.query_args.plan_cache is None:
+        plan_cache = PLAN_CACHE
+    else:
+        plan_cache = TextPlanCache(path=query.query_args.plan_cache)
+    plan_table = None
+    if query.query_args.plan_table is not None:
+        plan_table = load_plan_table(query.query_args.plan_table)
+
+    textplans = TextPlans(AllMessages(AllPropositions(AllFacts(books))),
+                          workers=query.query_args.workers,
+                          timeout=query.query_args.plan_timeout,
+                          plan_cache=plan_cache,
+                          search_options=search_options(query),
+                          plan_table=plan_table)
+    if plan_cache is not PLAN_CACHE:
+        plan_cache.close()
+    return textplans
+
+
+def generate_textplans_batch(queries, workers=None, timeout=None,
+                             plan_cache=PLAN_CACHE, plan_table=None):
+    """
+    generates all text plans for each of many database queries. In contrast
+    to calling ``generate_textplans`` for each query, the rules, the search
+    state memo, the text plan cache and (if ``workers`` > 1) the pool of
+    planning processes are only set up once and shared by all queries.
+
+    With several workers, the books of ``BATCH_QUERIES_PER_WORKER`` queries
+    per process are sent to the pool at once, so that the processes are
+    kept busy even if a query only returns a few books. Books of these
+    queries whose messages have the same fingerprint are planned only once.
 
+    The worker, plan cache and plan table arguments of the queries
+    themselves are ignored, but each query is planned with its own search options (cf.
+    ``database.search_options``).
 
-def initialize_openccg(lang='de'):
+    :param queries: ``Query`` instances or lists of query arguments
+    :type queries: iterable of ``Query``s or ``list``s of ``str``
+    :param workers: the number of planning processes. if None (or 1), all
+    books are planned in the current process.
+    :type workers: ``int`` or ``NoneType``
+    :param timeout: the maximum number of seconds a process may spend on
+    the plan of a single book (only used if workers > 1)
+    :type timeout: ``float`` or ``NoneType``
+    :type plan_cache: ``TextPlanCache`` or ``NoneType``
+    :type plan_table: ``PlanTable`` or ``NoneType``
+
+    :rtype: generator of ``TextPlans``
+    :return: the text plans of each query (in the same order as
+    ``queries``)
+    """
+    rules = Rules().rules
+    memo = LRUCache(maxsize=MEMO_SIZE)
+    queries = (query if isinstance(query, Query) else Query(query)
+               for query in queries)
+
+    if not workers > 1:
+        for query in queries:
+            allmessages = AllMessages(AllPropositions(AllFacts(
+                get_books(query))))
+            yield TextPlans(allmessages, rules=rules, memo=memo,
+                            plan_cache=plan_cache,
+                            search_options=search_options(query),
+                            plan_table=plan_table)
+        return
+
+    pool = planning_pool(rules, workers, timeout)
+    try:
+        while True:
+            chunk = list(itertools.islice(queries,
+                                          workers * BATCH_QUERIES_PER_WORKER))
+            if not chunk:
+                break
+            submitted = {}
+            submissions = []
+            for query in chunk:
+                allmessages = AllMessages(AllPropositions(AllFacts(
+                    get_books(query))))
+                options = search_options(query)
+                pending = submit_books(allmessages, pool, plan_cache,
+                                       submitted, options, plan_table)
+                submissions.append( (allmessages, pending) )
+            for allmessages, pending in submissions:
+                timed_plans = collect_plans(allmessages, pending, pool,
+                                            plan_cache)
+                yield TextPlans(allmessages, memo=memo,
+                                timed_plans=timed_plans)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def read_batch_queries(lines):
+    """
+    parses the queries of a batch file (cf. ``--batch``). Each non-empty
+    line contains one query, either as a JSON list of arguments, e.g.
+    ``["-k", "pragmatics", "-l", "English"]``, or as plain command line
+    arguments, e.g. ``-k pragmatics -l English``.
+
+    Lines that can't be split into arguments (e.g. because of an unclosed
+    quote or malformed JSON) are yielded with an error message instead of
+    arguments, so that the remaining queries can still be answered.
+
+    :type lines: iterable of ``str``
+    :rtype: generator of (``int``, ``list`` of ``str`` or ``NoneType``,
+    ``str`` or ``NoneType``) tuples
+    :return: the line number, the arguments (or None) and the error message
+    (or None) of each query
+    """
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if line.startswith('['):
+                arguments = json.loads(line)
+                if not isinstance(arguments, list) or not all(
+                        isinstance(arg, (basestring, int))
+                        and not isinstance(arg, bool)
+                        for arg in arguments):
+                    raise ValueError("a JSON query must be a list of "
+                                     "strings")
+                argv = [ensure_utf8(arg) for arg in arguments]
+            else:
+                argv = shlex.split(line)
+        except ValueError, err:
+            yield line_number, None, str(err)
+            continue
+        yield line_number, argv, None
+
+
+def answer_batch(batch_query, output=sys.stdout):
+    """
+    answers all queries of the batch file given by ``--batch`` and writes
+    one JSON object per query to ``output``, e.g.::
+
+        {"line": 1, "query": ["-k", "pragmatics"], "textplans": "<xml>..."}
+
+    The search backend, the search strategy, the number of workers, the
+    plan timeout, the plan cache, the plan table and the output format are
+    taken from ``batch_query`` (the query arguments of each line may
+    override the search backend and the search strategy). Queries that
+    can't be parsed are reported as ``{"line": ..., "error": ...}``, where
+    the error is the message of the argument parser (cf.
+    ``database.BatchArgumentParser``).
+
+    With ``--cache-output``, repeated queries are answered from the
+    serialized text plans in ``RESULT_CACHE``. Such answers and errors are
+    written immediately, i.e. (with several workers) possibly before the
+    answers of earlier lines.
+
+    :param batch_query: the query containing the ``--batch`` argument
+    :type batch_query: ``Query``
+    """
+    args = batch_query.query_args
+    shared_argv = []
+    if args.backend is not None:
+        shared_argv += ['--backend', args.backend]
+    if args.catalog_file is not None:
+        shared_argv += ['--catalog-file', args.catalog_file]
+    for option, value in sorted(search_options(batch_query).items()):
+        shared_argv += ['--' + option.replace('_', '-'), str(value)]
+
+    if args.batch == '-':
+        batch_file = sys.stdin
+    else:
+        batch_file = open(args.batch, 'r')
+    if args.plan_cache is None:
+        plan_cache = PLAN_CACHE
+    else:
+        plan_cache = TextPlanCache(path=args.plan_cache)
+    plan_table = None
+    if args.plan_table is not None:
+        plan_table = load_plan_table(args.plan_table)
+
+    parsed = []
+    def queries():
+        for line_number, argv, error in read_batch_queries(batch_file):
+            if error is not None:
+                output.write(json.dumps({"line": line_number,
+                                         "error": error}) + "\n")
+                continue
+            try:
+                query = Query(shared_argv + argv,
+                              parser=query_parser(batch=True))
+            except QueryArgumentError, err:
+                output.write(json.dumps({"line": line_number,
+                    "error": str(err)}) + "\n")
+                continue
+            except AssertionError, err:
+                output.write(json.dumps({"line": line_number,
+                    "error": " ".join(str(err).split())}) + "\n")
+                continue
+            if args.output_format == 'textplan-xml':
+                result = RESULT_CACHE.get_output(query, args.output_format)
+                if result is not None:
+                    output.write(json.dumps({"line": line_number,
+                        "query": argv, "textplans": result}) + "\n")
+                    continue
+            parsed.append( (line_number, argv, query) )
+            yield query
+
+    try:
+        for textplans in generate_textplans_batch(queries(),
+                workers=args.workers, timeout=args.plan_timeout,
+                plan_cache=plan_cache, plan_table=plan_table):
+            line_number, argv, query = parsed.pop(0)
+            if args.output_format == 'textplan-xml':
+                result = etreeprint(textplans2xml(textplans), debug=False)
+                RESULT_CACHE.put_output(query, args.output_format, result)
+            else:
+                result = [str(plan) for plan in textplans.document_plans]
+            output.write(json.dumps({"line": line_number, "query": argv,
+                                     "textplans": result}) + "\n")
+    finally:
+        if batch_file is not sys.stdin:
+            batch_file.close()
+        if plan_cache is not PLAN_CACHE:
+            plan_cache.close()
+
+
+def test_read_batch_queries():
+    """
+    checks that lines of a batch file which can't be split into arguments
+    are reported as errors, without affecting the other lines.
+    """
+    lines = ['-k pragmatics', "-k o'reilly", '',
+             '["-k", "semantics"', '["-k", null]',
+             '["-l", "English", "-r", 3]']
+    parsed = list(read_batch_queries(lines))
+    assert [line_number for (line_number, argv, error) in parsed] == \
+        [1, 2, 4, 5, 6]
+    assert parsed[0] == (1, ['-k', 'pragmatics'], None)
+    for line_number, argv, error in parsed[1:4]:
+        assert argv is None and error, (line_number, error)
+    assert parsed[4] == (6, ['-l', 'English', '-r', '3'], None)
+
+
+def test_batch_query_errors():
+    """
+    checks that invalid batch queries raise an exception containing the
+    message of the argument parser (instead of printing their usage and
+    exiting).
+    """
+    for argv, message in ((['--foo'], 'unrecognized arguments: --foo'),
+                          (['-r', 'x'], "invalid int value: 'x'"),
+                          (['-h'], 'unrecognized arguments: -h')):
+        try:
+            Query(argv, parser=query_parser(batch=True))
+        except QueryArgumentError, err:
+            assert message in str(err), (argv, str(err))
+        else:
+            raise AssertionError("{0} wasn't rejected".format(argv))
+
+
+def initialize_openccg(lang='de', server_port=None, cache_path=None):
     """
     starts OpenCCG's tccg realizer as a server in the background (ca. 20s).
+    If the port of a running ``pypolibox-tccg-server`` is given, connects to
+    it instead. Realizations are cached (in memory or, if ``cache_path`` is
+    given, in an SQLite database).
     """
-    from realization import OpenCCG
-    return OpenCCG(lang=lang)
+    if server_port is not None:
+        from realization import OpenCCGClient
+        return OpenCCGClient(port=server_port)
+    from realization import OpenCCG, RealizationCache, REALIZATION_CACHE
+    if cache_path is None:
+        cache = REALIZATION_CACHE
+    else:
+        cache = RealizationCache(path=cache_path)
+    return OpenCCG(lang=lang, cache=cache)
 
 
 def check_and_realize_textplan(openccg, textplan, lexicalize_message_block, phrase2sentence):
@@ -89,6 +394,17 @@ def main():
         sys.stderr.write("Output format must be one of: {}\n".format(valid_output_formats))
         sys.exit(1)
 
+    if query.query_args.cache_output:
+        RESULT_CACHE.cache_output = True
+
+    if query.query_args.batch is not None:
+        if output_format not in ('textplan-xml', 'textplan-featstruct'):
+            sys.stderr.write("--batch requires the output format "
+                             "textplan-xml or textplan-featstruct\n")
+            sys.exit(1)
+        answer_batch(query)
+        return
+
     try:
         lexicalize_messageblocks = \
             __import__("lexicalize_messageblocks_%s" % query.query_args.output_language, globals(), locals(), [], -1)
@@ -104,11 +420,21 @@ def main():
     lexicalize_message_block = lexicalize_messageblocks.lexicalize_message_block
     phrase2sentence = lexicalization.phrase2sentence
 
+    if output_format == 'textplan-xml':
+        xml = RESULT_CACHE.get_output(query, output_format)
+        if xml is None:
+            xml = etreeprint(textplans2xml(generate_textplans(query)),
+                             debug=False)
+            RESULT_CACHE.put_output(query, output_format, xml)
+        print xml
+        return
 
     textplans = generate_textplans(query)
 
     if output_format == 'openccg':
-        openccg = initialize_openccg(lang=query.query_args.output_language)
+        openccg = initialize_openccg(lang=query.query_args.output_language,
+                                     server_port=query.query_args.tccg_server,
+                                     cache_path=query.query_args.realization_cache)
         print "{} text plans will be generated.".format(len(textplans.document_plans))
         for i, textplan in enumerate(textplans.document_plans):
             print "Generating text plan #%i:\n" % i
@@ -152,9 +478,6 @@ def main():
             print "Text plan #%i:\n" % i
             print textplan, "\n\n"
 
-    else: # output_format == 'textplan-xml'
-        etreeprint(textplans2xml(textplans))
-
 
 if __name__ == "__main__":
     main()
@@ -9,14 +9,26 @@ the OpenCCG surface realizer and parse its output string.
 
 import os
 import re
+import sys
+import json
+import argparse
+import hashlib
+import sqlite3
+import threading
+import SocketServer
+import socket
 import pexpect
 import time
-from tempfile import NamedTemporaryFile
+from Queue import Queue
+from multiprocessing.pool import ThreadPool
+from tempfile import NamedTemporaryFile, gettempdir, mkstemp
 from commands import getstatusoutput
 from copy import deepcopy
+from lxml import etree
 
 from hlds import (Diamond, Sentence, diamond2sentence, add_nom_prefixes,
                   create_hlds_file)
+from util import LatencyHistogram, LRUCache
 
 
 if __name__ == '__main__':
@@ -24,6 +36,18 @@ if __name__ == '__main__':
 else:
     GRAMMAR_DIR = os.path.join(os.path.dirname(__file__), 'grammar')
 
+TCCG_SERVER_PORT = 4242 # default port of the OpenCCGServer (on localhost)
+TCCG_PROMPT = "\ntccg>" # tccg waits for input after printing this
+
+# HLDS XML files are handed over to tccg via a RAM-backed directory (if
+# available), so that realizing a sentence doesn't need any disk I/O
+if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+    TCCG_TMP_DIR = '/dev/shm'
+else:
+    TCCG_TMP_DIR = gettempdir()
+
+REALIZATION_CACHE_SIZE = 10000 # max. number of sentences cached in memory
+
 
 class OpenCCG(object):
     """
@@ -31,24 +55,37 @@ class OpenCCG(object):
     can either be run as a JSON-RPC server or simply imported as a Python
     module.
     """
-    def __init__(self, grammar_dir=GRAMMAR_DIR, lang='de'):
+    def __init__(self, grammar_dir=GRAMMAR_DIR, lang='de', cache=None):
         """
         spawns the OpenCCG/tccg server as a process
 
         Parameters
         ----------
         grammar_dir : path to the directory that contains the grammar
+        cache : RealizationCache or None
+            if given, sentences that were already realized won't be sent
+            to tccg again (unless the cache belongs to another grammar)
         """
-        current_dir = os.getcwd()
-        grammar_path = os.path.join(GRAMMAR_DIR, lang)
+        self.lang = lang
+        if cache is not None and not cache.accepts(grammar_dir):
+            cache = None
+        self.cache = cache
+        grammar_path = os.path.join(grammar_dir, lang)
         tccg_binary = "tccg"
 
-        os.chdir(grammar_path)
-        self._server = pexpect.spawn(tccg_binary)
+        # tccg is started in the grammar directory (without changing the
+        # working directory of this process)
+        self._server = pexpect.spawn(tccg_binary, cwd=grammar_path)
         print "starting tccg as a server with this path: %s" % tccg_binary
-        os.chdir(current_dir)
+        # each instance uses its own file to hand over HLDS XML to tccg
+        tmp_file_descriptor, self.tmp_file_path = mkstemp(
+            prefix="pypolibox-tccg-", suffix=".xml", dir=TCCG_TMP_DIR)
+        os.close(tmp_file_descriptor)
+        self._pending_prompts = 1 # tccg prints its prompt once it's ready
+        self.latencies = LatencyHistogram() # time needed per sentence
         print "checking tccg settings ..."
-        self._server.expect("\ntccg>") # wait for the tccg input prompt
+        self._server.expect(TCCG_PROMPT) # wait for the tccg input prompt
+        self._pending_prompts = 0
         print "Okay, here you go."
         print "current settings:\n{0}".format(self.parse(":sh"))
 
@@ -58,50 +95,54 @@ class OpenCCG(object):
 
         It returns a Python data-structure, while the parse()
         function returns a JSON object
+
+        The command is sent to ``tccg`` and its output is read until the next
+        ``tccg>`` input prompt appears (i.e. without any fixed delays). Each
+        command is answered by exactly one prompt, so if we stop waiting for
+        an answer (timeout), the prompts that are still outstanding are
+        consumed before the next command is sent. This way, the output of an
+        earlier command is never mistaken for the output of a later one.
         
         :return: if raw_output=True, the raw response string from the server 
         will be returned. otherwise, a list of dictionaries will be returned 
         (one for each input sentence).
         :rtype: ``str`` OR ``list`` of ``dict``s
         """
-        # clean up anything leftover
-        while True:
-            try:
-                # the second argument is a forced delay (in seconds)
-                # EVERY parse must incur.  
-                # TODO make this as small as possible.
-                ch = self._server.read_nonblocking (4000, 3) #originally: 0.3s
-            except pexpect.TIMEOUT:
-                break
-
-        self._server.sendline(text)
         # How much time should we give the parser to parse it?
         max_expected_time = 20.0
         if verbose:
             print "Timeout", max_expected_time
-        end_time = time.time() + max_expected_time 
-        incoming = ""
-        while True: 
-            # Time left, read more data
+
+        # resync: wait for the answers to earlier commands that timed out
+        while self._pending_prompts > 0:
             try:
-                ch = self._server.read_nonblocking (2000, 2)
-                freshlen = len(ch)
-                time.sleep (0.0001)
-                incoming = incoming + ch
-                if "\ntccg>" in incoming:
-                    break
+                self._server.expect(TCCG_PROMPT, timeout=max_expected_time)
+                self._pending_prompts -= 1
+            except pexpect.TIMEOUT:
+                return {'error': "tccg is still busy with an earlier command",
+                        'input': text,
+                        'output': self._server.before}
+        # clean up anything leftover (without waiting for it)
+        while True:
+            try:
+                self._server.read_nonblocking(4000, 0)
             except pexpect.TIMEOUT:
-                if verbose:
-                    print "Timeout" 
-                if end_time - time.time() < 0:
-                    return {'error': "timed out after %f seconds" % max_expected_time, 
-                            'input': text,
-                            'output': incoming}
-                else:
-                    continue
-            except pexpect.EOF:
                 break
 
+        self._server.sendline(text)
+        self._pending_prompts += 1
+        try:
+            self._server.expect(TCCG_PROMPT, timeout=max_expected_time)
+        except pexpect.TIMEOUT:
+            if verbose:
+                print "Timeout"
+            return {'error': "timed out after %f seconds" % max_expected_time,
+                    'input': text,
+                    'output': self._server.before}
+        self._pending_prompts -= 1
+        # the echoed command, tccg's answer and the new input prompt
+        incoming = self._server.before + self._server.after
+
         if raw_output == True: # plain text results returned by ``tccg``
             return incoming
 
@@ -116,29 +157,486 @@ class OpenCCG(object):
 
         :type featstruct: ``Diamond`` or ``Sentence``
         """
-        temp_sentence = deepcopy(featstruct)
-        
-        if isinstance(featstruct, Diamond):
-            temp_sentence = diamond2sentence(temp_sentence)
+        return self.realize_xml(featstruct2hlds_xml(featstruct))
 
-        add_nom_prefixes(temp_sentence)
-        sentence_xml_str = create_hlds_file(temp_sentence, mode="realize",
-                                            output="xml")
-    
-        tmp_file = open("pypolibox-tccg.tmp", "w")
+    def realize_xml(self, sentence_xml_str):
+        """
+        realizes a sentence that is already converted into HLDS-XML (cf. 
+        ``featstruct2hlds_xml``).
+
+        :type sentence_xml_str: ``str``
+        :rtype: ``list`` of ``str``
+        """
+        if self.cache is not None:
+            key = hlds_fingerprint(sentence_xml_str, self.lang)
+            realizations = self.cache.get(key)
+            if realizations is not None:
+                return realizations
+
+        start_time = time.time()
+        tmp_file = open(self.tmp_file_path, "w")
         tmp_file.write(sentence_xml_str)
         tmp_file.close()
-        tmp_file_path = os.path.abspath(tmp_file.name)
-        self.tccg_output = self.realize_hlds(tmp_file_path)
+        self.tccg_output = self.realize_hlds(self.tmp_file_path)
         #os.remove(tmp_file_path)
-        return parse_tccg_generator_output(self.tccg_output)
+        if isinstance(self.tccg_output, dict):
+            raise Exception, "tccg error: {0}".format(
+                self.tccg_output['error'])
+        realizations = parse_tccg_generator_output(self.tccg_output)
+        self.latencies.add(time.time() - start_time)
+        if self.cache is not None:
+            self.cache.put(key, realizations)
+        return realizations
+
+    def realize_all(self, featstructs):
+        """
+        realizes several ``Diamond``s or ``Sentence``s one after another 
+        (cf. ``OpenCCGPool.realize_all`` for concurrent realization).
+
+        :type featstructs: ``list`` of ``Diamond``s or ``Sentence``s
+        :rtype: ``list`` of ``list``s of ``str``
+        :return: the realizations of each feature structure (in the same 
+        order as ``featstructs``)
+        """
+        return [self.realize_xml(featstruct2hlds_xml(featstruct))
+                for featstruct in featstructs]
 
     def realize_hlds(self, hlds_xml_filename):
         tccg_command_string = ":r {0}".format(hlds_xml_filename)
         return self.parse(tccg_command_string, verbose=False)
 
+    def is_alive(self):
+        """checks if the tccg process is still running"""
+        return self._server.isalive()
+
     def terminate(self):
         self._server.terminate()
+        if os.path.exists(self.tmp_file_path):
+            os.remove(self.tmp_file_path)
+
+
+class OpenCCGPool(object):
+    """
+    a pool of ``OpenCCG`` instances, i.e. of several warm ``tccg`` processes, 
+    which are started only once. Realizations are dispatched to whichever 
+    process is idle, so that several sentences can be realized at the same 
+    time (cf. ``realize_all``). Crashed processes are replaced by new ones.
+    """
+    def __init__(self, size=2, grammar_dir=GRAMMAR_DIR, lang='de',
+                 cache=None):
+        """
+        starts ``size`` tccg processes (concurrently, since each one takes 
+        ca. 20s to start).
+
+        Parameters
+        ----------
+        size : int
+            the number of tccg processes
+        grammar_dir : str
+            path to the directory that contains the grammar
+        lang : str
+            language of the grammar, e.g. 'de'
+        cache : RealizationCache or None
+            if given, sentences that were already realized won't be sent
+            to tccg again (and don't have to wait for an idle process), 
+            unless the cache belongs to another grammar
+        """
+        self.size = size
+        self.grammar_dir = grammar_dir
+        self.lang = lang
+        if cache is not None and not cache.accepts(grammar_dir):
+            cache = None
+        self.cache = cache
+        self.restarts = 0 # number of crashed tccg processes replaced so far
+        self.latencies = LatencyHistogram() # incl. waiting for idle process
+        self._idle = Queue()
+        # all running tccg processes (idle or busy), cf. ``terminate``
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        started, failures = Queue(), Queue()
+        def start_worker():
+            try:
+                started.put(self.__start_worker())
+            except Exception:
+                failures.put(sys.exc_info())
+        threads = [threading.Thread(target=start_worker) for i in range(size)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        while not started.empty():
+            self._idle.put(started.get())
+        if not failures.empty():
+            # a pool with too few processes could wait forever for an idle one
+            self.terminate()
+            exc_type, exc_value, exc_traceback = failures.get()
+            raise exc_type, exc_value, exc_traceback
+
+    def __start_worker(self):
+        """starts a tccg process (unless the pool was terminated)"""
+        worker = OpenCCG(grammar_dir=self.grammar_dir, lang=self.lang)
+        with self._lock:
+            if not self._closed:
+                self._workers.add(worker)
+                return worker
+        worker.terminate()
+        raise RuntimeError("the OpenCCGPool was terminated")
+
+    def __checkout(self):
+        """
+        waits for an idle tccg process (and replaces it, if it has crashed 
+        in the meantime)
+
+        :rtype: ``OpenCCG``
+        """
+        worker = self._idle.get()
+        if not worker.is_alive():
+            try:
+                worker = self.__restart(worker)
+            except:
+                # keep the crashed process, so that the next checkout 
+                # tries to replace it again
+                self._idle.put(worker)
+                raise
+        return worker
+
+    def __restart(self, worker):
+        """replaces a crashed tccg process with a new one"""
+        with self._lock:
+            self._workers.discard(worker)
+        try:
+            worker.terminate()
+        except (OSError, pexpect.ExceptionPexpect):
+            pass
+        self.restarts += 1
+        return self.__start_worker()
+
+    def realize(self, featstruct):
+        """
+        realizes a ``Diamond`` or ``Sentence`` feature structure with an idle 
+        tccg process (cf. ``OpenCCG.realize``).
+
+        :type featstruct: ``Diamond`` or ``Sentence``
+        :rtype: ``list`` of ``str``
+        """
+        return self.realize_xml(featstruct2hlds_xml(featstruct))
+
+    def realize_xml(self, sentence_xml_str):
+        """
+        realizes an HLDS-XML sentence with an idle tccg process. If the 
+        process crashes, it is replaced and the sentence is realized again.
+
+        :type sentence_xml_str: ``str``
+        :rtype: ``list`` of ``str``
+        """
+        if self.cache is not None:
+            key = hlds_fingerprint(sentence_xml_str, self.lang)
+            realizations = self.cache.get(key)
+            if realizations is not None:
+                return realizations
+
+        start_time = time.time()
+        worker = self.__checkout()
+        try:
+            try:
+                realizations = worker.realize_xml(sentence_xml_str)
+            except pexpect.EOF:
+                worker = self.__restart(worker)
+                realizations = worker.realize_xml(sentence_xml_str)
+        finally:
+            self._idle.put(worker)
+        self.latencies.add(time.time() - start_time)
+        if self.cache is not None:
+            self.cache.put(key, realizations)
+        return realizations
+
+    def realize_all(self, featstructs):
+        """
+        realizes several ``Diamond``s or ``Sentence``s concurrently, using all 
+        tccg processes of the pool.
+
+        :type featstructs: ``list`` of ``Diamond``s or ``Sentence``s
+        :rtype: ``list`` of ``list``s of ``str``
+        :return: the realizations of each feature structure (in the same 
+        order as ``featstructs``)
+        """
+        xml_sentences = [featstruct2hlds_xml(featstruct)
+                         for featstruct in featstructs]
+        threads = ThreadPool(self.size)
+        try:
+            return threads.map(self.realize_xml, xml_sentences)
+        finally:
+            threads.close()
+
+    def terminate(self):
+        """
+        stops all tccg processes, including those that are still realizing 
+        a sentence (whose ``realize`` calls will fail)
+        """
+        with self._lock:
+            self._closed = True
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            try:
+                worker.terminate()
+            except (OSError, pexpect.ExceptionPexpect):
+                pass
+        while not self._idle.empty():
+            self._idle.get()
+
+
+def grammar_version(grammar_dir):
+    """
+    identifies a grammar by its (absolute) path and by the names, 
+    modification times and sizes of its files, which change whenever the 
+    grammar is edited.
+
+    :param grammar_dir: path to the directory that contains the grammar
+    :type grammar_dir: ``str``
+    :rtype: ``str``
+    """
+    grammar_dir = os.path.abspath(grammar_dir)
+    files = []
+    for root, dirs, file_names in os.walk(grammar_dir):
+        for file_name in file_names:
+            path = os.path.join(root, file_name)
+            stat = os.stat(path)
+            files.append( (os.path.relpath(path, grammar_dir),
+                           stat.st_mtime, stat.st_size) )
+    return hashlib.sha1(repr((grammar_dir, sorted(files)))).hexdigest()
+
+
+class RealizationCache(object):
+    """
+    a cache of the realizations that tccg generated for a sentence. 
+    Sentences are content-addressed by the fingerprint of their HLDS XML 
+    (cf. ``hlds_fingerprint``), so that recurring phrases (e.g. the title, 
+    authors or year of a book) are only realized once.
+
+    A cache belongs to the grammar the sentences are realized with (cf. 
+    ``grammar_version``), i.e. realizers with another grammar don't use it.
+
+    Realizations are kept in memory (evicting the least recently used 
+    ones). Optionally, they are also stored in an SQLite database, so that 
+    they survive the current process. The database is cleared if it was 
+    written with another version of the grammar. The cache can be shared 
+    by several threads (e.g. of an ``OpenCCGPool``).
+    """
+    def __init__(self, maxsize=REALIZATION_CACHE_SIZE, path=None,
+                 grammar_dir=GRAMMAR_DIR):
+        """
+        :param maxsize: the max. number of sentences kept in memory
+        :type maxsize: ``int``
+        :param path: the path to a (new or existing) SQLite database used 
+        as a persistent store. if None, realizations are only kept in memory.
+        :type path: ``str`` or ``NoneType``
+        :param grammar_dir: path to the directory that contains the grammar 
+        the sentences are realized with
+        :type grammar_dir: ``str``
+        """
+        self.grammar = grammar_version(grammar_dir)
+        self.memory = LRUCache(maxsize=maxsize)
+        self.path = path
+        self.store_hits = 0
+        self._lock = threading.Lock()
+        if path is None:
+            self.store = None
+        else:
+            self.store = sqlite3.connect(path, check_same_thread=False)
+            self.store.execute("CREATE TABLE IF NOT EXISTS realizations "
+                               "(fingerprint TEXT PRIMARY KEY, "
+                               "realizations TEXT)")
+            self.store.execute("CREATE TABLE IF NOT EXISTS metadata "
+                               "(name TEXT PRIMARY KEY, value TEXT)")
+            row = self.store.execute("SELECT value FROM metadata WHERE "
+                                     "name = 'grammar'").fetchone()
+            if row is None or row[0] != self.grammar:
+                self.store.execute("DELETE FROM realizations")
+                self.store.execute("INSERT OR REPLACE INTO metadata "
+                                   "VALUES ('grammar', ?)", (self.grammar,))
+            self.store.commit()
+
+    def accepts(self, grammar_dir):
+        """
+        :type grammar_dir: ``str``
+        :rtype: ``bool``
+        :return: True, if the cache belongs to the grammar in this directory
+        """
+        return grammar_version(grammar_dir) == self.grammar
+
+    def get(self, fingerprint):
+        """
+        :type fingerprint: ``str``
+        :rtype: ``list`` of ``str`` or ``NoneType``
+        :return: the cached realizations of a sentence or None, if it 
+        wasn't realized before
+        """
+        with self._lock:
+            realizations = self.memory.get(fingerprint)
+            if realizations is None and self.store is not None:
+                row = self.store.execute("SELECT realizations FROM "
+                                         "realizations WHERE fingerprint = ?",
+                                         (fingerprint,)).fetchone()
+                if row is not None:
+                    realizations = [realization.encode('UTF8')
+                                    for realization in json.loads(row[0])]
+                    self.memory.put(fingerprint, realizations)
+                    self.store_hits += 1
+            return realizations
+
+    def put(self, fingerprint, realizations):
+        """
+        :type fingerprint: ``str``
+        :type realizations: ``list`` of ``str``
+        """
+        with self._lock:
+            self.memory.put(fingerprint, realizations)
+            if self.store is not None:
+                self.store.execute("INSERT OR REPLACE INTO realizations "
+                                   "VALUES (?, ?)",
+                                   (fingerprint, json.dumps(realizations)))
+                self.store.commit()
+
+    def close(self):
+        """closes the persistent store (if any)"""
+        with self._lock:
+            if self.store is not None:
+                self.store.close()
+                self.store = None
+
+    def stats(self):
+        """
+        :rtype: ``dict``
+        :return: the number of cache hits (in memory and in the persistent 
+        store), misses and sentences kept in memory
+        """
+        stats = self.memory.stats()
+        stats['hits'] += self.store_hits
+        stats['misses'] -= self.store_hits
+        stats['store_hits'] = self.store_hits
+        return stats
+
+    def __str__(self):
+        return "{hits} hits ({store_hits} from disk), {misses} misses, " \
+               "{size}/{maxsize} entries".format(**self.stats())
+
+
+REALIZATION_CACHE = RealizationCache() # shared by all realizers by default
+
+
+class OpenCCGRequestHandler(SocketServer.StreamRequestHandler):
+    """
+    handles requests to an ``OpenCCGServer``. Each request is one line 
+    containing a JSON object with an HLDS-XML sentence (``{"hlds": ...}``). 
+    The response is one line containing a JSON object with its realizations 
+    (``{"realizations": [...]}``) or an error message (``{"error": ...}``).
+    """
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            try:
+                request = json.loads(line)
+                realizations = self.server.pool.realize_xml(
+                    request['hlds'].encode('UTF8'))
+                response = {'realizations': realizations}
+            except Exception, err:
+                response = {'error': repr(err)}
+            self.wfile.write(json.dumps(response) + "\n")
+            self.wfile.flush()
+
+
+class OpenCCGServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    makes an ``OpenCCGPool`` available to other processes (e.g. several 
+    invocations of the ``pypolibox`` command) via a socket on localhost, 
+    cf. ``OpenCCGClient``.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, pool, port=TCCG_SERVER_PORT):
+        """
+        :type pool: ``OpenCCGPool``
+        :type port: ``int``
+        """
+        SocketServer.TCPServer.__init__(self, ('localhost', port),
+                                        OpenCCGRequestHandler)
+        self.pool = pool
+
+
+class OpenCCGClient(object):
+    """
+    connects to an already running ``OpenCCGServer``. It can be used just 
+    like an ``OpenCCG`` instance, but doesn't need to start its own tccg 
+    process.
+    """
+    def __init__(self, port=TCCG_SERVER_PORT, host='localhost'):
+        self._socket = socket.create_connection((host, port))
+        self._rfile = self._socket.makefile('rb')
+
+    def realize(self, featstruct):
+        """
+        realizes a ``Diamond`` or ``Sentence`` feature structure via the 
+        server.
+
+        :type featstruct: ``Diamond`` or ``Sentence``
+        :rtype: ``list`` of ``str``
+        """
+        return self.realize_xml(featstruct2hlds_xml(featstruct))
+
+    def realize_xml(self, sentence_xml_str):
+        """
+        :type sentence_xml_str: ``str``
+        :rtype: ``list`` of ``str``
+        """
+        request = json.dumps({'hlds': sentence_xml_str})
+        self._socket.sendall(request + "\n")
+        response = json.loads(self._rfile.readline())
+        if 'error' in response:
+            raise Exception, "OpenCCG server error: {0}".format(
+                response['error'])
+        return [realization.encode('UTF8')
+                for realization in response['realizations']]
+
+    def terminate(self):
+        """closes the connection (but doesn't stop the server)"""
+        self._rfile.close()
+        self._socket.close()
+
+
+def hlds_fingerprint(sentence_xml_str, lang='de'):
+    """
+    computes a hash of an HLDS XML sentence, which is independent of its 
+    formatting (i.e. whitespace between elements, attribute quoting etc.).
+
+    :type sentence_xml_str: ``str``
+    :param lang: the language of the grammar the sentence is realized with
+    :type lang: ``str``
+    :rtype: ``str``
+    """
+    parser = etree.XMLParser(remove_blank_text=True)
+    tree = etree.fromstring(sentence_xml_str, parser)
+    normalized_xml = etree.tostring(tree, method="c14n")
+    return hashlib.sha1(lang + "\n" + normalized_xml).hexdigest()
+
+
+def featstruct2hlds_xml(featstruct):
+    """
+    converts a ``Diamond`` or ``Sentence`` feature structure into an HLDS-XML 
+    string that can be realized by tccg.
+
+    :type featstruct: ``Diamond`` or ``Sentence``
+    :rtype: ``str``
+    """
+    temp_sentence = deepcopy(featstruct)
+    
+    if isinstance(featstruct, Diamond):
+        temp_sentence = diamond2sentence(temp_sentence)
+
+    add_nom_prefixes(temp_sentence)
+    return create_hlds_file(temp_sentence, mode="realize", output="xml")
 
 
 def parse_tccg_generator_output(tccg_output):
@@ -156,3 +654,46 @@ def parse_tccg_generator_output(tccg_output):
         else:
             raise Exception, "Can't parse tccg output line:\n{0}".format(line)
     return sorted(set(results))
+
+
+def main():
+    """
+    starts a pool of tccg processes and serves it on localhost, so that 
+    ``pypolibox --tccg-server PORT`` doesn't need to start its own tccg.
+    """
+    parser = argparse.ArgumentParser(
+        description='serve a pool of OpenCCG/tccg realizers on localhost')
+    parser.add_argument("-n", "--workers", type=int, default=2,
+        help="number of tccg processes. default: 2")
+    parser.add_argument("--port", type=int, default=TCCG_SERVER_PORT,
+        help="port to listen on. default: {0}".format(TCCG_SERVER_PORT))
+    parser.add_argument("-d", "--output-language", default='de',
+        help="language of the grammar. default: de")
+    parser.add_argument("--cache",
+        help=("store realizations in the SQLite database CACHE, so that "
+              "they can be reused after a restart"))
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.cache is None:
+        cache = REALIZATION_CACHE
+    else:
+        cache = RealizationCache(path=args.cache)
+    pool = OpenCCGPool(size=args.workers, lang=args.output_language,
+                       cache=cache)
+    server = OpenCCGServer(pool, port=args.port)
+    print "serving {0} tccg processes on port {1}".format(args.workers,
+                                                          args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.terminate()
+        print "realization latencies:\n{0}".format(pool.latencies)
+        print "realization cache: {0}".format(cache)
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,12 +7,18 @@ The ``rules`` module contains rules, which are used by the text planner to
 combine messages into constituent sets and ultimately form one ``TextPlan``.
 """
 
+import ast
+import hashlib
 import itertools
 import nltk
 from nltk import Feature
 from messages import Message
 from util import exists
 
+# the names a condition may use (apart from the message types in ``len()``),
+# cf. ``check_condition``
+CONDITION_NAMES = ('exists', 'locals', 'len', 'True', 'False', 'None')
+
 class ConstituentSet(nltk.featstruct.FeatDict):
     """
     ``ConstituentSet`` is the contstuction built up by applying ``Rules`` to a 
@@ -102,6 +108,31 @@ class Rule(object):
         self.nucleus = nucleus
         self.satellite = satellite
         self.heuristic = heuristic
+        # conditions are parsed only once, not every time they are checked
+        self.compiled_conditions = [compile_condition(condition, name)
+                                    for condition in conditions]
+        # index keys of the prototypes, cf. find_indexed_candidates()
+        self.nucleus_keys = [prototype_key(prototype)
+                             for (msg_name, prototype) in nucleus]
+        self.satellite_keys = [prototype_key(prototype)
+                               for (msg_name, prototype) in satellite]
+
+    def __getstate__(self):
+        """
+        ``Rule``s are pickled without their compiled conditions (code objects 
+        can't be pickled) and without the search state they were last 
+        applied to.
+        """
+        state = self.__dict__.copy()
+        for attrib in ('compiled_conditions', 'messages', 'namespace'):
+            state.pop(attrib, None)
+        return state
+
+    def __setstate__(self, state):
+        """recompiles the conditions of an unpickled ``Rule``"""
+        self.__dict__.update(state)
+        self.compiled_conditions = [compile_condition(condition, self.name)
+                                    for condition in self.conditions]
 
     def __str__(self):
         """
@@ -109,10 +140,12 @@ class Rule(object):
         """
         ret = ''
         for (key, val) in self.__dict__.iteritems():
-            ret += str(key) + ' - ' + str(val) + '\n'
+            if key not in ('compiled_conditions', 'nucleus_keys',
+                           'satellite_keys'):
+                ret += str(key) + ' - ' + str(val) + '\n'
         return ret
 
-    def get_options(self, messages):
+    def get_options(self, messages, namespace=None, index=None):
         """
         this is the main method used for document planning 
             
@@ -132,6 +165,18 @@ class Rule(object):
         :type messages: list of ``Message`` objects
         :param messages: a list of ``Message`` objects, each containing one 
         message about a book
+
+        :type namespace: ``dict`` or ``NoneType``
+        :param namespace: maps message types to the ``Message``s in 
+        ``messages`` (cf. ``message_namespace``). The planner computes it once 
+        per search state and shares it between all rules. If None, it will be 
+        computed from ``messages``.
+
+        :type index: ``dict`` or ``NoneType``
+        :param index: the ``messages`` bucketed by their index keys (cf. 
+        ``index_constituents``). Like ``namespace``, it is computed once per 
+        search state by the planner. If None, it will be computed from 
+        ``messages``.
         
         :rtype: empty list or a list containing one ``tuple`` of (``int``, 
         ``ConstituentSet``, ``list``), where ``list`` consists of ``Message`` 
@@ -145,38 +190,114 @@ class Rule(object):
             - inputs is the list of inputs (``Message``s or ``ConstituentSets`` 
             used in this application of the rule 
         """
-        self.messages = messages # will be used by self.__name_eval()
+        self.messages = messages
+        if namespace is None:
+            namespace = message_namespace(messages)
+
+        # conditions only refer to the message types present in ``messages``,
+        # i.e. they are either met by all possible (nucleus, satellite)
+        # combinations or by none of them
+        if not self.conditions_hold(namespace):
+            return []
+
+        if index is None:
+            index = index_constituents(messages)
+
         nucleus_candidates = []
         satellite_candidates = []
 
-        for message_prototype in self.nucleus:
-            nucleus_candidates.extend(self.find_message_candidates(messages, 
-                                                            message_prototype))
+        for message_prototype, key in zip(self.nucleus, self.nucleus_keys):
+            nucleus_candidates.extend(self.find_indexed_candidates(index,
+                                                    message_prototype, key))
 
-        for message_prototype in self.satellite:
-            satellite_candidates.extend(self.find_message_candidates(messages,
-                                                            message_prototype))
+        for message_prototype, key in zip(self.satellite, self.satellite_keys):
+            satellite_candidates.extend(self.find_indexed_candidates(index,
+                                                    message_prototype, key))
         
         # cartesian product (all possible combinations) 
         # of nucleus and satellite messages
         possible_msg_combinations = list(itertools.product(nucleus_candidates,  
                                                         satellite_candidates)) 
         
-        condition_matching_combinations = self.get_satisfactory_groups(possible_msg_combinations) #remove messages which do not satisfy conditions
-        
-        non_empty_message_combinations = [msgs for msgs in condition_matching_combinations if msgs != [] ] # remove empty messages
+        non_empty_message_combinations = [msgs for msgs in possible_msg_combinations if msgs != [] ] # remove empty messages
  
         options_list = []
-        inputs = []
-        for i, combination in enumerate(non_empty_message_combinations):
-            score = self.heuristic
-            constituent_set = self.__get_return(combination)
-            (nucleus_name, nucleus_msg), (sat_name, sat_msg) = combination
-            inputs.append(nucleus_msg)
-            inputs.append(sat_msg)
-            options_list.append( (score, constituent_set, inputs) )
+        for combination in non_empty_message_combinations:
+            options_list.append(self.get_option(combination))
         return options_list            
 
+    def get_option(self, combination):
+        """
+        applies the ``Rule`` to one (nucleus, satellite) combination, 
+        regardless of its conditions.
+
+        :type combination: ``tuple`` of two ``tuple``s of (``str``, ``Message`` 
+        or ``ConstituentSet``)
+        :param combination: a tuple of two message tuples (nucleus, 
+        satellite) of the form (message name, message)
+
+        :rtype: ``tuple`` of (``int``, ``ConstituentSet``, ``list``)
+        :return: a 3-tuple (score, ``ConstituentSet``, inputs), cf. 
+        ``get_options``
+        """
+        (nucleus_name, nucleus_msg), (sat_name, sat_msg) = combination
+        constituent_set = self.__get_return(combination)
+        return (self.heuristic, constituent_set, [nucleus_msg, sat_msg])
+
+    def conditions_hold(self, namespace):
+        """
+        checks if all the conditions of the ``Rule`` are met in a search 
+        state.
+
+        :type namespace: ``dict``
+        :param namespace: maps the message types of the search state to its 
+        ``Message``s (cf. ``message_namespace``)
+        :rtype: ``bool``
+        """
+        return all(self.get_conditions(namespace))
+
+    def find_candidates(self, index):
+        """
+        finds all messages (in an index of a search state) that could be used 
+        as the nucleus or the satellite of this ``Rule``.
+
+        :type index: ``dict``
+        :param index: maps index keys to lists of ``Message``s and/or 
+        ``ConstituentSet``s (cf. ``index_constituents``)
+
+        :rtype: ``tuple`` of two ``list``s of ``tuple``s of (``int``, ``str``, 
+        ``Message`` or ``ConstituentSet``)
+        :return: the nucleus candidates and the satellite candidates. each 
+        candidate is stored together with the position and name of the 
+        prototype (in ``self.nucleus`` or ``self.satellite``) it matches.
+        """
+        nucleus_candidates = []
+        for position, (message_prototype, key) in \
+                enumerate(zip(self.nucleus, self.nucleus_keys)):
+            for name, message in self.find_indexed_candidates(index,
+                                                    message_prototype, key):
+                nucleus_candidates.append( (position, name, message) )
+
+        satellite_candidates = []
+        for position, (message_prototype, key) in \
+                enumerate(zip(self.satellite, self.satellite_keys)):
+            for name, message in self.find_indexed_candidates(index,
+                                                    message_prototype, key):
+                satellite_candidates.append( (position, name, message) )
+        return nucleus_candidates, satellite_candidates
+
+    def match_prototypes(self, constituent):
+        """
+        checks if a single (e.g. newly created) ``Message`` or 
+        ``ConstituentSet`` could be used as the nucleus or the satellite of 
+        this ``Rule``.
+
+        :type constituent: ``Message`` or ``ConstituentSet``
+        :rtype: ``tuple`` of two ``list``s of ``tuple``s, cf. 
+        ``find_candidates``
+        """
+        return self.find_candidates(index_constituents([constituent]))
+
     def find_message_candidates(self, messages, message_prototype):
         """
         takes a list of messages and returns only those with the right 
@@ -201,85 +322,59 @@ class Rule(object):
         messages_list = []
         name, condition = message_prototype
         for message in messages:            
-            if condition.subsumes(message):
+            if isinstance(message, nltk.featstruct.FeatStruct):
+                featstruct = message
+            else: # a record of the text planner, cf. ``planrecords``
+                featstruct = message.to_featstruct()
+            if condition.subsumes(featstruct):
                 messages_list.append( (name, message) )
         return messages_list
         
-    def get_satisfactory_groups(self, groups):    
+    def find_indexed_candidates(self, index, message_prototype, key):
         """
-        :type groups: ``list`` of ``list``'s of ``tuple``'s of (``str``, 
-        ``Message`` or ``ConstituentSet``)
-        :param groups: a list of group elements. each group contains a list 
-        which contains one or more message tuples of the form 
-        (message name, message)
-        
-        :rtype: ``list`` of ``list``'s of ``tuple``'s of (``str``, ``Message`` 
-        or ``ConstituentSet``)
-        :return: a list of group elements. contains only those groups which 
-        meet all the conditions specified in self.conditions        
-        """
-        satisfactory_groups = []
-        for group in groups:
-            if all(self.get_conditions(group)) is True:
-                satisfactory_groups.append(group)
-        return satisfactory_groups
-        
-    def get_conditions(self, group):
-        """
-        applies __name_eval to all conditions a Rule has, i.e. checks if a 
-        group meets all conditions
-        
-        :type group: ``list`` of ``tuple``'s of (``str``, ``Message`` or 
+        does the same as ``find_message_candidates``, but only checks those 
+        messages that are filed under the index key of the prototype. If the 
+        prototype consists of nothing but its index key, no subsumption check 
+        is needed at all.
+
+        :type index: ``dict``
+        :param index: maps index keys to lists of ``Message``s and/or 
+        ``ConstituentSet``s (cf. ``index_constituents``)
+
+        :param message_prototype: a tuple consisting of a message name and a 
+        ``Message`` or ``ConstituentSet``
+        :type message_prototype: ``tuple`` of (string, ``Message`` or 
         ``ConstituentSet``)
-        :param group: a list of message tuples of the form 
-        (message name, message)
+
+        :type key: ``tuple`` of (``tuple``, ``bool``)
+        :param key: the index key of the prototype and a boolean that tells 
+        if the key is all there is to the prototype (cf. ``prototype_key``)
+
+        :rtype: ``list`` of ``tuple``s of (string, ``Message``)
+        """
+        name, condition = message_prototype
+        index_key, is_exact = key
+        messages = index.get(index_key, [])
+        if is_exact:
+            return [(name, message) for message in messages]
+        else:
+            return self.find_message_candidates(messages, message_prototype)
+
+    def get_conditions(self, namespace):
+        """
+        evaluates all conditions a Rule has (cf. ``evaluate_condition``) in 
+        a search state
+
+        :type namespace: ``dict``
+        :param namespace: maps the message types of the search state to its 
+        ``Message``s (cf. ``message_namespace``)
 
         :rtype: ``list`` of ``bool``
-        :return: a list of truth values, each of which tells if a group met 
-        all conditions specified in self.conditions
-        """
-        results = []
-        for condition in self.conditions:
-            try:
-                results.append( self.__name_eval(condition, group) )
-            except NameError:
-                # __name_eval can check for the existence of an object, but it
-                # will fail to "do something" with a nonexisting object, e.g. 
-                # "len(lastbook_match) < 5" would raise an error if 
-                # lastbook_match doesn't exist
-                results.append(False)
-        return results
-                
-    def __name_eval(self, condition, group):
+        :return: a list of truth values, each of which tells if the search 
+        state met one of the conditions specified in self.conditions
         """
-        check if a ``condition`` is met by the ``Message``s in a ``group``
-        
-        :type condition: ``str``
-        :param condition: a python statement that can be evaluated to True or 
-        False, encoded as a string
-        
-        :type group: ``list`` of ``tuple``'s of (``str``, ``Message`` or 
-        ``ConstituentSet``)
-        :param group: a list of message tuples of the form 
-        (message name, message)
-        
-        ``Message``s and ``ConstituentSet``s are ``FeatDict``s, which can be 
-        queried just like normal ``dict``s.
-        
-        :rtype: ``bool``
-        :return: True if the condition is met by the ``Message``s in ``group``
-        """
-        for message in self.messages:
-            if Feature("msgType") in message: 
-            #if it's a ``Message`` and not a ``ConstituentSet``
-                message_name = message[Feature("msgType")]
-                locals()[message_name] = message
-
-        try:
-            ret = eval(condition)
-        except AttributeError:
-            ret = False
-        return ret
+        return [evaluate_condition(condition, namespace)
+                for condition in self.compiled_conditions]
 
     def __get_return(self, combination):
         """
@@ -299,6 +394,189 @@ class Rule(object):
         return ConstituentSet(relType = self.ruleType, nucleus=nucleus_msg, 
                               satellite=sat_msg)
 
+def compile_condition(condition, rule_name=''):
+    """
+    compiles the condition of a ``Rule`` into a code object, so that it 
+    doesn't need to be parsed every time it is evaluated.
+
+    :type condition: ``str``
+    :param condition: a python expression that can be evaluated to True or 
+    False, e.g. 'len(usermodel_match) >= len(usermodel_nomatch)'
+    :type rule_name: ``str``
+    :param rule_name: the name of the rule the condition belongs to (only 
+    used in error messages)
+
+    :rtype: ``code``
+    """
+    return compile(condition, "<rule '{0}'>".format(rule_name), 'eval')
+
+
+def evaluate_condition(condition, namespace):
+    """
+    checks if a ``Rule`` condition is met in a search state.
+
+    ``Message``s and ``ConstituentSet``s are ``FeatDict``s, which can be 
+    queried just like normal ``dict``s. Each ``Message`` of the search state 
+    can be accessed by its message type (cf. ``message_namespace``).
+
+    :type condition: ``code``
+    :param condition: a python statement that can be evaluated to True or 
+    False, compiled by ``compile_condition``
+    :type namespace: ``dict``
+    :param namespace: maps the message types of the search state to its 
+    ``Message``s
+    :return: the value of the condition (False, if it refers to a message 
+    that doesn't exist in the search state)
+    """
+    try:
+        return eval(condition, globals(), namespace)
+    except NameError:
+        # a condition can check for the existence of an object, but it
+        # will fail to "do something" with a nonexisting object, e.g.
+        # "len(lastbook_match) < 5" would raise an error if
+        # lastbook_match doesn't exist
+        return False
+    except AttributeError:
+        return False
+
+
+def check_condition(condition):
+    """
+    checks that the outcome of a rule condition only depends on the message
+    types of a search state and on the lengths of its messages, which is
+    all that a plan table (cf. ``plantable``) or the fingerprint of the
+    messages (cf. ``textplan.message_fingerprint``) distinguishes. Message
+    types may only be used as ``exists("msg_type", locals())`` or
+    ``len(msg_type)``.
+
+    :type condition: ``str``
+    :raises ValueError: if the condition looks at the content of a message
+    (or compares a length to a constant)
+    """
+    tree = ast.parse(condition, mode='eval')
+    # the message types (and their names) used by len() and exists()
+    arguments = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+           and node.args:
+            argument = node.args[0]
+            if (node.func.id == 'len' and isinstance(argument, ast.Name)) \
+               or (node.func.id == 'exists' and
+                   isinstance(argument, ast.Str)):
+                arguments.add(argument)
+
+    for node in ast.walk(tree):
+        if node in arguments:
+            continue
+        if (isinstance(node, ast.Name) and node.id not in CONDITION_NAMES) \
+           or isinstance(node, (ast.Num, ast.Str, ast.Subscript,
+                                ast.Attribute)):
+            raise ValueError("the condition '{0}' looks at more than the "
+                             "types and lengths of messages".format(
+                             condition))
+
+
+def message_namespace(messages):
+    """
+    maps the message types of all ``Message``s in a search state to the 
+    messages themselves. ``Rule`` conditions are evaluated in this 
+    namespace, i.e. a condition can refer to the 'usermodel_match' message 
+    as ``usermodel_match``. ``ConstituentSet``s are ignored.
+
+    :type messages: ``list`` or ``set`` of ``Message``s and/or 
+    ``ConstituentSet``s
+    :rtype: ``dict`` of (``str``, ``Message``)
+    """
+    namespace = {}
+    for message in messages:
+        if Feature("msgType") in message:
+        #if it's a ``Message`` and not a ``ConstituentSet``
+            namespace[message[Feature("msgType")]] = message
+    return namespace
+
+
+def constituent_keys(constituent):
+    """
+    returns all index keys a ``Message`` or ``ConstituentSet`` is filed under. 
+    A ``Message`` is filed under its message type, a ``ConstituentSet`` under 
+    its relation type and the message types of its nucleus and satellite 
+    (if those are ``Message``s).
+
+    :type constituent: ``Message`` or ``ConstituentSet``
+    :rtype: ``list`` of ``tuple``s of (``str``, ``str``)
+    """
+    if Feature("msgType") in constituent:
+        return [("msgType", constituent[Feature("msgType")])]
+
+    keys = []
+    if Feature("relType") in constituent:
+        keys.append( ("relType", constituent[Feature("relType")]) )
+    for role in ("nucleus", "satellite"):
+        if Feature(role) in constituent:
+            child = constituent[Feature(role)]
+            if Feature("msgType") in child:
+                keys.append( (role, child[Feature("msgType")]) )
+    return keys
+
+
+def prototype_key(prototype):
+    """
+    returns the index key of a ``Rule``'s nucleus/satellite prototype. Every 
+    message or constituent set subsumed by the prototype is filed under 
+    this key (cf. ``constituent_keys``).
+
+    :type prototype: ``Message`` or ``ConstituentSet``
+    :rtype: ``tuple`` of (``tuple``, ``bool``)
+    :return: the index key (None, if the prototype can't be indexed) and a 
+    boolean that is True if the prototype doesn't specify anything beyond 
+    that key, i.e. everything filed under the key is subsumed by it.
+    """
+    if Feature("msgType") in prototype:
+        return ("msgType", prototype[Feature("msgType")]), len(prototype) == 1
+    if Feature("relType") in prototype:
+        return ("relType", prototype[Feature("relType")]), len(prototype) == 1
+    for role in ("nucleus", "satellite"):
+        if Feature(role) in prototype:
+            child = prototype[Feature(role)]
+            if Feature("msgType") in child:
+                is_exact = len(prototype) == 1 and len(child) == 1
+                return (role, child[Feature("msgType")]), is_exact
+    return None, False
+
+
+def index_constituents(messages):
+    """
+    buckets the ``Message``s and ``ConstituentSet``s of a search state by 
+    their index keys, so that a ``Rule`` only needs to check those messages 
+    that could possibly be subsumed by its prototypes. All messages are 
+    also stored under the key None (for prototypes that can't be indexed).
+
+    :type messages: ``list`` or ``set`` of ``Message``s and/or 
+    ``ConstituentSet``s
+    :rtype: ``dict`` of (``tuple``, ``list``)
+    """
+    index = {None: []}
+    for message in messages:
+        index[None].append(message)
+        for key in constituent_keys(message):
+            index.setdefault(key, []).append(message)
+    return index
+
+
+def rules_digest(rules):
+    """
+    calculates a digest of the rules, so that text plans (or plan tables, 
+    cf. ``plantable``) aren't used with rules they weren't planned with.
+
+    :type rules: ``list`` of ``Rule``s
+    :rtype: ``str``
+    """
+    description = [(rule.name, rule.ruleType, str(rule.nucleus),
+                    str(rule.satellite), rule.conditions, rule.heuristic)
+                   for rule in rules]
+    return hashlib.sha1(repr(description)).hexdigest()
+
+
 class Rules():
     """creates Rule() instances
     
@@ -14,7 +14,9 @@ by using the ``nltk.featstruct`` data structure.
 ``textplan`` converts ``Proposition`` instances into ``Message``s (using 
 attribute value notation). Via a set of ``Rule``s, these messages are combined 
 into ``ConstituentSet``s. Rules are applied bottom-up, via a recursive 
-best-first search (cf. ``__bottom_up_search``).
+best-first search (cf. ``__bottom_up_search``) or, optionally, via a beam 
+search (cf. ``__beam_search``) or a dynamic program over subsets of the 
+messages (cf. ``__dp_search``).
 
 Not only messages, but also constituent sets can be combined 
 via rules. If all messages present can be combined into one large 
@@ -27,18 +29,42 @@ Structuring Algorithm for NLTK.
 """
 
 
+import hashlib
+import itertools
+import multiprocessing
+import shelve
+import threading
+from Queue import Queue
+from collections import OrderedDict
 import nltk
 from nltk.featstruct import Feature, FeatDict
 from lxml import etree
 from time import time
 
-from util import (flatten, freeze_all_messages, msgs_instance_to_list_of_msgs,
-                  ensure_unicode)
-from rules import Rules, ConstituentSet
+from util import (freeze_all_messages, msgs_instance_to_list_of_msgs,
+                  ensure_unicode, LRUCache)
+from rules import Rules, ConstituentSet, check_condition, rules_digest
 from messages import Message, Messages
+from planrecords import (PlanMessage, PlanConstituent, record_namespace,
+                         index_records)
 from hlds import etreeprint # TODO: dbg, rm
 
 
+MEMO_SIZE = 10000 # max. number of search states remembered by the planner
+PLAN_CACHE_SIZE = 1000 # max. number of text plan skeletons kept in memory
+_NOT_CACHED = object() # marks search states that haven't been explored, yet
+# key of the digest of the rules in the persistent store of a TextPlanCache
+RULES_DIGEST_KEY = 'rules_digest'
+
+# search strategies of ``generate_textplan``
+STRATEGIES = ('best-first', 'beam', 'dp')
+DEFAULT_STRATEGY = 'best-first'
+BEAM_WIDTH = 8 # number of partial plans kept in each step of the beam search
+
+WORKER_RULES = None # rules used by a planning process, cf. PlanningPool
+WORKER_MEMO = None # search state memo of a planning process
+
+
 class TextPlan(nltk.featstruct.FeatDict):
     """
     ``TextPlan`` is the output of Document Planning. A TextPlan consists of an 
@@ -54,6 +80,136 @@ class TextPlan(nltk.featstruct.FeatDict):
                                                   'book score': book_score})
         self['children'] = children
 
+__rules_digests = {} # caches the results of ``rules_cache_key``
+
+def rules_cache_key(rules):
+    """
+    returns the digest of the rules (cf. ``rules.rules_digest``), which is 
+    part of the keys of a ``TextPlanCache``. It is only calculated once per 
+    list of rules.
+
+    :type rules: ``list`` of ``Rule``s
+    :rtype: ``str`` or ``NoneType``
+    :return: the digest or None, if the plans of these rules can't be 
+    cached, because a condition looks at more than the types and lengths of 
+    messages (cf. ``rules.check_condition``), i.e. at more than their 
+    fingerprint (cf. ``message_fingerprint``)
+    """
+    key = tuple(rules) # keeps the rules alive, so their ids aren't reused
+    if key not in __rules_digests:
+        try:
+            for rule in rules:
+                for condition in rule.conditions:
+                    check_condition(condition)
+            __rules_digests[key] = rules_digest(rules)
+        except ValueError:
+            __rules_digests[key] = None
+    return __rules_digests[key]
+
+
+class TextPlanCache(object):
+    """
+    a cache of text plan skeletons (cf. ``textplan_skeleton``), which are 
+    content-addressed by the fingerprint of the messages they were planned 
+    for (cf. ``message_fingerprint``). The structure of a text plan only 
+    depends on the types and attributes of its messages, so books with 
+    messages of the same 'shape' can share the same skeleton.
+
+    A cache belongs to the rules the skeletons are planned with. It is 
+    bypassed when books are planned with other rules (cf. 
+    ``generate_textplan``), and its keys contain the digest of the rules 
+    (cf. ``plan_cache_key``).
+
+    Skeletons are kept in memory (evicting the least recently used ones). 
+    Optionally, they are also stored in a ``shelve`` file, so that they 
+    survive the current process. The store is cleared if it was written 
+    with other rules (e.g. after ``rules.py`` was changed).
+    """
+    def __init__(self, maxsize=PLAN_CACHE_SIZE, path=None, rules=None):
+        """
+        :param maxsize: the max. number of skeletons kept in memory
+        :type maxsize: ``int``
+        :param path: the path to a (new or existing) ``shelve`` file used 
+        as a persistent store. if None, skeletons are only kept in memory.
+        :type path: ``str`` or ``NoneType``
+        :param rules: the rules the skeletons are planned with (default: 
+        ``Rules().rules``)
+        :type rules: ``list`` of ``Rule``s or ``NoneType``
+        """
+        if rules is None:
+            rules = Rules().rules
+        self.rules_digest = rules_cache_key(rules)
+        self.memory = LRUCache(maxsize=maxsize)
+        self.path = path
+        if path is None:
+            self.store = None
+        else:
+            self.store = shelve.open(path)
+            if self.store.get(RULES_DIGEST_KEY) != self.rules_digest:
+                self.store.clear()
+                self.store[RULES_DIGEST_KEY] = self.rules_digest
+        self.store_hits = 0
+
+    def accepts(self, rules):
+        """
+        :type rules: ``list`` of ``Rule``s
+        :rtype: ``bool``
+        :return: True, if the cache belongs to these rules (and their plans 
+        can be cached at all, cf. ``rules_cache_key``)
+        """
+        return self.rules_digest is not None and \
+            rules_cache_key(rules) == self.rules_digest
+
+    def get(self, fingerprint):
+        """
+        :type fingerprint: ``str``
+        :rtype: ``tuple`` or ``str`` or ``NoneType``
+        :return: the cached skeleton (None, if the messages can't be 
+        planned) or ``_NOT_CACHED``
+        """
+        skeleton = self.memory.get(fingerprint, _NOT_CACHED)
+        if skeleton is _NOT_CACHED and self.store is not None:
+            if fingerprint in self.store:
+                skeleton = self.store[fingerprint]
+                self.memory.put(fingerprint, skeleton)
+                self.store_hits += 1
+        return skeleton
+
+    def put(self, fingerprint, skeleton):
+        """
+        :type fingerprint: ``str``
+        :type skeleton: ``tuple`` or ``str`` or ``NoneType``
+        """
+        self.memory.put(fingerprint, skeleton)
+        if self.store is not None:
+            self.store[fingerprint] = skeleton
+
+    def close(self):
+        """writes the persistent store (if any) to disk and closes it"""
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def stats(self):
+        """
+        :rtype: ``dict``
+        :return: the number of cache hits (in memory and in the persistent 
+        store), misses and skeletons kept in memory
+        """
+        stats = self.memory.stats()
+        stats['hits'] += self.store_hits
+        stats['misses'] -= self.store_hits
+        stats['store_hits'] = self.store_hits
+        return stats
+
+    def __str__(self):
+        return "{hits} hits ({store_hits} from disk), {misses} misses, " \
+               "{size}/{maxsize} entries".format(**self.stats())
+
+
+PLAN_CACHE = TextPlanCache() # shared by all ``TextPlans`` of this process
+
+
 class TextPlans(object):
     """
     generates all ``TextPlan``s for an ``AllMessages`` instance, i.e. one 
@@ -61,24 +217,104 @@ class TextPlans(object):
     database query
     """
     
-    def __init__ (self, allmessages, debug=False):
+    def __init__ (self, allmessages, debug=False, workers=None, timeout=None,
+                  plan_cache=PLAN_CACHE, rules=None, memo=None,
+                  timed_plans=None, search_options=None, plan_table=None):
+        """
+        :type allmessages: ``AllMessages``
+
+        :param workers: the number of processes used to plan the books 
+        concurrently. if None (or 1), all books are planned one after 
+        another in the current process.
+        :type workers: ``int`` or ``NoneType``
+
+        :param timeout: the maximum number of seconds a process may spend 
+        on the plan of a single book (only used if workers > 1, cf. 
+        ``PlanningPool``). books that can't be planned in time get no plan 
+        (None), just like books that can't be planned at all.
+        :type timeout: ``float`` or ``NoneType``
+
+        :param plan_cache: books whose messages have the same fingerprint as 
+        an already planned book will get a copy of its plan (unless the 
+        cache belongs to other rules). if None, every book is planned from 
+        scratch.
+        :type plan_cache: ``TextPlanCache`` or ``NoneType``
+
+        :param rules: the rules used for planning (default: ``Rules().rules``)
+        :type rules: ``list`` of ``Rule``s or ``NoneType``
+
+        :param memo: the search states remembered while planning (default: 
+        a new, empty memo)
+        :type memo: ``LRUCache`` or ``NoneType``
+
+        :param timed_plans: (plan, planning time, exhaustive) tuples of 
+        books that were already planned (cf. ``plan_books``). if given, 
+        nothing is planned.
+        :type timed_plans: ``list`` of ``tuple``s or ``NoneType``
+
+        :param search_options: the search strategy and its settings, i.e. 
+        keyword arguments of ``generate_textplan`` (e.g. ``{'strategy': 
+        'beam', 'beam_width': 4}``). if None, the default strategy is used.
+        :type search_options: ``dict`` or ``NoneType``
+
+        :param plan_table: books whose signature is in this table get their 
+        plan from it (if it was compiled with the same search strategy, cf. 
+        ``plantable``). if None, no table is used.
+        :type plan_table: ``PlanTable`` or ``NoneType``
+        """
         #generate all ``Rule``s that the ``Message``s will be checked against
-        rules = Rules().rules 
+        if rules is None:
+            rules = Rules().rules
+        # search states explored while planning one book are remembered
+        # while planning the others
+        if memo is None:
+            memo = LRUCache(maxsize=MEMO_SIZE)
+        self.memo = memo
         self.document_plans = []
-        for index, book in enumerate(allmessages.books):
-            before = time()
-            
-            messages = book.messages.values() #all messages about a single book
-            plan = generate_textplan(messages, rules, book.book_score)
-            
-            after = time()
-            time_diff = after - before
+        self.timed_out = [] # indices of books that couldn't be planned in time
+        # indices of books whose plan search was cut short (by the beam 
+        # width or a budget), i.e. which may have a better plan
+        self.inexhaustive = []
+        if search_options is None:
+            search_options = {}
+
+        if timed_plans is not None:
+            pass
+        elif workers > 1:
+            timed_plans = plan_books(allmessages, rules, workers, timeout,
+                                     plan_cache,
+                                     search_options=search_options,
+                                     plan_table=plan_table)
+        else:
+            timed_plans = []
+            for book in allmessages.books:
+                before = time()
+                messages = book.messages.values() #all messages about a book
+                report = {}
+                plan = generate_textplan(messages, rules, book.book_score,
+                                         memo=self.memo,
+                                         plan_cache=plan_cache,
+                                         plan_table=plan_table,
+                                         report=report, **search_options)
+                after = time()
+                timed_plans.append( (plan, after - before,
+                                     report['exhaustive']) )
+
+        for index, (plan, time_diff, exhaustive) in enumerate(timed_plans):
             self.document_plans.append(plan)
+            if time_diff is None:
+                self.timed_out.append(index)
+            elif not exhaustive:
+                self.inexhaustive.append(index)
 
             if debug == True:
-                print "Plan {0}: generated in {1} seconds.\n".format(index,
-                                                                     time_diff,
-                                                                     plan)
+                if time_diff is None:
+                    print "Plan {0}: timed out after {1} " \
+                          "seconds.\n".format(index, timeout)
+                else:
+                    print "Plan {0}: generated in {1} " \
+                          "seconds.\n".format(index, time_diff)
+                book = allmessages.books[index]
                 book_title = book.messages['id']['title']
                 
                 if index > 0:
@@ -90,11 +326,581 @@ class TextPlans(object):
                 else:
                     print "Describing '{0}':\n\n{1}".format(book_title, plan)
 
+        if debug == True:
+            print "Search state memo: {0}".format(self.memo)
+            print "Text plan cache: {0}".format(plan_cache)
 
 
+def plan_books(allmessages, rules, workers, timeout=None, plan_cache=None,
+               pool=None, search_options=None, plan_table=None):
+    """
+    generates the ``TextPlan``s of all books in an ``AllMessages`` instance 
+    concurrently, using a pool of ``workers`` processes. Each process 
+    receives the ``rules`` only once, while the ``Messages`` of each book 
+    are sent to whichever process is idle.
+
+    :type allmessages: ``AllMessages``
+    :type rules: ``list`` of ``Rule``s
+    :type workers: ``int``
+    :param timeout: the maximum number of seconds a process may spend on 
+    the plan of a single book (cf. ``PlanningPool``). if None, wait as long 
+    as it takes.
+    :type timeout: ``float`` or ``NoneType``
+    :param plan_cache: books whose skeleton is already cached aren't sent 
+    to the planning processes at all
+    :type plan_cache: ``TextPlanCache`` or ``NoneType``
+    :param pool: an already running pool of planning processes (cf. 
+    ``planning_pool``), which is left running (and whose timeout is used 
+    instead of ``timeout``). if None, a new pool of ``workers`` processes 
+    is started (and stopped afterwards).
+    :type pool: ``PlanningPool`` or ``NoneType``
+    :param search_options: the search strategy and its settings (cf. 
+    ``TextPlans``)
+    :type search_options: ``dict`` or ``NoneType``
+    :param plan_table: books whose signature is in this table aren't sent 
+    to the planning processes (cf. ``TextPlans``)
+    :type plan_table: ``PlanTable`` or ``NoneType``
+
+    :rtype: ``list`` of (``TextPlan`` or ``NoneType``, ``float`` or 
+    ``NoneType``, ``bool`` or ``NoneType``) tuples
+    :return: a (plan, planning time, exhaustive) tuple for each book (in the 
+    same order as ``allmessages.books``), where exhaustive tells if the 
+    search wasn't cut short (cf. ``generate_textplan``). if a book couldn't 
+    be planned in time, its plan, planning time and exhaustive are None.
+    """
+    if pool is not None:
+        pending = submit_books(allmessages, pool, plan_cache,
+                               search_options=search_options,
+                               plan_table=plan_table)
+        return collect_plans(allmessages, pending, pool, plan_cache)
+
+    pool = planning_pool(rules, workers, timeout)
+    try:
+        pending = submit_books(allmessages, pool, plan_cache,
+                               search_options=search_options,
+                               plan_table=plan_table)
+        return collect_plans(allmessages, pending, pool, plan_cache)
+    finally:
+        # don't wait for books that are still planned (if collect_plans 
+        # gave up on them)
+        pool.terminate()
+        pool.join()
+
+
+class PlanningTask(object):
+    """
+    a book that was sent to a ``PlanningPool``, i.e. the pending result of 
+    ``__plan_book``.
+    """
+    def __init__(self, messages, search_options):
+        """
+        :type messages: ``list`` of ``Message``s
+        :type search_options: ``dict``
+        """
+        self.args = (messages, search_options)
+        self.value = None
+        self.error = None
+        self.timed_out = False
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+
+    def finish(self, value=None, error=None, timed_out=False):
+        """
+        stores the result of the task (unless it was already finished, e.g. 
+        because the pool gave up on it).
+
+        :rtype: ``bool``
+        :return: True, if the result was stored
+        """
+        with self._lock:
+            if self._finished.is_set():
+                return False
+            self.value, self.error, self.timed_out = value, error, timed_out
+            self._finished.set()
+            return True
+
+    def ready(self):
+        """
+        :rtype: ``bool``
+        :return: True, if the task was planned, failed or timed out
+        """
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """waits (at most ``timeout`` seconds) until the task is ready"""
+        self._finished.wait(timeout)
+
+    def get(self):
+        """
+        :rtype: ``tuple`` of (``tuple`` or ``NoneType``, ``float``, ``bool``) 
+        or ``NoneType``
+        :return: the return value of ``__plan_book`` or None, if the book 
+        couldn't be planned in time
+        """
+        self.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class PlanningPool(object):
+    """
+    a pool of planning processes, which plan the books of many queries 
+    (cf. ``plan_books``, ``submit_books``). Each process receives the 
+    ``rules`` only once, while the ``Messages`` of each book are sent to 
+    whichever process is idle.
+
+    Each process is driven by a thread of the pool, which sends it one book 
+    at a time. The ``timeout`` of a book starts when its process begins to 
+    plan it, i.e. books don't time out while they are waiting for an idle 
+    process. A process that exceeds the timeout is killed and replaced, so 
+    that the books after it still get planned.
+    """
+    def __init__(self, rules, size, timeout=None):
+        """
+        :type rules: ``list`` of ``Rule``s
+        :param size: the number of planning processes
+        :type size: ``int``
+        :param timeout: the maximum number of seconds a process may spend 
+        on the plan of a single book. if None, there is no limit.
+        :type timeout: ``float`` or ``NoneType``
+        """
+        self.rules = rules
+        self.size = size
+        self.timeout = timeout
+        self.restarts = 0 # number of killed or crashed processes replaced
+        self._tasks = Queue()
+        self._lock = threading.Lock()
+        self._processes = set() # all running planning processes
+        self._closed = False
+        self._threads = [threading.Thread(target=self.__serve)
+                         for i in range(size)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def __start_process(self):
+        """
+        starts a planning process (unless the pool was terminated)
+
+        :rtype: ``tuple`` of (``multiprocessing.Process``, 
+        ``multiprocessing.Connection``) or ``NoneType``
+        """
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_planning_worker,
+                                          args=(child_conn, self.rules))
+        process.daemon = True
+        with self._lock:
+            if self._closed:
+                return None
+            process.start()
+            self._processes.add(process)
+        child_conn.close()
+        return process, conn
+
+    def __stop_process(self, process, conn):
+        """kills a planning process"""
+        with self._lock:
+            self._processes.discard(process)
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        conn.close()
+
+    def __serve(self):
+        """
+        sends the books of the pool to one planning process (and replaces 
+        it, if it crashes or exceeds the timeout)
+        """
+        worker = self.__start_process()
+        while worker is not None:
+            task = self._tasks.get()
+            if task is None: # the pool is closed
+                break
+            if task.ready(): # the pool gave up on this book
+                continue
+            process, conn = worker
+            try:
+                conn.send(task.args)
+                if conn.poll(self.timeout):
+                    succeeded, result = conn.recv()
+                    if succeeded:
+                        task.finish(value=result)
+                    else:
+                        task.finish(error=result)
+                    continue
+                task.finish(timed_out=True)
+            except (EOFError, IOError):
+                # the process crashed (or was killed by ``terminate``)
+                task.finish(error=RuntimeError("the planning process "
+                                               "crashed"))
+            self.__stop_process(process, conn)
+            with self._lock:
+                if self._closed:
+                    return
+                self.restarts += 1
+            worker = self.__start_process()
+        if worker is not None:
+            self.__stop_process(*worker)
+
+    def apply_async(self, messages, search_options):
+        """
+        sends the messages of a book to the next idle planning process.
+
+        :type messages: ``list`` of ``Message``s
+        :type search_options: ``dict``
+        :rtype: ``PlanningTask``
+        """
+        task = PlanningTask(messages, search_options)
+        self._tasks.put(task)
+        return task
+
+    def wait(self, tasks):
+        """
+        waits until the tasks are ready. If the pool has a timeout, it 
+        gives up on tasks that aren't ready after (number of tasks / size + 
+        1) * timeout seconds, i.e. when all of them should have been planned 
+        or timed out.
+
+        :type tasks: ``list`` of ``PlanningTask``s
+        """
+        tasks = [task for task in set(tasks) if not task.ready()]
+        if self.timeout is None:
+            for task in tasks:
+                task.wait()
+            return
+
+        deadline = time() + (len(tasks) / float(self.size) + 1) * \
+            self.timeout
+        for task in tasks:
+            task.wait(max(deadline - time(), 0))
+            task.finish(timed_out=True) # if it isn't ready, yet
+
+    def close(self):
+        """stops the processes once they have planned all pending books"""
+        for thread in self._threads:
+            self._tasks.put(None)
+
+    def terminate(self):
+        """
+        kills all planning processes (including the busy ones) and gives up 
+        on all pending books
+        """
+        with self._lock:
+            self._closed = True
+            processes = list(self._processes)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        while not self._tasks.empty():
+            task = self._tasks.get()
+            if task is not None:
+                task.finish(timed_out=True)
+        self.close()
+
+    def join(self):
+        """waits until all threads (and their processes) have stopped"""
+        for thread in self._threads:
+            thread.join()
+
+
+def planning_pool(rules, workers, timeout=None):
+    """
+    starts a pool of ``workers`` planning processes, which can plan the 
+    books of many queries (cf. ``plan_books``, ``submit_books``). The pool 
+    must be stopped by the caller (``pool.terminate()``).
+
+    :type rules: ``list`` of ``Rule``s
+    :type workers: ``int``
+    :param timeout: the maximum number of seconds a process may spend on 
+    the plan of a single book (cf. ``PlanningPool``)
+    :type timeout: ``float`` or ``NoneType``
+    :rtype: ``PlanningPool``
+    """
+    return PlanningPool(rules, workers, timeout)
+
+
+def submit_books(allmessages, pool, plan_cache=None, submitted=None,
+                 search_options=None, plan_table=None):
+    """
+    sends the messages of all books of an ``AllMessages`` instance to a 
+    pool of planning processes, without waiting for their plans (cf. 
+    ``collect_plans``).
+
+    :type allmessages: ``AllMessages``
+    :type pool: ``PlanningPool``
+    :param plan_cache: books whose skeleton is already cached aren't sent 
+    to the planning processes at all
+    :type plan_cache: ``TextPlanCache`` or ``NoneType``
+    :param submitted: maps the message fingerprints (and search options) of 
+    books that were already sent to the pool to their pending results. 
+    books with the same fingerprint are only planned once (per search 
+    options). if None, every book that isn't cached is sent to the pool.
+    :type submitted: ``dict`` or ``NoneType``
+    :param search_options: the search strategy and its settings (cf. 
+    ``TextPlans``)
+    :type search_options: ``dict`` or ``NoneType``
+    :param plan_table: books whose signature is in this table aren't sent 
+    to the pool either (cf. ``TextPlans``)
+    :type plan_table: ``PlanTable`` or ``NoneType``
+
+    :rtype: ``list`` of (``str`` or ``NoneType``, ``tuple`` or ``str`` or 
+    ``NoneType``, ``PlanningTask`` or ``NoneType``) tuples
+    :return: for each book, the plan cache key of its messages (cf. 
+    ``plan_cache_key``) and either its cached skeleton or the pending 
+    result of its planning process
+    """
+    if search_options is None:
+        search_options = {}
+    options_key = tuple(sorted(search_options.items()))
+    strategy = search_options.get('strategy', DEFAULT_STRATEGY)
+    if plan_table is not None and plan_table.strategy != strategy:
+        plan_table = None
+    if plan_cache is not None and not plan_cache.accepts(pool.rules):
+        plan_cache = None
+    digest = rules_cache_key(pool.rules)
+    pending = []
+    for book in allmessages.books:
+        fingerprint = plan_cache_key(message_fingerprint(
+            book.messages.values()), digest, search_options)
+        skeleton = _NOT_CACHED
+        if plan_table is not None:
+            skeleton = plan_table.get(book.messages.values())
+        if skeleton is _NOT_CACHED and plan_cache is not None and \
+           fingerprint is not None:
+            skeleton = plan_cache.get(fingerprint)
+        if skeleton is not _NOT_CACHED:
+            result = None
+        elif submitted is not None and \
+             (fingerprint, options_key) in submitted:
+            result = submitted[(fingerprint, options_key)]
+        else:
+            result = pool.apply_async(book.messages.values(),
+                                      search_options)
+            if submitted is not None and fingerprint is not None:
+                submitted[(fingerprint, options_key)] = result
+        pending.append( (fingerprint, skeleton, result) )
+    return pending
+
+
+def collect_plans(allmessages, pending, pool, plan_cache=None):
+    """
+    waits for the plans of the books that were sent to a pool of planning 
+    processes by ``submit_books`` (cf. ``PlanningPool.wait``).
+
+    :type allmessages: ``AllMessages``
+    :param pending: the return value of ``submit_books``
+    :type pending: ``list`` of ``tuple``s
+    :param pool: the pool that plans the books
+    :type pool: ``PlanningPool``
+    :param plan_cache: stores the skeletons of all newly planned books 
+    (whose search wasn't cut short)
+    :type plan_cache: ``TextPlanCache`` or ``NoneType``
+
+    :rtype: ``list`` of ``tuple``s
+    :return: a (plan, planning time, exhaustive) tuple for each book (cf. 
+    ``plan_books``)
+    """
+    if plan_cache is not None and not plan_cache.accepts(pool.rules):
+        plan_cache = None
+    pool.wait([result for (fingerprint, skeleton, result) in pending
+               if result is not None])
+    timed_plans = []
+    for book, (fingerprint, skeleton, result) in \
+            zip(allmessages.books, pending):
+        if result is None: # cached skeleton
+            time_diff, exhaustive = 0.0, True
+        else:
+            planned = result.get()
+            if planned is None: # timed out
+                timed_plans.append( (None, None, None) )
+                continue
+            skeleton, time_diff, exhaustive = planned
+            if plan_cache is not None and fingerprint is not None and \
+               exhaustive:
+                plan_cache.put(fingerprint, skeleton)
+
+        # the plan is rebuilt from the original messages, since unpickled
+        # copies of them wouldn't necessarily list their values (frozensets)
+        # in the same order
+        if skeleton is None:
+            timed_plans.append( (None, time_diff, exhaustive) )
+        else:
+            messages = freeze_all_messages(book.messages.values())
+            children = fill_skeleton(skeleton, messages)
+            plan = TextPlan(book_score=book.book_score, text='',
+                            children=children)
+            timed_plans.append( (plan, time_diff, exhaustive) )
+    return timed_plans
+
+
+def _planning_worker(conn, rules):
+    """
+    runs a planning process of a ``PlanningPool``, which receives the 
+    (messages, search options) of one book after another and sends back 
+    (True, the return value of ``__plan_book``) or (False, the exception it 
+    raised).
+
+    :type conn: ``multiprocessing.Connection``
+    :type rules: ``list`` of ``Rule``s
+    """
+    global WORKER_RULES, WORKER_MEMO
+    WORKER_RULES = rules
+    WORKER_MEMO = LRUCache(maxsize=MEMO_SIZE)
+    while True:
+        try:
+            messages, search_options = conn.recv()
+        except EOFError: # the pool was stopped
+            return
+        try:
+            result = (True, __plan_book(messages, search_options))
+        except Exception, err:
+            result = (False, err)
+        conn.send(result)
+
+
+def __plan_book(messages, search_options):
+    """
+    PlanningPool helper function that generates the ``TextPlan`` of one book 
+    in a planning process.
+
+    :type messages: ``list`` of ``Message``s
+    :type search_options: ``dict``
+    :rtype: ``tuple`` of (``tuple`` or ``NoneType``, ``float``, ``bool``)
+    :return: the skeleton of the text plan (cf. ``textplan_skeleton``) or 
+    None (if no plan could be found), the time it took to plan the book 
+    and whether the search was exhaustive
+    """
+    before = time()
+    report = {}
+    plan = generate_textplan(messages, WORKER_RULES, memo=WORKER_MEMO,
+                             report=report, **search_options)
+    if plan is None:
+        skeleton = None
+    else:
+        skeleton = textplan_skeleton(plan["children"])
+    return skeleton, time() - before, report['exhaustive']
+
+
+def textplan_skeleton(tree):
+    """
+    returns the skeleton of a text plan, i.e. its RST relations and message 
+    types, but not the content of its messages. A ``ConstituentSet`` is 
+    represented as a (relation type, nucleus, satellite) tuple, a 
+    ``Message`` by its message type, e.g.::
+
+        ('Sequence', ('Elaboration', 'id', 'usermodel_match'), 'extra')
+
+    :type tree: ``ConstituentSet`` or ``Message``
+    :rtype: ``tuple`` or ``str``
+    """
+    if isinstance(tree, ConstituentSet):
+        return (tree[Feature("relType")],
+                textplan_skeleton(tree[Feature("nucleus")]),
+                textplan_skeleton(tree[Feature("satellite")]))
+    else:
+        return tree[Feature("msgType")]
+
+
+def message_fingerprint(messages):
+    """
+    calculates a fingerprint of the 'shape' of a book's messages, i.e. of 
+    their message types and the names of their attributes (but not their 
+    values). As long as the rule conditions only look at the message types 
+    and the lengths of the messages (cf. ``rules.check_condition``), rules 
+    can only 'see' this shape, so messages with the same fingerprint will be 
+    combined into text plans with the same skeleton. Plans of other rules 
+    aren't cached (cf. ``rules_cache_key``).
+
+    :type messages: ``list`` or ``set`` of ``Message``s
+    :rtype: ``str`` or ``NoneType``
+    :return: a hex digest or None, if the messages don't have distinct 
+    message types (their plan skeletons couldn't be filled unambiguously)
+    """
+    shapes = []
+    for message in messages:
+        if not isinstance(message, Message):
+            return None
+        attributes = sorted(str(key) for key in message.keys()
+                            if key != Feature("msgType"))
+        shapes.append( (message[Feature("msgType")], tuple(attributes)) )
+
+    message_types = [msg_type for (msg_type, attributes) in shapes]
+    if len(set(message_types)) != len(message_types):
+        return None
+    return hashlib.sha1(repr(sorted(shapes))).hexdigest()
+
+
+def plan_cache_key(fingerprint, rules_digest, search_options=None):
+    """
+    returns the key under which the skeleton of a plan is stored in a 
+    ``TextPlanCache``, i.e. the digest of the rules and the fingerprint of 
+    the messages. Different search strategies may find different plans 
+    for the same messages, so the strategy is added to the key of all 
+    plans not found by the default strategy. Only plans found by an 
+    exhaustive search are cached (cf. ``generate_textplan``), so the other 
+    settings of a strategy don't matter.
+
+    :param fingerprint: the fingerprint of the messages (cf. 
+    ``message_fingerprint``)
+    :type fingerprint: ``str`` or ``NoneType``
+    :param rules_digest: the digest of the rules (cf. ``rules_cache_key``)
+    :type rules_digest: ``str`` or ``NoneType``
+    :param search_options: keyword arguments of ``generate_textplan``
+    :type search_options: ``dict`` or ``NoneType``
+    :rtype: ``str`` or ``NoneType``
+    :return: the key or None, if the plan can't be cached
+    """
+    if fingerprint is None or rules_digest is None:
+        return None
+    key = "{0}:{1}".format(rules_digest, fingerprint)
+    if not search_options:
+        return key
+    strategy = search_options.get('strategy', DEFAULT_STRATEGY)
+    if strategy == DEFAULT_STRATEGY:
+        return key
+    return "{0}:{1}".format(key, strategy)
+
+
+def fill_skeleton(skeleton, messages):
+    """
+    turns the skeleton of a text plan (cf. ``textplan_skeleton``) back into 
+    a tree of frozen ``ConstituentSet``s, using the ``Message``s of a book.
+
+    :type skeleton: ``tuple`` or ``str``
+    :param messages: the messages of a book (with distinct message types)
+    :type messages: ``list`` of ``Message``s
+    :rtype: ``ConstituentSet`` or ``Message``
+    """
+    messages_by_type = dict((message[Feature("msgType")], message)
+                            for message in messages)
+    return __fill_skeleton(skeleton, messages_by_type)
+
+
+def __fill_skeleton(skeleton, messages_by_type):
+    """
+    recursive helper function for fill_skeleton()
+
+    :type skeleton: ``tuple`` or ``str``
+    :type messages_by_type: ``dict`` of (``str``, ``Message``)
+    :rtype: ``ConstituentSet`` or ``Message``
+    """
+    if isinstance(skeleton, tuple):
+        reltype, nucleus, satellite = skeleton
+        constituent_set = ConstituentSet(relType=reltype,
+            nucleus=__fill_skeleton(nucleus, messages_by_type),
+            satellite=__fill_skeleton(satellite, messages_by_type))
+        constituent_set.freeze()
+        return constituent_set
+    else:
+        return messages_by_type[skeleton]
+
 
 def generate_textplan(messages, rules=Rules().rules, book_score = None, 
-                      dtype = 'TextPlan', text = ''):
+                      dtype = 'TextPlan', text = '', memo=None,
+                      plan_cache=None, strategy=DEFAULT_STRATEGY,
+                      beam_width=BEAM_WIDTH, node_budget=None,
+                      time_budget=None, report=None, plan_table=None):
     """
     The main method implementing the Bottom-Up document structuring algorithm 
     from "Building Natural Language Generation Systems" figure 4.17, p. 108.
@@ -106,6 +912,18 @@ def generate_textplan(messages, rules=Rules().rules, book_score = None,
 
     If no plan is reached using bottom-up, ``None`` is returned.
 
+    With ``strategy='beam'``, a beam search is used instead (cf. 
+    ``__beam_search``), which looks for the plan with the highest sum of 
+    rule heuristics, but only keeps the ``beam_width`` best partial plans in 
+    each step. Its search can also be limited by a ``node_budget`` and/or a 
+    ``time_budget``. If the search is cut short, its best partial plan is 
+    completed by the best-first search, but there might be better plans.
+
+    With ``strategy='dp'``, the plan with the highest sum of rule heuristics 
+    is found by a dynamic program over subsets of the messages (cf. 
+    ``__dp_search``), whose planning time only depends on the number of 
+    messages.
+
     :param messages: a list of ``Message``s which have been selected during 
     content selection for inclusion in the TextPlan
     :type messages: list of ``Message``s
@@ -116,9 +934,47 @@ def generate_textplan(messages, rules=Rules().rules, book_score = None,
     :type dtype: string
     :param text: an optional text string describing the document
     :type text: string
+    :param memo: a cache of search states that were already explored (with 
+    the same ``rules``). if None, a new one will be used for this plan.
+    :type memo: ``LRUCache`` or ``NoneType``
+    :param plan_cache: a cache of text plan skeletons. if the messages' 
+    fingerprint is cached, no search is needed. if None (or if the cache 
+    belongs to other ``rules``), no cache is used.
+    :type plan_cache: ``TextPlanCache`` or ``NoneType``
+    :param strategy: the search strategy, one of ``STRATEGIES``
+    :type strategy: ``str``
+    :param beam_width: the number of partial plans kept in each step of the 
+    beam search. if None, no partial plan is dropped.
+    :type beam_width: ``int`` or ``NoneType``
+    :param node_budget: the maximum number of search states that the beam 
+    search may create. if None, there is no limit.
+    :type node_budget: ``int`` or ``NoneType``
+    :param time_budget: the maximum number of seconds the beam search may 
+    take (before its best partial plan is completed). if None, there is no 
+    limit.
+    :type time_budget: ``float`` or ``NoneType``
+    :param report: if given, this dict is updated with the ``strategy`` 
+    used, whether the search was ``exhaustive`` (i.e. wasn't cut short by 
+    the beam width or a budget), the number of search ``nodes`` created by 
+    the beam search (or of chart cells filled by the dynamic program), the 
+    ``score`` of the plan (i.e. the sum of its rule heuristics, if known) 
+    and whether the plan was ``cached`` (or taken from the plan table).
+    :type report: ``dict`` or ``NoneType``
+    :param plan_table: a decision table of text plan skeletons (compiled 
+    for the same ``rules`` and ``strategy``, cf. ``plantable``). if the 
+    signature of the messages is in the table, no search is needed. if 
+    None, no table is used.
+    :type plan_table: ``PlanTable`` or ``NoneType``
     :return: a document plan. if no plan could be created: return None
     :rtype: ``TextPlan`` or ``NoneType``
     """
+    if strategy not in STRATEGIES:
+        raise ValueError("unknown search strategy: {0}".format(strategy))
+    if report is None:
+        report = {}
+    report.update(strategy=strategy, exhaustive=True, nodes=None,
+                  score=None, cached=False)
+
     if isinstance(messages, list):
         frozen_messages = freeze_all_messages(messages)
     elif isinstance(messages, Messages):
@@ -126,72 +982,514 @@ def generate_textplan(messages, rules=Rules().rules, book_score = None,
         message_list = msgs_instance_to_list_of_msgs(messages)
         frozen_messages = freeze_all_messages(message_list)
         
+    if memo is None:
+        memo = LRUCache(maxsize=MEMO_SIZE)
+
     messages_set = set(frozen_messages) # remove duplicate messages    
-    ret = __bottom_up_search(messages_set, rules)
 
-    if ret: # if __bottom_up_search has found a valid plan ...
-        children =  ret.pop() 
+    fingerprint = None
+    if plan_cache is not None and plan_cache.accepts(rules):
+        fingerprint = plan_cache_key(message_fingerprint(messages_set),
+                                     plan_cache.rules_digest,
+                                     {'strategy': strategy})
+    skeleton = _NOT_CACHED
+    if plan_table is not None and plan_table.strategy == strategy:
+        skeleton = plan_table.get(messages_set)
+    if skeleton is _NOT_CACHED and fingerprint is not None:
+        skeleton = plan_cache.get(fingerprint)
+    if skeleton is not _NOT_CACHED:
+        report['cached'] = True
+        if skeleton is None: # these messages can't be planned
+            return None
+        return TextPlan(book_score=book_score, dtype=dtype, text=text,
+                        children=fill_skeleton(skeleton, messages_set))
+
+    # the search runs on planner records (cf. ``planrecords``), which are
+    # built in the same order as ``messages_set`` (sets of records are
+    # iterated in the same order as sets of the messages they represent)
+    records = set([PlanMessage(message) for message in frozen_messages])
+    if strategy == 'beam':
+        ret, exhaustive, nodes, score = __beam_search(Agenda(records, rules),
+                                                      memo, beam_width,
+                                                      node_budget,
+                                                      time_budget)
+        report.update(exhaustive=exhaustive, nodes=nodes, score=score)
+        if not exhaustive: # a better plan might exist, so don't cache it
+            fingerprint = None
+    elif strategy == 'dp':
+        ret, nodes, score = __dp_search(records, rules)
+        report.update(nodes=nodes, score=score)
+    else:
+        ret = __bottom_up_search(Agenda(records, rules), memo)
+
+    if ret: # if the search has found a valid plan ...
+        children =  ret.pop().to_featstruct()
         # pop returns an 'arbitrary' set element (there's only one)
+        if fingerprint is not None:
+            plan_cache.put(fingerprint, textplan_skeleton(children))
         return TextPlan(book_score=book_score, dtype=dtype, 
                         text=text, children=children)
     else:
+        if fingerprint is not None:
+            plan_cache.put(fingerprint, None)
         return None
 
-def __bottom_up_search(messages, rules):
+def __bottom_up_search(agenda, memo):
     """generate_text() helper method which performs recursive best-first-search
 
-    :param messages: a set containing ``Message``s and/or ``ConstituentSet``s
-    :type messages: ``set`` of ``Message``s or ``ConstituentSet``s
-    
-    :param rules: a list of ``Rule``s specifying relationships which can hold 
-    between the messages
-    :type rules: ``list`` of ``Rule``s
+    Each search state (i.e. a set of ``Message``s and ``ConstituentSet``s) is 
+    stored in ``memo`` together with its result, so that dead ends (and 
+    already solved states) reached via a different sequence of rule 
+    applications won't be explored again.
+
+    :param agenda: the search state, i.e. a set containing ``Message``s 
+    and/or ``ConstituentSet``s and all the ways in which ``Rule``s could 
+    combine them
+    :type agenda: ``Agenda``
+
+    :param memo: maps frozen search states to their result (a frozenset 
+    containing the plan or None, if the state is a dead end)
+    :type memo: ``LRUCache``
         
     :return: a set containing one ``Message``, i.e. the first valid plan reached
     by best-first-search. returns None if no valid plan is found.
     :rtype: ``NoneType`` or a ``set`` of (``Message``s or ``ConstituentSet``s)
     """
+    messages = agenda.messages
     if len(messages) == 1:
         return messages
     elif len(messages) < 1:
         raise Exception('Error: Input contains no messages.')
-    else:
-        try:
-            options = [rule.get_options(messages) for rule in rules]
-        except:
-            raise Exception('ERROR: Rule {0} had trouble with these ' \
-                            'messages: {1}'.format(rule, messages))
-            
-        options = flatten(options)
-        options_list = []
-        for x, y, z in options:
-            y.freeze()
-            options_list.append( (x, y, z) )
-            
-        if options_list == []:
+
+    state = frozenset(messages)
+    known_result = memo.get(state, _NOT_CACHED)
+    if known_result is not _NOT_CACHED:
+        if known_result is None: # dead end
             return None
+        return set(known_result)
+
+    ret = __search_options(agenda, memo)
+    if ret:
+        memo.put(state, frozenset(ret))
+    else:
+        memo.put(state, None)
+    return ret
+
 
-        #sort all options by their score, beginning with the highest one
-        sorted_options = sorted(options_list, key = lambda (x,y,z): x, 
-                                reverse=True) 
-                                
-        for (score, rst_relation, removes) in sorted_options:
-            """
-            rst_relation: a ConstituentSet (RST relation) that was generated by
-                Rule.get_options()
-            removes: a list containing those messages that are now part of 
-                'rst_relation' and should therefore not be used again
-            """
-            testSet = messages - set(removes)
-            testSet = testSet.union(set([rst_relation]))
-            # a set containing a ConstituentSet and one or more Messages that 
-            # haven't been integrated into a structure yet
-
-            ret = __bottom_up_search(testSet, rules)
-            if ret:
-                return ret
+def __search_options(agenda, memo):
+    """
+    __bottom_up_search() helper method that recursively tries all the options
+    (i.e. rule applications) of a search state, best ones first.
+
+    :type agenda: ``Agenda``
+    :type memo: ``LRUCache``
+    :rtype: ``NoneType`` or a ``set`` of (``Message``s or ``ConstituentSet``s)
+    """
+    options_list = agenda.get_options()
+    if options_list == []:
         return None
 
+    #sort all options by their score, beginning with the highest one
+    sorted_options = sorted(options_list, key = lambda (x,y,z): x, 
+                            reverse=True) 
+                            
+    for (score, rst_relation, removes) in sorted_options:
+        """
+        rst_relation: a PlanConstituent (RST relation) that was generated
+            by Agenda.get_options()
+        removes: a list containing those messages that are now part of 
+            'rst_relation' and should therefore not be used again
+        """
+        ret = __bottom_up_search(agenda.apply(removes, rst_relation), memo)
+        if ret:
+            return ret
+    return None
+
+
+def __beam_search(agenda, memo, beam_width, node_budget=None,
+                  time_budget=None):
+    """
+    generate_textplan() helper method which performs a beam search.
+
+    Each rule application combines two constituents, so all the search 
+    states in one step of the search have the same size. In each step, all 
+    options (i.e. rule applications) of the states in the beam are scored by 
+    the sum of the heuristics of the rules applied so far. Only the 
+    ``beam_width`` best resulting states are kept (if several options lead 
+    to the same state, only the best one counts). Ties are broken by the 
+    rank of the state the option was found in and by the order of the 
+    options (cf. ``Agenda.get_options``), so the search is deterministic.
+
+    If no state was dropped, the search is exhaustive and finds the plan 
+    with the highest sum of heuristics. If the ``node_budget`` or the 
+    ``time_budget`` is used up, the states of the beam are completed by the 
+    best-first search (best ones first, cf. ``__bottom_up_search``). If all 
+    states of the beam turn out to be dead ends, the best-first search 
+    starts over from ``agenda``, so a plan is found whenever one exists.
+
+    :param agenda: the initial search state
+    :type agenda: ``Agenda``
+    :param memo: the search state memo of the best-first search
+    :type memo: ``LRUCache``
+    :param beam_width: max. number of states kept in each step. if None, all 
+    states are kept.
+    :type beam_width: ``int`` or ``NoneType``
+    :param node_budget: max. number of search states to create
+    :type node_budget: ``int`` or ``NoneType``
+    :param time_budget: max. number of seconds to search
+    :type time_budget: ``float`` or ``NoneType``
+
+    :rtype: ``tuple`` of (``set`` or ``NoneType``, ``bool``, ``int``, 
+    ``int`` or ``NoneType``)
+    :return: a set containing the plan (or None, if no plan was found), 
+    whether the search was exhaustive, the number of states created and 
+    the score of the plan (None, if it was completed by the best-first 
+    search)
+    """
+    if len(agenda.messages) == 1:
+        return set(agenda.messages), True, 0, 0
+    elif len(agenda.messages) < 1:
+        raise Exception('Error: Input contains no messages.')
+
+    deadline = None
+    if time_budget is not None:
+        deadline = time() + time_budget
+
+    beam = [(0, agenda)]
+    nodes = 0
+    exhaustive = True
+    while True:
+        candidates = []
+        for rank, (score, state) in enumerate(beam):
+            for index, (heuristic, constituent_set, removes) in \
+                    enumerate(state.get_options()):
+                candidates.append( (score + heuristic, rank, index, state,
+                                    constituent_set, removes) )
+        if not candidates:
+            break
+        candidates.sort(key=lambda candidate: (-candidate[0], candidate[1],
+                                               candidate[2]))
+
+        next_beam = []
+        successors = set()
+        out_of_budget = False
+        for (score, rank, index, state, constituent_set, removes) in \
+                candidates:
+            successor = state.messages.difference(removes)
+            successor = frozenset(successor.union([constituent_set]))
+            if successor in successors:
+                continue
+            if beam_width is not None and len(next_beam) == beam_width:
+                exhaustive = False
+                break
+            if (node_budget is not None and nodes >= node_budget) or \
+               (deadline is not None and time() > deadline):
+                exhaustive = False
+                out_of_budget = True
+                break
+            successors.add(successor)
+            next_beam.append( (score, state.apply(removes, constituent_set)) )
+            nodes += 1
+
+        if out_of_budget:
+            for score, state in next_beam or beam:
+                ret = __bottom_up_search(state, memo)
+                if ret:
+                    return ret, exhaustive, nodes, None
+            break
+        if len(next_beam[0][1].messages) == 1:
+            # all states in the beam are complete plans, the first is best
+            score = next_beam[0][0]
+            return set(next_beam[0][1].messages), exhaustive, nodes, score
+        beam = next_beam
+
+    if exhaustive: # there is no plan
+        return None, exhaustive, nodes, None
+    # all the states that were kept are dead ends
+    return __bottom_up_search(agenda, memo), exhaustive, nodes, None
+
+
+def __dp_search(records, rules):
+    """
+    generate_textplan() helper method which finds the plan with the highest 
+    sum of rule heuristics by a CKY-like dynamic program over subsets of the 
+    messages.
+
+    ``Rule`` conditions are evaluated in the namespace of the messages that 
+    haven't been combined, yet (cf. ``Agenda.get_options``), i.e. whether a 
+    rule can be applied depends on the order of the rule applications. The 
+    dynamic program only considers plans whose subtrees are built one after 
+    the other (i.e. the rule applications of a subtree aren't interleaved 
+    with those of its sibling). A chart cell ``(subset, outside)`` holds the 
+    best plans for a subset of the messages that can be built while the 
+    ``outside`` messages (which aren't part of the subset) are still 
+    uncombined. If the nucleus subset of a rule application is built first, 
+    the satellite messages are still uncombined while it is built, but only 
+    a single nucleus message is still uncombined while the satellite 
+    subset is built (and vice versa).
+
+    Since a rule may only accept some of the plans of a subset as its nucleus 
+    or satellite, each cell keeps the best plan for each distinct way the 
+    rules can use a plan (cf. ``__rule_signature``). Ties are broken by the 
+    order in which plans are found (subsets in the order of their message 
+    types, then rules in the order of ``rules``), so the result is 
+    deterministic.
+
+    :param records: the ``PlanMessage``s of a book
+    :type records: ``set`` of ``PlanMessage``s
+    :type rules: ``list`` of ``Rule``s
+
+    :rtype: ``tuple`` of (``set`` or ``NoneType``, ``int``, ``int`` or 
+    ``NoneType``)
+    :return: a set containing the plan (or None, if no plan was found), the 
+    number of chart cells filled and the score of the plan
+    """
+    if len(records) < 1:
+        raise Exception('Error: Input contains no messages.')
+    leaves = sorted(records, key=lambda record: (record.msg_type,
+                                                 hash(record)))
+    full = (1 << len(leaves)) - 1
+    chart = {}
+    signatures = {} # plan -> its rule signature
+    conditions = {}
+
+    def conditions_hold(rule_index, uncombined):
+        key = (rule_index, uncombined)
+        if key not in conditions:
+            namespace = dict((leaf.msg_type, leaf.message)
+                             for position, leaf in enumerate(leaves)
+                             if uncombined & (1 << position))
+            conditions[key] = rules[rule_index].conditions_hold(namespace)
+        return conditions[key]
+
+    def single(subset):
+        # a subset of one message stays uncombined until it is used
+        return subset if subset & (subset - 1) == 0 else 0
+
+    def fill(subset, outside):
+        cell = chart.get( (subset, outside) )
+        if cell is not None:
+            return cell
+
+        if single(subset):
+            leaf = leaves[subset.bit_length() - 1]
+            key = signatures.get(leaf)
+            if key is None:
+                key = __rule_signature(leaf, rules)
+                signatures[leaf] = key
+            cell = [(0, leaf, key)]
+        else:
+            best = OrderedDict() # signature -> (score, plan, signature)
+            nucleus_subset = (subset - 1) & subset
+            while nucleus_subset:
+                satellite_subset = subset & ~nucleus_subset
+                uncombined = outside | single(nucleus_subset) | \
+                             single(satellite_subset)
+                for nucleus_outside, satellite_outside in (
+                        (outside | satellite_subset,
+                         outside | single(nucleus_subset)),
+                        (outside | single(satellite_subset),
+                         outside | nucleus_subset)):
+                    nuclei = chart.get( (nucleus_subset, nucleus_outside) )
+                    if nuclei is None:
+                        nuclei = fill(nucleus_subset, nucleus_outside)
+                    if not nuclei:
+                        continue
+                    satellites = chart.get( (satellite_subset,
+                                             satellite_outside) )
+                    if satellites is None:
+                        satellites = fill(satellite_subset,
+                                          satellite_outside)
+                    for nucleus_score, nucleus, (nucleus_rules, _) in nuclei:
+                        for satellite_score, satellite, (_, satellite_rules) \
+                                in satellites:
+                            rule_mask = nucleus_rules & satellite_rules
+                            rule_index = 0
+                            while rule_mask:
+                                if rule_mask & 1 and \
+                                   conditions_hold(rule_index, uncombined):
+                                    rule = rules[rule_index]
+                                    plan = PlanConstituent(rule.ruleType,
+                                                           nucleus, satellite)
+                                    score = nucleus_score + \
+                                            satellite_score + rule.heuristic
+                                    key = signatures.get(plan)
+                                    if key is None:
+                                        key = __rule_signature(plan, rules)
+                                        signatures[plan] = key
+                                    if key not in best or \
+                                       score > best[key][0]:
+                                        best[key] = (score, plan, key)
+                                rule_mask >>= 1
+                                rule_index += 1
+                nucleus_subset = (nucleus_subset - 1) & subset
+            cell = best.values()
+        chart[(subset, outside)] = cell
+        return cell
+
+    plans = fill(full, 0)
+    if not plans:
+        return None, len(chart), None
+    score, plan, key = plans[0]
+    for other_score, other_plan, key in plans[1:]:
+        if other_score > score:
+            score, plan = other_score, other_plan
+    return set([plan]), len(chart), score
+
+
+def __rule_signature(record, rules):
+    """
+    __dp_search() helper method that describes how the ``rules`` can use a 
+    plan, i.e. which rules accept it as their nucleus and which rules accept 
+    it as their satellite. Plans with the same signature are interchangeable 
+    in the dynamic program.
+
+    :type record: ``PlanMessage`` or ``PlanConstituent``
+    :type rules: ``list`` of ``Rule``s
+    :rtype: ``tuple`` of two ``int``s
+    :return: two bit masks, where bit i is set if ``rules[i]`` accepts the 
+    plan as its nucleus (or satellite, respectively)
+    """
+    index = index_records([record])
+    nucleus_mask = satellite_mask = 0
+    for rule_index, rule in enumerate(rules):
+        nuclei, satellites = rule.find_candidates(index)
+        if nuclei:
+            nucleus_mask |= 1 << rule_index
+        if satellites:
+            satellite_mask |= 1 << rule_index
+    return nucleus_mask, satellite_mask
+
+
+class Agenda(object):
+    """
+    An ``Agenda`` represents one state of the bottom-up search, i.e. a set of 
+    ``PlanMessage``s and ``PlanConstituent``s (the planner records of 
+    ``Message``s and ``ConstituentSet``s, cf. ``planrecords``), together with 
+    all (nucleus, satellite) pairs that each ``Rule`` could combine (similar 
+    to the agenda of a chart parser).
+
+    Applying a rule only removes two constituents from the search state and 
+    adds a new ``ConstituentSet``. Therefore, the agenda of the resulting 
+    state is derived from the current one: pairs that use one of the removed 
+    constituents are dropped, and only pairs involving the new 
+    ``ConstituentSet`` need to be looked for. Rule conditions depend on the 
+    whole search state, so they are checked whenever the options of a state 
+    are requested.
+    """
+    def __init__(self, messages, rules, candidates=None, pairs=None):
+        """
+        :param messages: a set containing ``PlanMessage``s and/or 
+        ``PlanConstituent``s
+        :type messages: ``set`` of ``PlanMessage``s or ``PlanConstituent``s
+
+        :param rules: a list of ``Rule``s specifying relationships which can 
+        hold between the messages
+        :type rules: ``list`` of ``Rule``s
+
+        :param candidates: for each rule, a tuple of its nucleus and 
+        satellite candidates (cf. ``Rule.find_candidates``). will be 
+        calculated from ``messages`` if None.
+        :type candidates: ``list`` of ``tuple``s of two ``list``s
+
+        :param pairs: for each rule, a list of all (nucleus candidate, 
+        satellite candidate) pairs. will be calculated from ``candidates`` 
+        if None.
+        :type pairs: ``list`` of ``list``s of ``tuple``s
+        """
+        self.messages = messages
+        self.rules = rules
+
+        if candidates is None:
+            index = index_records(messages)
+            candidates = [rule.find_candidates(index) for rule in rules]
+        self.candidates = candidates
+
+        if pairs is None:
+            pairs = [list(itertools.product(nuclei, satellites))
+                     for (nuclei, satellites) in candidates]
+        self.pairs = pairs
+
+    def get_options(self):
+        """
+        returns all rule applications that are possible in this search 
+        state, i.e. the (nucleus, satellite) pairs of all rules whose 
+        conditions are met.
+
+        Options are ordered just like a sequence of ``Rule.get_options`` calls 
+        would order them: by rule, then by the position of the nucleus and 
+        satellite prototypes the pair matches and finally by the order in 
+        which the constituents are stored in ``self.messages``.
+
+        :rtype: ``list`` of ``tuple``s of (``int``, ``PlanConstituent``, 
+        ``list``), cf. ``Rule.get_option``
+        """
+        namespace = record_namespace(self.messages)
+        order = dict((message, position)
+                     for (position, message) in enumerate(self.messages))
+        def pair_position(((nuc_pos, nuc_name, nucleus),
+                           (sat_pos, sat_name, satellite))):
+            return (nuc_pos, order[nucleus], sat_pos, order[satellite])
+
+        options = []
+        for rule, pairs in zip(self.rules, self.pairs):
+            if not pairs:
+                continue
+            try:
+                if not rule.conditions_hold(namespace):
+                    continue
+            except:
+                raise Exception('ERROR: Rule {0} had trouble with these ' \
+                                'messages: {1}'.format(rule, self.messages))
+            for (nuc_pos, nuc_name, nucleus), (sat_pos, sat_name, satellite) \
+                    in sorted(pairs, key=pair_position):
+                constituent_set = PlanConstituent(rule.ruleType, nucleus,
+                                                  satellite)
+                options.append( (rule.heuristic, constituent_set,
+                                 [nucleus, satellite]) )
+        return options
+
+    def apply(self, removes, constituent_set):
+        """
+        returns the search state that results from combining ``removes`` into 
+        ``constituent_set``. This agenda remains unchanged.
+
+        :param removes: the inputs of a rule application, which are now part 
+        of ``constituent_set``
+        :type removes: ``list`` of ``PlanMessage``s or ``PlanConstituent``s
+        :type constituent_set: ``PlanConstituent``
+        :rtype: ``Agenda``
+        """
+        removed = set(removes)
+        messages = self.messages - removed
+        messages = messages.union(set([constituent_set]))
+        # a set containing a ConstituentSet and one or more Messages that 
+        # haven't been integrated into a structure yet
+
+        def is_kept(candidate):
+            return candidate[2] not in removed
+        new_index = index_records([constituent_set])
+
+        candidates = []
+        pairs = []
+        for rule, (nuclei, satellites), rule_pairs in \
+                zip(self.rules, self.candidates, self.pairs):
+            new_nuclei, new_satellites = rule.find_candidates(new_index)
+            nuclei = filter(is_kept, nuclei)
+            satellites = filter(is_kept, satellites)
+
+            rule_pairs = [(nucleus, satellite)
+                          for (nucleus, satellite) in rule_pairs
+                          if is_kept(nucleus) and is_kept(satellite)]
+            rule_pairs.extend(itertools.product(new_nuclei,
+                                                satellites + new_satellites))
+            rule_pairs.extend(itertools.product(nuclei, new_satellites))
+
+            candidates.append( (nuclei + new_nuclei,
+                                satellites + new_satellites) )
+            pairs.append(rule_pairs)
+        return Agenda(messages, self.rules, candidates, pairs)
+
 
 def linearize_textplan(textplan):
     """
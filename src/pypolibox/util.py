@@ -9,9 +9,12 @@ There shouldn't be any code in this module that require loading other
 modules from pypolibox!
 """
 
+import bisect
+import math
 import os
 import re
 import cPickle as pickle
+from collections import OrderedDict
 import yaml
 from nltk.featstruct import Feature
 
@@ -144,3 +147,140 @@ def exists(thing, namespace):
         return True
     else:
         return False
+
+
+class LRUCache(object):
+    """
+    a size-bounded key/value store that evicts its least recently used entry
+    once ``maxsize`` entries are stored. The cache counts how often a lookup
+    succeeded (``hits``) or failed (``misses``).
+
+    :type maxsize: ``int``
+    :param maxsize: the maximum number of entries to keep. if None, the cache
+    grows without bounds.
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        returns the value stored under ``key`` (marking it as recently used)
+        or ``default``, if the key isn't cached.
+        """
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        stores a value under the given key and evicts the least recently
+        used entries if the cache is full.
+        """
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        if self.maxsize is not None:
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """removes all entries and resets the hit/miss counters"""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        :rtype: ``dict``
+        :return: the number of cache hits, misses and stored entries
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def __str__(self):
+        return "{0} hits, {1} misses, {2}/{3} entries".format(self.hits,
+            self.misses, len(self._entries), self.maxsize)
+
+
+class LatencyHistogram(object):
+    """
+    records how long an operation took (e.g. the realization of a sentence)
+    and reports percentiles and a histogram of these latencies.
+    """
+    # upper bounds of the histogram buckets (in seconds)
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.latencies = []
+
+    def add(self, seconds):
+        """records the duration of one operation"""
+        self.latencies.append(seconds)
+
+    def __len__(self):
+        return len(self.latencies)
+
+    def percentile(self, percent):
+        """
+        :param percent: a number between 0 and 100, e.g. 50 for the median
+        :type percent: ``int`` or ``float``
+        :rtype: ``float`` or ``None``
+        :return: the smallest recorded latency that is at least as large as
+        ``percent`` percent of all recorded latencies (nearest-rank method).
+        None, if nothing was recorded yet.
+        """
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        rank = int(math.ceil(percent / 100.0 * len(latencies)))
+        return latencies[max(rank, 1) - 1]
+
+    def histogram(self):
+        """
+        :rtype: ``list`` of (``float``, ``int``) tuples
+        :return: the upper bound of each bucket and the number of latencies
+        that fall into it. The last bucket (upper bound: None) contains all
+        latencies above the largest bound in ``BUCKETS``.
+        """
+        counts = [0] * (len(self.BUCKETS) + 1)
+        for latency in self.latencies:
+            counts[bisect.bisect_left(self.BUCKETS, latency)] += 1
+        return zip(self.BUCKETS + (None,), counts)
+
+    def stats(self):
+        """
+        :rtype: ``dict``
+        :return: the number of recorded latencies, their median (p50),
+        99th percentile (p99) and maximum
+        """
+        return {'count': len(self.latencies), 'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': max(self.latencies) if self.latencies else None}
+
+    def __str__(self):
+        if not self.latencies:
+            return "no latencies recorded"
+        lines = ["{count} latencies, p50: {p50:.3f}s, p99: {p99:.3f}s, " \
+                 "max: {max:.3f}s".format(**self.stats())]
+        lower_bound = 0.0
+        for upper_bound, count in self.histogram():
+            if upper_bound is None:
+                bucket = "> {0}s".format(lower_bound)
+            else:
+                bucket = "{0}-{1}s".format(lower_bound, upper_bound)
+                lower_bound = upper_bound
+            lines.append("{0:>12}: {1}".format(bucket, count))
+        return "\n".join(lines)